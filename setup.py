@@ -13,8 +13,13 @@ setup(
     zip_safe=False,
     install_requires=[
         'requests',
+        'aiohttp',
         'click',
         'customtkinter',
         'chinesecalendar'
-    ]
+    ],
+    entry_points={
+        'console_scripts': ['subway = subway.cli:command'],
+        'pytest11': ['subway-stand-in = subway.plugin']
+    }
 )
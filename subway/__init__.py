@@ -1,17 +1,59 @@
 # _author: Coke
 # _date: 2023/3/16 15:47
 
-from . import (
-    logger,
-    discard,
-    message,
-    metro,
-    utils
+import importlib
+
+# 子模块及对外导出的对象均在第一次访问时才导入, 命令行及工作进程只会导入实际使用的模块
+_MODULES = (
+    'logger',
+    'discard',
+    'message',
+    'metro',
+    'utils',
+    'resolver',
+    'scheduler',
+    'calibration',
+    'burst',
+    'coalesce',
+    'record',
+    'server',
+    'shard',
+    'pool',
+    'config',
+    'watcher',
+    'tokens',
+    'dispatcher',
+    'outbox',
+    'trace',
+    'metrics',
+    'profiler',
+    'planner',
+    'preference',
+    'booking',
+    'cli'
 )
-from .main import (
-    command,
-    Subway,
-    TIME_FORMAT
+
+_ATTRIBUTES = dict(
+    command='main',
+    Subway='main',
+    TIME_FORMAT='main',
+    RewriteSubway='rewrite'
 )
 
-from .rewrite import RewriteSubway
+__all__ = list(_MODULES) + list(_ATTRIBUTES)
+
+
+def __getattr__(name: str):
+    if name in _MODULES:
+        return importlib.import_module(f'{__name__}.{name}')
+
+    if name in _ATTRIBUTES:
+        value = getattr(importlib.import_module(f'{__name__}.{_ATTRIBUTES[name]}'), name)
+        globals()[name] = value
+        return value
+
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -14,7 +14,7 @@ import os
 
 try:
     sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-    from subway import utils, RewriteSubway
+    from subway import utils, logger, RewriteSubway
 except ImportError as e:
     raise ImportError('请进入项目路径 subscribe-subway/subway 目录运行此脚本')
 
@@ -55,6 +55,8 @@ class APP(customtkinter.CTk):
         self.textbox.tag_config("warning", foreground="#E6A23C")
         self.textbox.tag_config("danger", foreground="#F56C6C")
         self.textbox.tag_config("info", foreground="#909399")
+        # 日志由 Tk 主循环按固定帧率批量写入, 并只保留最近的日志
+        self.sink = logger.TextboxSink(self.textbox)
 
     @staticmethod
     def disable_textbox(_):
@@ -75,7 +77,7 @@ class APP(customtkinter.CTk):
                     target=RewriteSubway(
                         subscribeTime=[12, 20],
                         dingTalk=bool(self.sidebar_frame.dingtalk_switch.get()),
-                        app=self.textbox,
+                        app=self.sink,
                         level=self.sidebar_frame.logger_select.get(),
                         confPath=os.path.abspath(
                             os.path.join(os.path.dirname(os.path.abspath(__file__)), 'conf', 'conf.json')
@@ -190,6 +192,7 @@ class ConfigWindow(customtkinter.CTkToplevel):
     WIDTH = 700
     HEIGHT = 450
     NAME = '配置文件'
+    USERS = 50  # 界面中最多添加的用户数量, 标签页过多时难以操作, 更多用户请直接编辑配置文件并使用 shard 引擎
 
     def __init__(self, master, *args, **kwargs):
         super().__init__(master, *args, **kwargs)
@@ -338,8 +341,8 @@ class ConfigWindow(customtkinter.CTkToplevel):
 
     def command_add_user(self):
         """ 添加用户的钩子 """
-        if len(self.config_tab.get_tab_list.keys()) >= 5:
-            tkinter.messagebox.showinfo('温馨提示', '最多添加五位用户~')
+        if len(self.config_tab.get_tab_list.keys()) >= self.USERS:
+            tkinter.messagebox.showinfo('温馨提示', f'最多添加 {self.USERS} 位用户~')
             return
 
         default = f'新用户 {self.user_index}'
@@ -373,13 +376,20 @@ class ConfigWindow(customtkinter.CTkToplevel):
             return
 
         # 将验证完成的数据写入 Json 文件中
+        # 保留界面中未展示的配置项, 如 burstPlan
         try:
+            with open(self.conf_path, 'r', encoding='utf-8') as file:
+                write_data = json.loads(file.read())
+        except (OSError, ValueError):
+            write_data = self.default_json
+
+        try:
+            write_data.update(
+                dingTalkToken=self.webhook_input.get(),
+                dingTalkSign=self.sign_input.get(),
+                userAgent=content
+            )
             with open(self.conf_path, 'w', encoding='utf-8') as file:
-                write_data = dict(
-                    dingTalkToken=self.webhook_input.get(),
-                    dingTalkSign=self.sign_input.get(),
-                    userAgent=content
-                )
                 file.write(json.dumps(write_data, indent=2, ensure_ascii=False))
         except PermissionError:
             tkinter.messagebox.showerror('温馨提示', f'请以管理员身份打开, 或将应用安装在C盘外')
@@ -567,7 +577,10 @@ class ConfigTabView(customtkinter.CTkTabview):
 
         line, station = tab.line_select.get().split('-')
 
+        # 保留用户在界面中未展示的配置项, 如 burstPlan
+        origin = next(filter(lambda x: x.get('name') == tab.username_input.get(), self.users), dict())
         return dict(
+            origin,
             lineName=line,
             stationName=station,
             timeSlot=self.time_interval.get(tab.time_select.get()),
@@ -0,0 +1,399 @@
+# _author: Coke
+# _date: 2023/10/9 20:25
+
+from typing import Generator, List, Optional, Tuple
+
+import asyncio
+import logging
+import time
+
+from subway import burst, coalesce, logger, metro, preference, profiler, scheduler, shard, trace
+
+# 流程产出的操作, 由 Runner 或 AsyncRunner 中的同名方法执行
+APPOINTMENT = 'appointment'  # (choice, timeout) -> bool
+PREPARE = 'prepare'  # (start, ) -> None
+WAIT = 'wait'  # (instant, ) -> None
+BALANCE = 'balance'  # (windows, ) -> dict
+BURST = 'burst'  # (instants, choice) -> Optional[float]
+
+Step = Tuple[str, tuple]
+
+GRACE = 60.0  # 抢票计划的最后一个请求之后等待任务完成的时间, 包括预检查、预热及最终断言
+WAVE_TIMEOUT = 10.0  # 每个波次的余票查询、预约查询可能超时的时间之和, 波次会因此晚于计划执行
+
+
+class Booking:
+    """
+    单个用户的抢票流程, 线程与协程两种抢票引擎共用
+    流程本身不执行任何 I/O, 只按顺序产出需要执行的操作, 由 run 或 run_async 通过对应的 Runner 执行并传回结果
+    """
+
+    def __init__(self, kwargs: dict):
+        """
+        :param kwargs: 参考 task, 流程使用的参数会从 kwargs 中移除, 剩余的内容作为抢票结果返回
+        """
+
+        self.kwargs = kwargs
+        self.start = kwargs.pop('startTime', 0)
+        line = kwargs.pop('lineName', '昌平线')
+        station = kwargs.pop('stationName', '沙河站')
+        time_slot = kwargs.pop('timeSlot', '0720-0730')
+        self.token = kwargs.pop('token', None)
+        interval = kwargs.pop('interval', 1)
+        frequency = kwargs.pop('frequency', 7)
+        width = kwargs.pop('burst', 3)
+        level = kwargs.pop('level', 'INFO')
+        kwargs['result'] = True
+        log_path = kwargs.pop('logPath', None)
+        try:
+            self.logger = logger.LoggingOutput(
+                level,
+                log_path=log_path,
+                log_conf=kwargs.pop('logConf', None),
+                handle=True if kwargs.pop('app', False) else None,
+                progress=True
+            )
+        except (Exception, ):
+            self.logger = logging
+        self.plan = burst.BurstPlan.parse(
+            kwargs.pop('burstPlan', None), frequency=frequency, interval=interval, burst=width
+        )
+        self.name = kwargs.get('name')
+        # 首选及按优先级排列的其他站点时段, 每轮余票查询后选择仍有余票的最优候选
+        self.choices = preference.ranked(line, station, time_slot, kwargs.pop('preferences', ()))
+        self.tracer = trace.Tracer(self.name, self.start)
+        # 创建 Metro 或 AsyncMetro 的参数
+        self.options = dict(
+            pool_size=self.plan.concurrency,
+            dns=kwargs.pop('dns', None),
+            cache=kwargs.pop('balanceCache', None),
+            domain=kwargs.pop('domain', None),
+            tracer=self.tracer
+        )
+
+    def _booked(self, timeout: float = None) -> Generator[Step, bool, Optional[preference.Choice]]:
+        """ 查询是否已存在任意候选时段的预约, 返回已预约的候选 """
+        for choice in self.choices:
+            if (yield APPOINTMENT, (choice, timeout)):
+                return choice
+
+    def flow(self) -> Generator[Step, object, dict]:
+        """
+        抢票流程
+        :return: 生成器结束时返回抢票结果, 即 task 的返回值
+        """
+
+        kwargs, _logger, tracer = self.kwargs, self.logger, self.tracer
+
+        # 如果已存在任意候选时段的预约则终止
+        with tracer.span(trace.PRECHECK) as span:
+            exist = yield from self._booked(timeout=2)
+            span.outcome = 'exist' if exist else 'absent'
+        if exist:
+            kwargs['booked'] = exist.station, exist.slot
+            _logger.info('检测到已存在预约, 终止程序')
+            kwargs['loggerList'] = _logger.log_list
+            kwargs['trace'] = tracer.events
+            return kwargs
+
+        # 在抢票前的等待时间内预热连接池, 抢票时刻的请求直接复用已建立的连接
+        yield PREPARE, (self.start, )
+        _logger.debug(f'抢票计划: {self.plan}')
+
+        # 整个抢票计划为一个可取消的请求组, 任意请求成功后剩余的请求不再发出
+        success_at = None
+        waves = self.plan.waves(self.start)
+        choice = self.choices[0]  # 首轮不查询余票, 直接抢首选时段
+        for wave in waves:
+
+            if wave.check:
+                yield WAIT, (wave.instants[0], )
+                tracer.wake(wave.instants[0])
+                # 每个站点只查询一次余票, 所有候选共用同一轮的查询结果
+                snapshot = yield BALANCE, (preference.windows(self.choices), )
+                exist = yield from self._booked(timeout=2)
+
+                # 如果存在预约则终止
+                if exist:
+                    _logger.info('抢票成功')
+                    break
+
+                _choice = preference.choose(snapshot, self.choices)
+                if _choice is None:
+                    _logger.info(f'{"、".join(x.label for x in self.choices)} 时段已经没有余票了...')
+                    continue
+
+                if _choice != choice:
+                    _logger.info(f'{choice.label} 时段已经没有余票了, 改抢 {_choice.label}')
+                choice = _choice
+
+            _logger.info(f'{choice.label} 准备抢票, 本轮按计划发出 {len(wave.instants)} 个请求')
+            success_at = yield BURST, (wave.instants, choice)
+            if success_at is not None:
+                _logger.info(f'抢票成功, 距离抢票时刻 {round((success_at - self.start) * 1000, 1)} ms')
+                break
+
+            result = yield from self._booked(timeout=5)
+            if result:
+                break
+
+        else:
+            _logger.info(f'程序运行了 {len(waves)} 次, 没有抢到票...')
+            kwargs['result'] = False
+
+        # 由于高峰期接口容易超时, 最后程序运行完成后再进行一次断言, 抢票接口已经明确返回成功时无需断言
+        with tracer.span(trace.VERIFY) as span:
+            _booked = choice if success_at is not None else (yield from self._booked())
+            kwargs['result'] = _booked is not None
+            span.outcome = 'skipped' if success_at is not None else ('exist' if kwargs['result'] else 'absent')
+        if _booked is not None:
+            kwargs['booked'] = _booked.station, _booked.slot
+        tracer.event(trace.RESULT, time.monotonic(), 0, outcome='success' if kwargs['result'] else 'failure')
+        kwargs['trace'] = tracer.events
+        _logger.log_list.insert(0, [f'↘↘↘↘↘↘↘↘↘↘ {self.name} ↙↙↙↙↙↙↙↙↙↙', logger.WARNING, 'warning'])
+        _logger.log_list.append([f'↗↗↗↗↗↗↗↗↗↗ {self.name} ↖↖↖↖↖↖↖↖↖↖', logger.WARNING, 'warning'])
+        kwargs['loggerList'] = _logger.log_list
+
+        return kwargs
+
+
+class Runner:
+    """ 以线程执行流程产出的操作, 配合 <metro.Metro> 类使用 """
+
+    def __init__(self, _metro, tracer: trace.Tracer):
+        """
+        :param _metro: <metro.Metro> 类
+        :param tracer: <trace.Tracer> 类
+        """
+        self.metro = _metro
+        self.tracer = tracer
+        self.group = burst.BurstGroup()
+
+    def appointment(self, choice: preference.Choice, timeout: Optional[float]) -> bool:
+        return self.metro.appointment(stationName=choice.station, arrivalTime=choice.slot, timeout=timeout)
+
+    def prepare(self, start: float) -> None:
+        self.metro.warm_up()
+        self.metro.mark(start)
+
+    @staticmethod
+    def wait(instant: float) -> None:
+        scheduler.wait(instant)
+
+    def balance(self, windows: dict) -> dict:
+        return {
+            station: self.metro.balance(stationName=station, timeSlot=window) for station, window in windows.items()
+        }
+
+    def fire(self, instant: float, choice: preference.Choice) -> bool:
+        self.tracer.wake(instant)
+        return self.metro.shakedown(lineName=choice.line, stationName=choice.station, timeSlot=choice.slot)
+
+    def burst(self, instants: List[float], choice: preference.Choice) -> Optional[float]:
+        """ 按计划发出一轮抢票请求并等待完成, 返回抢票成功的时间戳, 未成功时返回 None """
+        for instant in instants:
+            self.group.submit(instant, lambda _instant=instant: self.fire(_instant, choice))
+        return self.group.success_at if self.group.join() else None
+
+
+class AsyncRunner(Runner):
+    """ Runner 的协程版本, 配合 <metro.AsyncMetro> 类使用, 所有站点的余票并发查询 """
+
+    def __init__(self, _metro, tracer: trace.Tracer):
+        super().__init__(_metro, tracer)
+        self.group = burst.AsyncBurstGroup()
+
+    async def appointment(self, choice: preference.Choice, timeout: Optional[float]) -> bool:
+        return await self.metro.appointment(stationName=choice.station, arrivalTime=choice.slot, timeout=timeout)
+
+    async def prepare(self, start: float) -> None:
+        await self.metro.warm_up()
+        self.metro.mark(start)
+
+    @staticmethod
+    async def wait(instant: float) -> None:
+        await scheduler.async_wait(instant)
+
+    async def balance(self, windows: dict) -> dict:
+        balances = await asyncio.gather(*(
+            self.metro.balance(stationName=station, timeSlot=window) for station, window in windows.items()
+        ))
+        return dict(zip(windows, balances))
+
+    async def fire(self, instant: float, choice: preference.Choice) -> bool:
+        self.tracer.wake(instant)
+        return await self.metro.shakedown(lineName=choice.line, stationName=choice.station, timeSlot=choice.slot)
+
+    async def burst(self, instants: List[float], choice: preference.Choice) -> Optional[float]:
+        """ 参考 Runner.burst """
+        for instant in instants:
+            self.group.submit(instant, lambda _instant=instant: self.fire(_instant, choice))
+        return self.group.success_at if await self.group.join() else None
+
+
+def run(booking: Booking, runner: Runner) -> dict:
+    """
+    在当前线程中执行抢票流程
+    :param booking: <Booking> 类
+    :param runner: <Runner> 类
+    :return: 返回抢票结果
+    """
+
+    flow = booking.flow()
+    send, value = flow.send, None
+    while True:
+        try:
+            name, args = send(value)
+        except StopIteration as stop:
+            return stop.value
+        # 操作抛出的异常交还给流程, 正在进行的 trace 阶段可以正常结束
+        try:
+            value, send = getattr(runner, name)(*args), flow.send
+        except (Exception, ) as error:
+            value, send = error, flow.throw
+
+
+async def run_async(booking: Booking, runner: AsyncRunner) -> dict:
+    """ run 的协程版本 """
+
+    flow = booking.flow()
+    send, value = flow.send, None
+    while True:
+        try:
+            name, args = send(value)
+        except StopIteration as stop:
+            return stop.value
+        try:
+            value, send = await getattr(runner, name)(*args), flow.send
+        except (Exception, ) as error:
+            value, send = error, flow.throw
+
+
+def task(kwargs: dict, subway_result: list = None) -> dict:
+    """
+    执行抢票程序任务, 由线程或进程池中的工作进程调用, 工作进程只需要导入本模块
+        :param kwargs:
+                startTime -> int: 开始执行的时间
+                lineName -> str: 线路名称
+                stationName -> str: 站点名称
+                timeSlot -> str: 抢票时段
+                token -> str: 地铁系统的 Authorization 字段
+                interval -> Union[int, float]: 抢票失败后的重试间隔, 未配置 burstPlan 时使用
+                frequency -> int: 抢票失败后的重试次数, 未配置 burstPlan 时使用
+                burst -> int: 每次抢票并发的请求数量, 未配置 burstPlan 时使用
+                burstPlan -> dict: 抢票计划, 参考 burst.BurstPlan
+                level -> str: 日志等级
+                name -> str: 当前用户名称
+                logPath -> str: 日志记录路径
+                logConf -> str: 日志配置路径
+                app -> bool: 是否通过 app 启动, 为 True 时将日志缓存到 loggerList 中返回
+                dns -> resolver.Resolver: 预解析及测速后的解析器, 连接会固定到最快的节点
+                balanceCache -> coalesce.BalanceCache: 所有用户共享的余票缓存
+                domain -> str: 地铁接口地址
+                profile -> str: 性能分析报告的目录, 为 None 时不分析
+        :param subway_result: 线程存储信息数据表
+        :return: 返回是否抢票成功
+    """
+
+    with profiler.Profiler(kwargs.pop('profile', None), f'task-{kwargs.get("name")}', kwargs.get('startTime')):
+        booking = Booking(kwargs)
+        _metro = metro.Metro(booking.token, **booking.options)
+        try:
+            kwargs = run(booking, Runner(_metro, booking.tracer))
+        finally:
+            _metro.close()
+
+    if subway_result is not None:
+        subway_result.append(kwargs)
+
+    return kwargs
+
+
+async def task_async(kwargs: dict, connector=None) -> dict:
+    """
+    执行抢票程序任务的协程版本, 抢票流程与 task 一致
+    :param kwargs: 参考 task
+    :param connector: 共享的 <aiohttp.TCPConnector>
+    :return: 返回是否抢票成功
+    """
+
+    # 协程与父级共享同一个线程, 由 Subway.start_task 或 task_shard 统一分析
+    kwargs.pop('profile', None)
+
+    booking = Booking(kwargs)
+    async with metro.AsyncMetro(booking.token, connector=connector, **booking.options) as _metro:
+        return await run_async(booking, AsyncRunner(_metro, booking.tracer))
+
+
+def concurrency(item: dict) -> int:
+    """ 用户抢票计划中单个波次最多的并发请求数量 """
+    return burst.BurstPlan.parse(item.get('burstPlan'), **item).concurrency
+
+
+def deadline(items: List[dict]) -> float:
+    """
+    一批抢票任务最晚应该完成的时间戳, 超过后可以认为执行任务的工作进程已经异常退出
+    :param items: task 的 kwargs 列表
+    :return:
+    """
+    result = time.time()
+    for item in items:
+        waves = burst.BurstPlan.parse(item.get('burstPlan'), **item).waves(item.get('startTime') or time.time())
+        result = max(result, waves[-1].instants[-1] + len(waves) * WAVE_TIMEOUT + GRACE)
+    return result
+
+
+def failure(item: dict, error: BaseException) -> dict:
+    """
+    抢票任务抛出异常时生成该用户的失败结果并记录日志
+    :param item: task 的 kwargs
+    :param error: 抢票任务抛出的异常
+    :return: 返回与 task 格式一致的结果
+    """
+    _message = f'{item.get("name")} 抢票任务异常: {type(error).__name__}: {error}'
+    logging.error(_message)
+    return dict(name=item.get('name'), result=False, loggerList=[[_message, logger.ERROR, 'danger']], trace=[])
+
+
+async def gather_async(users: list, dns=None, limit: int = None) -> list:
+    """
+    在当前事件循环中并发运行多个用户的抢票任务, 所有用户共享同一个连接池
+    :param users: task 的 kwargs 列表
+    :param dns: <resolver.Resolver> 类
+    :param limit: 连接池上限, 默认为所有用户的并发请求数量之和
+    :return:
+    """
+
+    if not users:
+        return []
+
+    total = sum(map(concurrency, users))
+    connector = metro.AsyncMetro.create_connector(min(total, limit) if limit else total, dns)
+    try:
+        # 每个用户的异常只影响该用户的结果, 不会丢弃其他用户已经抢到的票
+        result = await asyncio.gather(
+            *(task_async(kwargs=item, connector=connector) for item in users), return_exceptions=True
+        )
+    finally:
+        await connector.close()
+    return [
+        failure(item, _result) if isinstance(_result, BaseException) else _result
+        for item, _result in zip(users, result)
+    ]
+
+
+def task_shard(users: list) -> list:
+    """
+    运行单个分片的抢票任务, 分片内的用户共享余票缓存及连接池
+    :param users: task 的 kwargs 列表
+    :return:
+    """
+
+    cache = coalesce.AsyncBalanceCache()
+    for item in users:
+        item['balanceCache'] = cache
+
+    dns = users[0].get('dns') if users else None
+    directory, release = (users[0].get('profile'), users[0].get('startTime')) if users else (None, None)
+    with profiler.Profiler(directory, 'shard', release):
+        return asyncio.run(gather_async(users, dns, shard.LIMIT))
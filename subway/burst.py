@@ -0,0 +1,240 @@
+# _author: Coke
+# _date: 2023/8/12 16:40
+
+from typing import Awaitable, Callable, List, NamedTuple, Optional, Tuple, Union
+
+import threading
+import asyncio
+import time
+
+from subway import scheduler
+
+
+class Wave(NamedTuple):
+    """ 一个抢票波次 """
+
+    instants: Tuple[float, ...]  # 波次中每个请求的发出时间戳
+    check: bool  # 发出前是否需要先查询余票, 首个波次在放票时刻盲发, 无需查询
+
+
+class BurstPlan:
+    """
+    声明式的抢票计划, 配置格式如下, 时间单位均为毫秒:
+        {
+            "offsets": [-30, 0, 40, 120],  // 首个波次中每个请求相对放票时刻的偏移, 不查询余票直接发出
+            "rounds": 6,  // 首个波次之后的重试波次数量, 重试前会先查询余票
+            "width": 3,  // 每个重试波次同时发出的请求数量
+            "interval": 1000,  // 首个重试波次距离放票时刻的间隔
+            "growth": 1.0,  // 每个重试波次的间隔相对上一次的倍数
+            "maxInterval": 5000  // 重试波次间隔的上限
+        }
+    """
+
+    __slots__ = ('offsets', 'rounds', 'width', 'interval', 'growth', 'max_interval')
+
+    def __init__(self, offsets: List[float] = None, rounds: int = 6, width: int = 3,
+                 interval: float = 1000, growth: float = 1.0, max_interval: float = 5000):
+        self.offsets = tuple(offsets) if offsets is not None else (0, ) * width
+        self.rounds = rounds
+        self.width = width
+        self.interval = interval
+        self.growth = growth
+        self.max_interval = max_interval
+
+    @classmethod
+    def parse(cls, conf: Optional[Union[dict, 'BurstPlan']], **kwargs) -> 'BurstPlan':
+        """
+        解析抢票计划配置, 未配置的字段使用 kwargs 中的旧参数
+        :param conf: 抢票计划配置, 为 None 时使用旧参数生成计划, 已经解析过的 <BurstPlan> 直接返回
+        :param kwargs:
+                frequency -> int: 抢票次数, 等于首个波次 + 重试波次
+                interval -> float: 重试间隔, 单位秒
+                burst -> int: 每个波次的请求数量
+        :return: 不符合要求时抛出 AssertionError 或 ValueError
+        """
+
+        if isinstance(conf, cls):
+            return conf
+
+        conf = conf or dict()
+        assert isinstance(conf, dict), 'burstPlan 必须为对象'
+        try:
+            width = conf.get('width', kwargs.get('burst', 3))
+            offsets = conf.get('offsets', [0] * width)
+            plan = cls(
+                offsets=offsets,
+                # frequency 为 0 时与旧版本一样不重试
+                rounds=conf.get('rounds', max(kwargs.get('frequency', 7) - 1, 0)),
+                width=width,
+                interval=conf.get('interval', kwargs.get('interval', 1) * 1000),
+                growth=conf.get('growth', 1.0),
+                max_interval=conf.get('maxInterval', 5000)
+            )
+            plan.validate()
+        except TypeError as error:
+            # 字段类型错误时比较或构造会抛出 TypeError, 统一转换为配置错误, 避免启动或重新加载配置时崩溃
+            raise ValueError(f'burstPlan 字段类型不正确: {error}') from error
+        return plan
+
+    def validate(self) -> None:
+        """ 校验抢票计划, 不符合要求时抛出 AssertionError """
+        assert self.offsets, 'burstPlan.offsets 不能为空'
+        assert all(isinstance(item, (int, float)) for item in self.offsets), 'burstPlan.offsets 必须为数字'
+        assert isinstance(self.rounds, int) and self.rounds >= 0, 'burstPlan.rounds 必须为非负整数'
+        assert isinstance(self.width, int) and self.width > 0, 'burstPlan.width 必须为正整数'
+        assert self.interval > 0 and self.growth >= 1, 'burstPlan.interval 必须大于 0 且 growth 不小于 1'
+
+    @property
+    def concurrency(self) -> int:
+        """ 单个波次中最多的并发请求数量, 用于确定连接池大小 """
+        return max(len(self.offsets), self.width)
+
+    def waves(self, release: float) -> List[Wave]:
+        """
+        生成抢票波次
+        :param release: 放票时刻的时间戳
+        :return: 返回按时间排序的波次列表
+        """
+
+        result = [Wave(tuple(sorted(release + item / 1000 for item in self.offsets)), False)]
+        interval = self.interval
+        instant = release
+        for _ in range(self.rounds):
+            instant += interval / 1000
+            result.append(Wave((instant, ) * self.width, True))
+            interval = min(interval * self.growth, self.max_interval)
+        return result
+
+    def _key(self) -> tuple:
+        return self.offsets, self.rounds, self.width, self.interval, self.growth, self.max_interval
+
+    def __eq__(self, other):
+        return isinstance(other, BurstPlan) and self._key() == other._key()
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def __repr__(self):
+        return (
+            f'BurstPlan(offsets={list(self.offsets)}, rounds={self.rounds}, width={self.width}, '
+            f'interval={self.interval}, growth={self.growth}, maxInterval={self.max_interval})'
+        )
+
+
+class BurstGroup:
+    """
+    可取消的抢票请求组, 任意一个抢票请求成功后, 尚未发出的请求不再发出, 等待方立即返回
+    线程中已经发出的请求无法中断, 其结果会被忽略
+    """
+
+    def __init__(self):
+        self.success = False
+        self.success_at: Optional[float] = None  # 抢票成功的时间戳
+        self._pending = 0
+        self._condition = threading.Condition()
+
+    def succeed(self) -> None:
+        """ 标记抢票成功并唤醒所有等待者 """
+        with self._condition:
+            if not self.success:
+                self.success = True
+                self.success_at = time.time()
+            self._condition.notify_all()
+
+    def _wait(self, instant: float) -> bool:
+        """
+        等待到指定时间, 等待期间抢票成功则提前返回
+        :param instant: 目标时间戳
+        :return: 如果已经抢票成功返回 True
+        """
+        remaining = instant - time.time() - scheduler.COARSE
+        if remaining > 0:
+            with self._condition:
+                self._condition.wait_for(lambda: self.success, remaining)
+        if self.success:
+            return True
+        scheduler.wait(instant)
+        return self.success
+
+    def submit(self, instant: float, func: Callable[[], bool]) -> threading.Thread:
+        """
+        在指定时间发出抢票请求
+        :param instant: 发出的时间戳
+        :param func: 抢票函数, 返回 True 时表示抢票成功
+        :return: 返回执行请求的线程
+        """
+
+        def target():
+            try:
+                if self._wait(instant):
+                    return
+                if func():
+                    self.succeed()
+            finally:
+                with self._condition:
+                    self._pending -= 1
+                    self._condition.notify_all()
+
+        with self._condition:
+            self._pending += 1
+        thread = threading.Thread(target=target, daemon=True)
+        thread.start()
+        return thread
+
+    def join(self) -> bool:
+        """
+        等待所有请求完成, 或任意请求抢票成功
+        :return: 返回是否抢票成功
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self.success or not self._pending)
+        return self.success
+
+
+class AsyncBurstGroup:
+    """ BurstGroup 的协程版本, 抢票成功后会取消所有未完成的请求, 包括已经发出的请求 """
+
+    def __init__(self):
+        self.success = False
+        self.success_at: Optional[float] = None
+        self._tasks = set()
+
+    def submit(self, instant: float, func: Callable[[], Awaitable[bool]]) -> asyncio.Task:
+        """
+        参考 BurstGroup.submit
+        :param instant: 发出的时间戳
+        :param func: 返回协程的抢票函数
+        :return:
+        """
+
+        async def target():
+            await scheduler.async_wait(instant)
+            if await func():
+                self.success = True
+                self.success_at = self.success_at or time.time()
+                self.cancel()
+
+        task = asyncio.ensure_future(target())
+        self._tasks.add(task)
+        task.add_done_callback(self._done)
+        return task
+
+    def _done(self, task: asyncio.Task) -> None:
+        # 读取异常, 失败的请求与线程版本一致只影响自身
+        self._tasks.discard(task)
+        if not task.cancelled():
+            task.exception()
+
+    def cancel(self) -> None:
+        """ 取消所有未完成的请求 """
+        current = asyncio.current_task()
+        for task in list(self._tasks):
+            if task is not current:
+                task.cancel()
+
+    async def join(self) -> bool:
+        """ 参考 BurstGroup.join """
+        while self._tasks and not self.success:
+            await asyncio.wait(set(self._tasks), return_when=asyncio.FIRST_COMPLETED)
+        self.cancel()
+        return self.success
@@ -0,0 +1,128 @@
+# _author: Coke
+# _date: 2023/8/9 22:15
+
+from typing import List, NamedTuple, Optional
+from email.utils import parsedate_to_datetime
+from requests.exceptions import RequestException
+
+import logging
+import time
+
+from subway import metro
+
+SAMPLES = 8  # 采样次数
+INTERVAL = 0.13  # 采样间隔, 与 1 秒互质, 使 Date 头的跳变落在不同的相位上以收窄偏差区间
+LIMIT = 5.0  # 偏差超过此值时输出告警
+PRECISION = 0.02  # 偏差的误差范围不超过此值时直接使用区间中点, 否则只修正到区间内最接近 0 的一端, 单位秒
+
+
+class Calibration(NamedTuple):
+    """ 校准结果, 服务器时间 = 本地时间 + offset """
+
+    offset: float  # 本地时钟相对服务器时钟的偏差, 误差范围过大时为实际修正的部分, 单位秒
+    uncertainty: float  # 偏差的误差范围 (±), 单位秒
+    latency: float  # 单程延迟, 单位秒
+    samples: int  # 有效采样次数
+
+    def fire(self, release: float) -> float:
+        """
+        计算本地的发出时刻, 使请求到达服务器时恰好为服务器的放票时刻
+        :param release: 服务器时钟下的放票时间戳
+        :return: 返回本地时钟下的发出时间戳
+        """
+        return release - self.offset - self.latency
+
+    @property
+    def lead(self) -> float:
+        """ 相对本地放票时刻提前发出的时间, 单位秒 """
+        return self.offset + self.latency
+
+
+UNCALIBRATED = Calibration(0.0, float('inf'), 0.0, 0)
+
+
+def _sample(client: metro.Metro, timeout: float) -> Optional[tuple]:
+    """
+    发送一次请求并记录发送、接收时间及服务器的 Date 头
+    :return: 返回 (发送时间, 接收时间, 服务器时间) 失败时返回 None
+    """
+    try:
+        start = time.time()
+        response = client.session.request('HEAD', f'{client.domain}/', timeout=timeout)
+        end = time.time()
+        response.close()
+        date = response.headers.get('Date')
+        if not date:
+            return None
+        return start, end, parsedate_to_datetime(date).timestamp()
+    except (RequestException, TypeError, ValueError):
+        return None
+
+
+def calibrate(client: metro.Metro, samples: int = SAMPLES, interval: float = INTERVAL,
+              timeout: float = 2, logger=None) -> Calibration:
+    """
+    采样服务器的 Date 头及响应耗时, 估算时钟偏差及单程延迟
+    Date 头精度为 1 秒, 每次采样说明服务器时间在 [date, date + 1) 内且发生在本地 [start, end] 之间,
+    因此偏差落在 [date - end, date + 1 - start] 区间, 对所有采样的区间求交集后取中点
+    :param client: 用于采样的 <metro.Metro> 类, 复用其连接池及节点固定
+    :param samples: 采样次数
+    :param interval: 采样间隔
+    :param timeout: 单次请求超时时间
+    :param logger: <logger.LoggingOutput> 类
+    :return: 返回 <Calibration>, 采样失败时返回未校准结果
+    """
+
+    result = []
+    for index in range(samples):
+        item = _sample(client, timeout)
+        if item is not None:
+            result.append(item)
+        if index < samples - 1:
+            time.sleep(interval)
+
+    return estimate(result, logger)
+
+
+def estimate(result: List[tuple], logger=None) -> Calibration:
+    """
+    根据采样结果估算时钟偏差及单程延迟, 参考 calibrate
+    误差范围较大时区间中点并不可信, 例如 22.5 ms ±35.9 ms 的真实偏差可能为 0, 此时只修正到区间内最接近 0 的一端,
+    区间包含 0 时不修正偏差, 避免校准本身使发出时刻偏离
+    :param result: _sample 的返回结果列表
+    :param logger: <logger.LoggingOutput> 类
+    :return: 返回 <Calibration>, 没有采样结果时返回未校准结果
+    """
+
+    logger = logger if logger is not None else logging
+    if not result:
+        logger.warning('未能获取服务器时间, 不进行时钟校准')
+        return UNCALIBRATED
+
+    lower = max(date - end for start, end, date in result)
+    upper = min(date + 1 - start for start, end, date in result)
+    if lower > upper:
+        # 区间不相交说明采样期间时钟发生了跳变, 退化为取每次采样中点的平均值
+        offsets = [date + 0.5 - (start + end) / 2 for start, end, date in result]
+        lower, upper = min(offsets), max(offsets)
+
+    latency = min(end - start for start, end, date in result) / 2
+    offset, uncertainty = (lower + upper) / 2, (upper - lower) / 2
+    if uncertainty > PRECISION:
+        measured, offset = offset, min(max(0.0, lower), upper)
+        if offset:
+            logger.warning(
+                f'时钟偏差 {round(measured * 1000, 1)} ms 的误差范围 ±{round(uncertainty * 1000, 1)} ms 过大, '
+                f'只修正 {round(offset * 1000, 1)} ms'
+            )
+        else:
+            logger.warning(
+                f'时钟偏差 {round(measured * 1000, 1)} ms 的误差范围 ±{round(uncertainty * 1000, 1)} ms 过大, '
+                f'不修正时钟偏差'
+            )
+
+    calibration = Calibration(offset, uncertainty, latency, len(result))
+    if abs(calibration.offset) > LIMIT:
+        logger.warning(f'本地时钟与服务器相差 {round(calibration.offset, 3)} 秒, 请检查系统时间')
+
+    return calibration
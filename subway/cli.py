@@ -0,0 +1,127 @@
+# _author: Coke
+# _date: 2023/9/2 10:18
+
+from typing import Dict, List, Tuple
+
+import importlib
+import click
+import sys
+
+# 子命令及其实现, 只有被调用的子命令才会导入对应的模块
+COMMANDS = dict(
+    run='subway.main:command',
+    serve='subway.server:command',
+    trace='subway.cli:trace',
+    plan='subway.planner:command',
+    jitter='subway.cli:jitter',
+    imports='subway.cli:imports'
+)
+
+# 冷启动导入耗时预算, 单位毫秒, 不包含解释器自身的启动耗时, 预留约一半的余量以免受主机负载波动影响
+# 工作进程会导入 subway.scheduler 及 subway.trace, 两者都不能依赖 click 等只有命令行才会用到的模块
+BUDGET = {
+    'subway.cli': 90,
+    'subway.scheduler': 60,
+    'subway.trace': 150,
+    'subway.metro': 300,
+    'subway.main': 400,
+    'subway.server': 120
+}
+
+
+class LazyGroup(click.Group):
+    """ 延迟导入子命令的命令组, 执行某个子命令时只会导入该子命令的模块 """
+
+    def __init__(self, *args, commands: Dict[str, str] = None, **kwargs):
+        super(LazyGroup, self).__init__(*args, **kwargs)
+        self.lazy = commands or dict()
+
+    def list_commands(self, ctx) -> List[str]:
+        return sorted(set(super(LazyGroup, self).list_commands(ctx)) | set(self.lazy))
+
+    def get_command(self, ctx, name):
+        if name in self.lazy:
+            module, attribute = self.lazy[name].split(':')
+            return getattr(importlib.import_module(module), attribute)
+        return super(LazyGroup, self).get_command(ctx, name)
+
+
+@click.group(cls=LazyGroup, commands=COMMANDS)
+def command() -> None:
+    """ 北京地铁进站预约程序 """
+
+
+@click.command()
+@click.option('--samples', '-n', help='采样次数', default=20)
+@click.option('--delay', '-d', help='每次采样的定时间隔, 单位秒', default=0.2)
+def jitter(samples: int, delay: float) -> None:
+    """ 测量当前主机上调度器的触发误差 """
+    from subway import scheduler
+
+    for key, value in scheduler.jitter(samples, delay).items():
+        click.echo(f'{key}: {value}')
+
+
+@click.command()
+@click.argument('filename')
+@click.option('--output', '-o', help='输出文件路径, 默认与事件文件同名的 .trace.json 文件', default='')
+def trace(filename: str, output: str) -> None:
+    """ 将抢票时段的事件文件转换为 Chrome / Perfetto trace 格式 """
+    from subway import trace as _trace
+
+    output = _trace.export(filename, output)
+    click.echo(f'已导出 {output}, 请在 chrome://tracing 或 https://ui.perfetto.dev 中打开')
+
+
+def measure(module: str) -> Tuple[float, List[Tuple[float, str]]]:
+    """
+    在全新的解释器中测量模块的冷启动导入耗时
+    :param module: 模块名称
+    :return: 返回 (总耗时, [(自身耗时, 模块名称), ...]) 单位毫秒, 列表按自身耗时降序排列
+    """
+
+    import subprocess
+
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True,
+        text=True,
+        check=True
+    )
+
+    total, items = 0.0, []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        if name.strip() == module:
+            total = int(cumulative) / 1000
+        items.append((int(own) / 1000, name.strip()))
+
+    return total, sorted(items, reverse=True)
+
+
+@click.command()
+@click.option('--top', '-t', help='输出自身耗时最多的模块数量', default=5)
+@click.argument('modules', nargs=-1)
+def imports(top: int, modules: Tuple[str]) -> None:
+    """ 测量冷启动导入耗时并与预算比较, 超出预算时返回非零退出码 """
+
+    over = []
+    for module in modules or BUDGET:
+        total, items = measure(module)
+        budget = BUDGET.get(module)
+        status = '' if budget is None else f' / 预算 {budget} ms'
+        if budget is not None and total > budget:
+            over.append(module)
+            status += ' 超出预算'
+        click.echo(f'{module}: {round(total, 1)} ms{status}')
+        for own, name in items[:top]:
+            click.echo(f'    {round(own, 1):>8} ms  {name}')
+
+    if over:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    command()
@@ -0,0 +1,113 @@
+# _author: Coke
+# _date: 2023/8/15 20:48
+
+from typing import Any, Awaitable, Callable, Hashable
+
+import threading
+import asyncio
+import zlib
+import time
+
+TTL = 0.05  # 余票缓存的有效期, 单位秒
+STRIPES = 16  # 跨进程共享时使用的锁数量
+
+
+def balance_key(body: dict) -> tuple:
+    """
+    生成余票查询的缓存 Key, 由站点、日期及时段组成
+    :param body: 余票接口的请求体, 参考 Metro._balance_body
+    :return:
+    """
+    return body.get('stationName'), tuple(body.get('enterDates') or ()), body.get('timeSlot')
+
+
+class BalanceCache:
+    """
+    单飞余票缓存, 同一个 Key 同一时刻只会有一个查询在进行, 其他等待者直接复用其结果
+    默认在线程间共享; 通过 shared 创建时数据及锁由 multiprocessing.Manager 托管, 可以在进程间共享
+    """
+
+    def __init__(self, ttl: float = TTL, store=None, locks=None):
+        """
+        :param ttl: 缓存有效期
+        :param store: 缓存容器, 默认为 dict
+        :param locks: 锁列表, 按 Key 分片使用, 默认为 threading.Lock
+        """
+        self.ttl = ttl
+        self._store = store if store is not None else dict()
+        self._locks = locks if locks is not None else [threading.Lock() for _ in range(STRIPES)]
+
+    @classmethod
+    def shared(cls, manager, ttl: float = TTL) -> 'BalanceCache':
+        """
+        创建可在进程间共享的缓存
+        :param manager: 已启动的 multiprocessing.Manager
+        :param ttl: 缓存有效期
+        :return:
+        """
+        return cls(ttl, manager.dict(), [manager.Lock() for _ in range(STRIPES)])
+
+    def _lock(self, key: Hashable):
+        # 不使用 hash(), 其结果在不同进程中不一致
+        return self._locks[zlib.crc32(repr(key).encode()) % len(self._locks)]
+
+    def _fresh(self, key: Hashable):
+        entry = self._store.get(key)
+        if entry is not None and time.time() - entry[0] <= self.ttl:
+            return entry
+        return None
+
+    def get(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        """
+        获取缓存, 过期时由第一个调用者执行 loader, 其他调用者等待并复用其结果
+        :param key: 缓存 Key
+        :param loader: 查询函数
+        :return: 返回查询结果
+        """
+
+        entry = self._fresh(key)
+        if entry is not None:
+            return entry[1]
+
+        with self._lock(key):
+            entry = self._fresh(key)
+            if entry is not None:
+                return entry[1]
+
+            value = loader()
+            self._store[key] = (time.time(), value)
+            return value
+
+
+class AsyncBalanceCache:
+    """ BalanceCache 的协程版本, 在同一个事件循环的协程间共享 """
+
+    def __init__(self, ttl: float = TTL):
+        self.ttl = ttl
+        self._store = dict()
+        self._flights = dict()
+
+    async def get(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        参考 BalanceCache.get
+        :param key: 缓存 Key
+        :param loader: 返回协程的查询函数
+        :return: 返回查询结果
+        """
+
+        entry = self._store.get(key)
+        if entry is not None and time.time() - entry[0] <= self.ttl:
+            return entry[1]
+
+        flight = self._flights.get(key)
+        if flight is not None:
+            return await asyncio.shield(flight)
+
+        flight = asyncio.ensure_future(loader())
+        self._flights[key] = flight
+        try:
+            value = await asyncio.shield(flight)
+            self._store[key] = (time.time(), value)
+            return value
+        finally:
+            self._flights.pop(key, None)
@@ -0,0 +1,235 @@
+# _author: Coke
+# _date: 2023/9/5 20:31
+
+from typing import NamedTuple, Optional, Set, Tuple
+
+import hashlib
+import json
+import time
+import os
+
+from subway import burst, preference, utils
+
+REQUIRED = ('lineName', 'stationName', 'timeSlot', 'token', 'name')  # 抢票用户的必填项
+TASK_FIELDS = ('interval', 'frequency', 'burst')  # 传递给抢票任务的可选字段
+DATE_FORMAT = '%Y-%m-%d'  # skipDates 中的日期格式
+
+
+class User(NamedTuple):
+    """ 配置文件中的单个用户, 解析后不可变 """
+
+    name: str
+    line: str  # 线路名称, 如 昌平线
+    station: str  # 站点名称, 如 沙河站
+    slot: str  # 抢票时段, 如 0720-0730
+    token: str
+    expire: int  # Token 过期时间戳, 无法解析时为 -1
+    shakedown: bool  # 为 True 时忽略此用户
+    plan: Optional[burst.BurstPlan]  # 合并全局计划后的抢票计划, 屏蔽用户为 None
+    options: Tuple[Tuple[str, object], ...]  # 其他传递给抢票任务的字段, 参考 TASK_FIELDS
+    subscribe: Tuple  # 用户自己的抢票时间, 为空时使用全局的抢票时间, 参考 utils.clock
+    skip: Tuple[str, ...]  # 不需要抢票的乘车日期, 如 2023-10-09
+    holiday: bool  # 为 True 时节假日也需要抢票
+    preferences: Tuple[preference.Choice, ...]  # 首选没有余票时按顺序尝试的其他站点及时段
+
+    @property
+    def key(self) -> Tuple[str, str]:
+        """ (站点, 时段) 用于分片及合并余票查询 """
+        return self.station, self.slot
+
+    @property
+    def window(self) -> Tuple[str, str]:
+        """ 时段的开始及结束时间, 如 ('0720', '0730') """
+        start, _, end = self.slot.partition('-')
+        return start, end
+
+    def expired(self, now: float = None) -> bool:
+        """ Token 是否已经过期 """
+        return self.expire <= int(now if now is not None else time.time())
+
+    def task_kwargs(self) -> dict:
+        """
+        生成 Subway.task 所需的用户参数, 只包含抢票任务使用的字段
+        :return:
+        """
+        return dict(
+            name=self.name,
+            lineName=self.line,
+            stationName=self.station,
+            timeSlot=self.slot,
+            token=self.token,
+            burstPlan=self.plan,
+            preferences=self.preferences,
+            **dict(self.options)
+        )
+
+
+class Config(NamedTuple):
+    """ 解析后的配置文件, 同一个文件版本只会解析一次, 所有组件共享同一个实例 """
+
+    users: Tuple[User, ...]
+    ding_token: Optional[str]
+    ding_sign: Optional[str]
+    lark_token: Optional[str]  # 飞书机器人的 webhook
+    lark_sign: Optional[str]
+    plan: Optional[burst.BurstPlan]  # 全局抢票计划
+    version: str  # 文件内容的摘要
+
+    @classmethod
+    def parse(cls, content: str, filename: str = '') -> 'Config':
+        """
+        解析并校验配置文件内容
+        :param content: 配置文件内容
+        :param filename: 配置文件路径, 用于错误信息
+        :return: 不符合要求时抛出 AssertionError、ValueError 或 TypeError
+        """
+
+        data: dict = json.loads(content)
+        users = data.get('userAgent')
+        head = f'{filename} 文件中'
+        tail = f', 请参考 README 文件配置'
+
+        assert isinstance(users, list), f'{head}没有存在 userAgent 或 userAgent 不为数组{tail}'
+
+        assert len(users), f'{head} userAgent 未配置任何数据{tail}'
+
+        plan = burst.BurstPlan.parse(data.get('burstPlan')) if data.get('burstPlan') is not None else None
+
+        records = []
+        for user in users:
+
+            # 校验 userAgent 中的数据类型
+            assert isinstance(user, dict), f'{head} userAgent 的 item 非对象{tail}'
+
+            shakedown = bool(user.get('shakedown'))
+            options = tuple((key, user[key]) for key in TASK_FIELDS if key in user)
+            user_plan = None
+            preferences = ()
+
+            # 如果此信息标记为非抢票模式则不校验
+            if not shakedown:
+                tooltip = f'{user.get("name")} 用户'
+                # 校验必填项, 必填项不可为空
+                for item in REQUIRED:
+                    assert user.get(item), f'{head} userAgent 的 {tooltip} {item} 未填写或为空{tail}'
+
+                # Token 过期的用户不会使整个文件校验失败, 由 Config.active 过滤
+                # 校验用户自己的抢票时间及跳过的日期
+                for item in ('subscribeTime', 'skipDates'):
+                    assert isinstance(user.get(item) or [], list), f'{head} userAgent 的 {tooltip} {item} 不为数组{tail}'
+                for item in user.get('subscribeTime') or ():
+                    utils.clock(item)
+                for item in user.get('skipDates') or ():
+                    time.strptime(item, DATE_FORMAT)
+
+                assert isinstance(user.get('preferences') or [], list), \
+                    f'{head} userAgent 的 {tooltip} preferences 不为数组{tail}'
+                preferences = preference.parse(user.get('preferences'), user.get('lineName'), user.get('stationName'))
+
+                user_plan = burst.BurstPlan.parse(
+                    user.get('burstPlan') if user.get('burstPlan') is not None else data.get('burstPlan'),
+                    **dict(options)
+                )
+
+            records.append(User(
+                name=user.get('name'),
+                line=user.get('lineName'),
+                station=user.get('stationName'),
+                slot=user.get('timeSlot'),
+                token=user.get('token'),
+                expire=utils.decode(user.get('token')),
+                shakedown=shakedown,
+                plan=user_plan,
+                options=options,
+                subscribe=tuple(user.get('subscribeTime') or ()),
+                skip=tuple(user.get('skipDates') or ()),
+                holiday=bool(user.get('holiday')),
+                preferences=preferences
+            ))
+
+        return cls(
+            users=tuple(records),
+            ding_token=data.get('dingTalkToken'),
+            ding_sign=data.get('dingTalkSign'),
+            lark_token=data.get('larkToken'),
+            lark_sign=data.get('larkSign'),
+            plan=plan,
+            version=digest(content)
+        )
+
+    def user(self, name: str) -> Optional[User]:
+        """ 按名称获取用户 """
+        for user in self.users:
+            if user.name == name:
+                return user
+
+    def active(self, now: float = None) -> Tuple[User, ...]:
+        """ 需要抢票的用户, 过滤掉屏蔽及 Token 过期的用户 """
+        now = now if now is not None else time.time()
+        return tuple(user for user in self.users if not user.shakedown and not user.expired(now))
+
+
+def diff(old: Optional[Config], new: Config) -> Set[str]:
+    """
+    比较两个配置版本中的用户
+    :param old: 旧配置, 为 None 时所有用户都视为新增
+    :param new: 新配置
+    :return: 返回新增、删除及内容发生变化的用户名称
+    """
+
+    before = {user.name: user for user in old.users} if old is not None else dict()
+    after = {user.name: user for user in new.users}
+    return {name for name in before.keys() | after.keys() if before.get(name) != after.get(name)}
+
+
+def digest(content: str) -> str:
+    """ 文件内容的摘要, 用于判断配置文件版本 """
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+class Loader:
+    """
+    配置文件加载器, 文件版本未变化时直接返回上次的解析结果
+    先比较文件的 inode、修改时间及大小, 变化后再比较内容摘要, 内容未变化时不会重新解析
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.config: Optional[Config] = None
+        self.error: Optional[Exception] = None  # 最近一个版本的解析错误
+        self._stat: Optional[Tuple[int, int, int]] = None
+        self._version: Optional[str] = None
+
+    def load(self) -> Tuple[Optional[Config], bool]:
+        """
+        加载配置文件
+        :return: 返回 (当前有效的配置, 是否是新解析的版本), 新版本不符合要求时返回上一个有效的配置并记录 error
+        """
+
+        stat = os.stat(self.filename)
+        key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if key == self._stat:
+            return self.config, False
+
+        with open(self.filename, 'r', encoding='utf-8') as file:
+            content = file.read()
+
+        self._stat = key
+        version = digest(content)
+        if version == self._version:
+            return self.config, False
+
+        self._version = version
+        if self.config is not None and version == self.config.version:
+            self.error = None
+            return self.config, False
+
+        try:
+            config = Config.parse(content, self.filename)
+        except (ValueError, TypeError, AssertionError) as error:
+            self.error = error
+            return self.config, False
+
+        self.error = None
+        self.config = config
+        return config, True
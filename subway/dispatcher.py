@@ -0,0 +1,263 @@
+# _author: Coke
+# _date: 2023/9/16 10:52
+
+from typing import Callable, Dict, List, Optional
+from requests.adapters import HTTPAdapter
+
+import threading
+import requests
+import logging
+import sqlite3
+import time
+import uuid
+
+from subway import message, outbox
+
+TITLE = '地铁抢票通知'
+DINGTALK = 'dingTalk'
+LARK = 'lark'
+
+# 每个渠道的限流, (每秒补充的令牌数量, 桶容量)
+# 钉钉自定义机器人每分钟最多发送 20 条, 飞书自定义机器人每分钟最多 100 条且每秒最多 5 条
+LIMITS = {
+    DINGTALK: (20 / 60, 20),
+    LARK: (100 / 60, 5)
+}
+
+
+class TokenBucket:
+    """ 令牌桶限流, 桶中没有令牌时阻塞到补充出下一个令牌 """
+
+    def __init__(self, rate: float, capacity: int):
+        """
+        :param rate: 每秒补充的令牌数量
+        :param capacity: 桶容量, 即允许的突发数量
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """
+        获取一个令牌
+        :return: 返回等待的时间, 单位秒
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+class Channel:
+    """
+    单个通知渠道, 拥有独立的发送线程及限流, 一个渠道被限流或失败重试时不会影响其他渠道
+    发送线程从发件箱中取出到期的通知, 失败后由发件箱按指数退避重新安排
+    """
+
+    def __init__(
+            self,
+            name: str,
+            sender: Callable[[outbox.Record], bool],
+            _outbox: outbox.Outbox,
+            bucket: Optional[TokenBucket] = None,
+            logger=None
+    ):
+        """
+        :param name: 渠道名称
+        :param sender: 发送函数, 发送成功返回 True
+        :param _outbox: <outbox.Outbox> 类
+        :param bucket: 限流的令牌桶, 默认参考 LIMITS
+        :param logger: <logger.LoggingOutput> 类
+        """
+        self.name = name
+        self.sender = sender
+        self.outbox = _outbox
+        self.bucket = bucket or TokenBucket(*LIMITS.get(name, (1, 1)))
+        self.logger = logger if logger is not None else logging
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._idle = threading.Event()  # 没有到期的通知时置位
+        self._closed = False
+        self._thread = threading.Thread(target=self._loop, name=f'dispatcher-{name}', daemon=True)
+        self._thread.start()
+
+    def put(self, key: str, title: str, text: str, markdown: bool) -> bool:
+        """ 将通知写入发件箱并唤醒发送线程, 已存在相同幂等键的通知时返回 False """
+        with self._lock:
+            self._idle.clear()
+            inserted = self.outbox.put(self.name, key, title, text, markdown)
+        self._wake.set()
+        return inserted
+
+    def wait(self, timeout: float = None) -> bool:
+        """ 等待所有到期的通知发送完成, 退避中的通知不会等待 """
+        return self._idle.wait(timeout)
+
+    def close(self) -> None:
+        """ 发送完所有到期的通知后停止发送线程, 未发送的通知保留在发件箱中, 下次启动后继续发送 """
+        self._closed = True
+        self._wake.set()
+
+    def join(self, timeout: float = None) -> None:
+        """ 等待发送线程退出, 需要先调用 close """
+        self._thread.join(timeout)
+
+    def _next(self) -> Optional[outbox.Record]:
+        with self._lock:
+            record = self.outbox.due(self.name)
+            if record is None:
+                self._idle.set()
+            return record
+
+    def _loop(self) -> None:
+        while True:
+            record = self._next()
+            if record is None:
+                if self._closed:
+                    return
+                # 空闲时在发送线程中压缩发件箱, 写入通知的调用方不会等待压缩
+                try:
+                    self.outbox.maintain()
+                except sqlite3.Error as error:
+                    self.logger.error(f'通知发件箱压缩失败: {error}')
+                due = self.outbox.next_due(self.name)
+                self._wake.wait(None if due is None else max(due - time.time(), 0))
+                self._wake.clear()
+                continue
+
+            wait = self.bucket.acquire()
+            if wait:
+                self.logger.debug(f'{self.name} 通知被限流, 等待 {round(wait, 1)} 秒')
+
+            try:
+                error = None if self.sender(record) else '机器人返回失败'
+            except (Exception, ) as _error:
+                error = repr(_error)
+
+            if error is None:
+                self.outbox.done(record)
+                continue
+
+            due = self.outbox.retry(record, error)
+            if due is not None:
+                self.logger.warning(
+                    f'{self.name} 通知第 {record.attempts + 1} 次发送失败, {round(due - time.time(), 1)} 秒后重试: {error}'
+                )
+
+
+class Dispatcher:
+    """
+    后台通知分发器, 调用方只负责写入发件箱, 不会等待任何 webhook
+    所有渠道共享一个带连接池的会话, 通知会并发分发到每个渠道
+    """
+
+    def __init__(self, _outbox: outbox.Outbox = None, logger=None):
+        """
+        :param _outbox: <outbox.Outbox> 类, 默认使用不持久化的内存发件箱
+        :param logger: <logger.LoggingOutput> 类
+        """
+        self.logger = logger if logger is not None else logging
+        self.outbox = _outbox if _outbox is not None else outbox.Outbox(logger=self.logger)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(LIMITS), pool_maxsize=len(LIMITS))
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.channels: Dict[str, Channel] = dict()
+        self._lock = threading.Lock()
+
+    def configure(self, senders: Dict[str, Callable[[outbox.Record], bool]]) -> None:
+        """
+        更新渠道, 已存在的渠道保留发送线程及限流状态, 只替换发送函数
+        :param senders: 渠道名称: 发送函数, 参考 dingtalk, lark
+        :return:
+        """
+        with self._lock:
+            for name in list(self.channels):
+                if name not in senders:
+                    self.channels.pop(name).close()
+
+            for name, sender in senders.items():
+                if name in self.channels:
+                    self.channels[name].sender = sender
+                else:
+                    self.channels[name] = Channel(name, sender, self.outbox, logger=self.logger)
+
+    def dingtalk(self, webhook: str, secret: str = None) -> Callable[[outbox.Record], bool]:
+        """ 生成钉钉机器人的发送函数 """
+
+        def sender(item: outbox.Record) -> bool:
+            robot = message.DingTalk(webhook, secret, logger=self.logger, session=self.session)
+            if item.markdown:
+                return robot.markdown(item.title, item.text) is not None
+            return robot.text(item.text) is not None
+
+        return sender
+
+    def lark(self, webhook: str, secret: str = None) -> Callable[[outbox.Record], bool]:
+        """ 生成飞书机器人的发送函数 """
+
+        def sender(item: outbox.Record) -> bool:
+            robot = message.Lark(webhook, secret, logger=self.logger, session=self.session)
+            if item.markdown:
+                return robot.markdown(item.title, item.text) is not None
+            return robot.text(item.text) is not None
+
+        return sender
+
+    def _put(self, key: Optional[str], title: str, text: str, markdown: bool) -> None:
+        key = key or uuid.uuid4().hex
+        with self._lock:
+            channels = list(self.channels.values())
+        for channel in channels:
+            if not channel.put(key, title, text, markdown):
+                self.logger.debug(f'{channel.name} 通知 {key} 已存在, 不会重复发送')
+
+    def send(self, text: str, title: str = TITLE, key: str = None) -> None:
+        """
+        将一条纯文本通知写入所有渠道的发件箱
+        :param text: 通知内容
+        :param title: 标题
+        :param key: 幂等键, 相同的键在每个渠道中只发送一次, 默认不去重
+        :return:
+        """
+        self._put(key, title, text, False)
+
+    def digest(self, title: str, lines: List[str], key: str = None) -> None:
+        """
+        将一批结果汇总为一条 markdown 通知写入所有渠道的发件箱
+        :param title: 标题
+        :param lines: 每一行的内容
+        :param key: 幂等键, 参考 send
+        :return:
+        """
+        if not lines:
+            return
+        self._put(key, title, '\n'.join([f'#### {title}'] + [f'- {line}' for line in lines]), True)
+
+    def join(self, timeout: float = None) -> bool:
+        """ 等待所有到期的通知发送完成, 超时返回 False """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        for channel in list(self.channels.values()):
+            if not channel.wait(None if deadline is None else max(deadline - time.monotonic(), 0)):
+                return False
+        return True
+
+    def close(self) -> None:
+        """ 发送完所有到期的通知后停止发送线程并关闭会话及发件箱 """
+        with self._lock:
+            channels = list(self.channels.values())
+            self.channels.clear()
+        for channel in channels:
+            channel.close()
+        for channel in channels:
+            channel.join()
+        self.session.close()
+        self.outbox.close()
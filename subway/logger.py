@@ -1,10 +1,13 @@
 # _author: Coke
 # _date: 2023/3/16 15:32
 
-from logging import config
+from logging import config, handlers
 
+import multiprocessing
+import collections
+import threading
 import logging
-import tkinter
+import atexit
 import json
 import time
 import os
@@ -12,6 +15,11 @@ import os
 _LOG_BYTES = 1024 * 1024 * 100
 _LOG_COUNT = 10
 
+# 默认的日志文件路径, 项目根目录下的 log.log
+LOG_PATH = os.path.abspath(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'log.log'))
+
+END = 'end'  # 与 tkinter.END 一致, 避免命令行及工作进程导入 tkinter
+
 INFO = 'INFO'
 DEBUG = 'DEBUG'
 ERROR = 'ERROR'
@@ -26,12 +34,146 @@ _LEVEL = dict(
     DEBUG=10
 )
 
+# 进程内的日志管道, 主进程由 setup 创建, 工作进程由 attach 接入
+_QUEUE = None
+_LISTENER = None
+_LOCK = threading.Lock()
+
+
+def setup(level, log_path=None, log_conf=None):
+    """
+    配置主进程的日志管道, 每个进程只读取一次配置文件并调用一次 dictConfig
+    配置文件中的处理器交给唯一的 QueueListener 线程, 根日志器只保留一个 QueueHandler
+    所有进程的日志都写入同一个队列, 由监听线程统一格式化并写入文件, 日志文件只有一个写入方, 轮转时不会冲突
+    :param level: 日志等级
+    :param log_path: 日志文件路径
+    :param log_conf: 日志配置文件
+    :return: 返回日志队列, 已经配置过时只更新日志等级
+    """
+
+    global _QUEUE, _LISTENER
+    with _LOCK:
+        if _QUEUE is not None:
+            logging.getLogger().setLevel(level)
+            return _QUEUE
+
+        with open(log_conf, 'r', encoding='utf-8') as file:
+            read_data = json.loads(file.read())
+            read_data['root']['level'] = level
+            read_data['handlers']['file']['filename'] = log_path
+
+        config.dictConfig(read_data)
+
+        from subway import pool
+        root = logging.getLogger()
+        # 队列需要与进程池使用同一种启动方式, 才能在创建工作进程时传递
+        _QUEUE = multiprocessing.get_context(pool.start_method()).Queue()
+        _LISTENER = handlers.QueueListener(_QUEUE, *root.handlers, respect_handler_level=True)
+        root.handlers = [handlers.QueueHandler(_QUEUE)]
+        _LISTENER.start()
+        atexit.register(stop)
+        return _QUEUE
+
+
+def attach(_queue, level) -> None:
+    """
+    工作进程接入主进程的日志管道, 不读取配置文件, 每条日志只是一次入队
+    :param _queue: 主进程 setup 返回的日志队列
+    :param level: 日志等级, 低于此等级的日志不会入队
+    :return:
+    """
+
+    global _QUEUE
+    with _LOCK:
+        _QUEUE = _queue
+        root = logging.getLogger()
+        root.handlers = [handlers.QueueHandler(_queue)]
+        root.setLevel(level)
+
+
+def log_queue():
+    """ 当前进程的日志队列, 未配置时返回 None """
+    return _QUEUE
+
+
+def stop() -> None:
+    """ 写入队列中剩余的日志并停止监听线程 """
+    global _LISTENER
+    with _LOCK:
+        if _LISTENER is not None:
+            _LISTENER.stop()
+            _LISTENER = None
+
+
+class TextboxSink:
+    """
+    GUI 日志输出, 任意线程只负责将日志追加到有界的缓冲区, 由 Tk 主循环按固定帧率批量写入文本框
+    文本框只保留最近的 lines 行, 超出后删除最早的日志, 长时间运行时内存保持稳定
+    """
+
+    INTERVAL = 33  # 写入文本框的间隔, 单位毫秒, 约每秒 30 帧
+    LINES = 5000  # 文本框及缓冲区保留的最大行数
+    BATCH = 1000  # 每帧最多写入的行数, 避免一帧阻塞主循环过久
+
+    def __init__(self, textbox, **kwargs):
+        """
+        需要在 Tk 主线程中创建
+        :param textbox: <customtkinter.CTkTextbox> 类
+        :param kwargs:
+                interval -> int: 写入文本框的间隔, 单位毫秒
+                lines -> int: 保留的最大行数
+                batch -> int: 每帧最多写入的行数
+        """
+        self.textbox = textbox
+        self.interval = kwargs.pop('interval', self.INTERVAL)
+        self.lines = kwargs.pop('lines', self.LINES)
+        self.batch = kwargs.pop('batch', self.BATCH)
+        # deque 的 append 及 popleft 是线程安全的, 界面来不及写入时丢弃最早的日志
+        self._buffer = collections.deque(maxlen=self.lines)
+        self._job = self.textbox.after(self.interval, self._drain)
+
+    def write(self, text: str, color: str = None) -> None:
+        """ 追加一行日志, 可以在任意线程中调用 """
+        self._buffer.append((text, color))
+
+    def close(self) -> None:
+        """ 停止写入文本框, 需要在 Tk 主线程中调用 """
+        if self._job is not None:
+            self.textbox.after_cancel(self._job)
+            self._job = None
+
+    def _drain(self) -> None:
+        """ 在 Tk 主循环中调用, 将缓冲区中的日志按颜色合并后批量写入 """
+        try:
+            count = min(len(self._buffer), self.batch)
+            if count:
+                chunk, tag = [], None
+                for _ in range(count):
+                    text, color = self._buffer.popleft()
+                    if chunk and color != tag:
+                        self.textbox.insert(END, ''.join(chunk), tag)
+                        chunk = []
+                    chunk.append(text)
+                    tag = color
+                self.textbox.insert(END, ''.join(chunk), tag)
+
+                # 删除超出保留行数的最早的日志
+                excess = int(self.textbox.index('end-1c').split('.')[0]) - 1 - self.lines
+                if excess > 0:
+                    self.textbox.delete('1.0', f'{excess + 1}.0')
+                self.textbox.see(END)
+        finally:
+            self._job = self.textbox.after(self.interval, self._drain)
+
 
 class LoggingOutput:
     """ 二次封装了一下 logging 方法, 支持 customtkinter.CTkTextbox 数据传递 """
 
     def __init__(self, level, log_path=None, log_conf=None, handle=None, progress=False):
         self.level = _LEVEL.get(level)
+        # 直接传入文本框时包装为 TextboxSink, 不在日志线程中操作界面
+        if handle is not None and not progress and not isinstance(handle, TextboxSink):
+            handle = TextboxSink(handle)
         self.handle = handle
         self.progress = progress
         self._format = '%Y-%m-%d %H:%M:%S'
@@ -41,16 +183,9 @@ class LoggingOutput:
             return
 
         if log_path is None:
-            log_path = os.path.abspath(
-                os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(os.path.abspath(__file__)))), 'log.log')
-            )
+            log_path = LOG_PATH
 
-        with open(base_conf, 'r', encoding='utf-8') as file:
-            read_data = json.loads(file.read())
-            read_data['root']['level'] = level
-            read_data['handlers']['file']['filename'] = log_path
-
-        config.dictConfig(read_data)
+        setup(level, log_path, base_conf)
 
     @staticmethod
     def _get_conf() -> str:
@@ -66,12 +201,11 @@ class LoggingOutput:
         return conf_path
 
     def message(self, msg, level, color):
-        message = f'{time.strftime(self._format)} {level}: {msg}\n'
-        if not self.progress:
-            self.handle.insert(tkinter.END, message, color)
-            self.handle.see(tkinter.END)
-        else:
+        if self.progress:
             self.log_list.append([msg, level, color])
+            return
+
+        self.handle.write(f'{time.strftime(self._format)} {level}: {msg}\n', color)
 
     def info(self, msg, *args, **kwargs):
         if self.level <= _LEVEL.get(INFO):
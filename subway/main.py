@@ -1,26 +1,31 @@
 # _author: Coke
 # _date: 2023/7/8 20:02
 
-from typing import Optional, Tuple, Type
+from typing import Optional
 
-import chinese_calendar
-import multiprocessing
+import urllib.parse
 import threading
-import datetime
+import asyncio
 import logging
 import click
 import time
-import json
 import sys
 import os
 
 
 TIME_FORMAT = '%Y-%m-%d'
 
+PROCESS = 'process'  # 每个用户一个进程的抢票引擎
+ASYNC = 'async'  # 所有用户运行在同一个事件循环中的协程抢票引擎
+SHARD = 'shard'  # 用户分片到多个进程, 每个进程以协程运行多个用户的抢票引擎
+ENGINES = (PROCESS, ASYNC, SHARD)
+
 # 检查项目目录完整性
 try:
     sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-    from subway import metro, utils, logger, message
+    from subway import (
+        metro, utils, logger, resolver, scheduler, calibration, coalesce, shard, pool, config, watcher, tokens
+    )
 except ImportError as e:
     raise ImportError('请进入项目路径 subscribe-subway/subway 目录运行此脚本')
 
@@ -43,14 +48,24 @@ class Subway:
         """
         初始化抢票程序
         :param kwargs:
-                subscribeTime -> List: 可抢票的时段, [12, 20]
+                subscribeTime -> List: 可抢票的时段, [12, 20] 或精确到毫秒的 ['12:00:00.150', 20]
                 processes -> int: 进程池最多同时运行的数量
                 dingTalk -> bool: 是否启动钉钉机器人通知
                 confPath -> str: 配置文件路径
                 logPath -> str: 日志文件路径
                 logConf -> str: 日志配置文件
-                app -> Type: 如果通过 app 启动则传递 <customtkinter.CTkTextbox> 类
+                app -> Type: 如果通过 app 启动则传递 <logger.TextboxSink> 或 <customtkinter.CTkTextbox> 类
                 level -> str: 日志等级
+                engine -> str: 抢票引擎, 可选值 process, async, shard
+                shards -> int: shard 引擎的分片(进程)数量, 默认与 CPU 核数一致
+                calibrate -> bool: 是否在抢票前校准服务器时钟偏差及单程延迟, 默认 True
+                domain -> str: 地铁接口地址, 默认为 metro.DOMAIN, 测试时可以指向本地替身服务 server.StandIn
+                dataPath -> str: 运行数据目录, 默认为日志文件目录下的 data 目录, 不会写入被监听的配置文件目录
+                outboxPath -> str: 通知发件箱文件路径, 默认为数据目录下的 outbox.db
+                tracePath -> str: 抢票事件文件目录, 每个抢票时段一个 JSONL 文件, 默认为数据目录下的 trace 目录
+                metricsPort -> int: 以 Prometheus 文本格式提供指标的本机端口, 默认不启动
+                profile -> bool: 是否对每个抢票时段进行性能分析, 报告写入日志文件目录下的 profile 目录
+                planDays -> int: 抢票计划覆盖的天数, 默认为 planner.DAYS
         :return:
         """
         self.subscribe_time = kwargs.pop('subscribeTime', [12, 20])
@@ -61,6 +76,22 @@ class Subway:
         self.logger_level = kwargs.pop('level', 'INFO')
         self.log_path = kwargs.pop('logPath', None)
         self.log_conf = kwargs.pop('logConf', None)
+        self.engine = kwargs.pop('engine', PROCESS)
+        self.shards = kwargs.pop('shards', None) or shard.default_shards()
+        self.calibrate = kwargs.pop('calibrate', True)
+        self.domain = kwargs.pop('domain', None) or metro.DOMAIN
+        self.data_path = kwargs.pop('dataPath', None) or os.path.join(
+            os.path.dirname(os.path.abspath(self.log_path or logger.LOG_PATH)), 'data'
+        )
+        self.outbox_path = kwargs.pop('outboxPath', None)
+        self.trace_path = kwargs.pop('tracePath', None)
+        self.metrics_port = kwargs.pop('metricsPort', None)
+        self.plan_days = kwargs.pop('planDays', None)
+        # 性能分析报告的目录, 未启动性能分析时为 None
+        self.profile_path = os.path.join(
+            os.path.dirname(os.path.abspath(self.log_path or logger.LOG_PATH)), 'profile'
+        ) if kwargs.pop('profile', False) else None
+        assert self.engine in ENGINES, f'不支持的抢票引擎 {self.engine}, 可选值为 {", ".join(ENGINES)}'
         self.ticket = list()
         try:
             self.logger = logger.LoggingOutput(
@@ -71,6 +102,18 @@ class Subway:
             )
         except (Exception, ):
             self.logger = logging
+        _domain = urllib.parse.urlsplit(self.domain)
+        # 抢票前预解析地铁接口域名并测速
+        self.dns = resolver.Resolver(
+            _domain.hostname,
+            _domain.port or (443 if _domain.scheme == 'https' else 80),
+            tls=_domain.scheme == 'https',
+            logger=self.logger
+        )
+        self.scheduler = scheduler.Scheduler(logger=self.logger)  # 抢票时刻、通知及每日切换的中心调度器
+        self.pool: Optional[pool.WorkerPool] = None  # 常驻进程池, 在 run 中启动其他线程之前创建
+        self.watcher: Optional[watcher.Watcher] = None  # 配置文件监听器, 在 async_task 中启动
+        self.balance_cache: Optional[coalesce.BalanceCache] = None  # process 引擎跨进程共享的余票缓存
         # 如果未指定配置文件则使用默认配置文件
         if self.filename is None:
             self.filename = os.path.abspath(os.path.join(
@@ -84,89 +127,60 @@ class Subway:
         # 判断文件是否存在
         assert os.path.exists(self.filename), '配置文件路径不正确, 请检查'
 
-        # 配置文件内容信息
-        self.file_content: str = self._read_file_content()
-
-        # 检查文件配置是否符合规范
-        _result, _message = self._check_content(self.file_content)
-        assert _result, _message
+        # 解析并检查配置文件, 同一个文件版本只解析一次, 所有组件共享解析后的配置
+        # 只在主进程中使用的子系统在此导入, 工作进程通过 booking 执行任务, 不会导入本模块及这些子系统
+        from subway import dispatcher, metrics, outbox, planner
+
+        self.loader = config.Loader(self.filename)
+        self.config: config.Config = self.loader.load()[0]
+        if self.config is None:
+            self.logger.error(f'校验 conf 文件内容失败: {self.loader.error}')
+        assert self.config is not None, self.loader.error
+        self._check_expired()
+        # 多日抢票计划, 每个抢票时刻只包含需要在此时刻抢票的用户
+        self.planner = planner.Planner(self.subscribe_time, self.plan_days or planner.DAYS, logger=self.logger)
+        self.planner.update(self.config)
+        self.grab: Optional[planner.Grab] = None  # 正在执行的抢票时刻
         # 检查 钉钉内容
         if self.dingtalk:
             self._check_dingtalk()
 
-        # 创建一个用户通知容器
-        self.user_notification = dict()
-
-    def _read_file_content(self) -> str:
-        """
-        读取文件内容
-        :return:
-        """
-        with open(self.filename, 'r', encoding='utf-8') as file:
-            content = file.read()
-        return content
-
-    @staticmethod
-    def _check_token(token: str) -> bool:
+        self.tokens: Optional[tokens.TokenRegistry] = None  # Token 通知注册表, 配置了通知渠道时创建
+        # 后台通知分发器, 抢票主循环只负责写入发件箱, 不会等待任何 webhook
+        # 发件箱及事件文件写入单独的数据目录, 避免频繁唤醒配置文件目录的监听器
+        if self.outbox_path is None:
+            os.makedirs(self.data_path, exist_ok=True)
+            self.outbox_path = os.path.join(self.data_path, 'outbox.db')
+        if self.trace_path is None:
+            self.trace_path = os.path.join(self.data_path, 'trace')
+        self.logger.debug(f'通知发件箱路径: {self.outbox_path}')
+        self.dispatcher = dispatcher.Dispatcher(outbox.Outbox(self.outbox_path, logger=self.logger), logger=self.logger)
+
+        # 指标只在主进程中由每个时段返回的事件合并, 参考 metrics.GrabMetrics
+        self.metrics = metrics.GrabMetrics()
+        self.metrics.pending.function(self.dispatcher.outbox.pending)
+        self.exporter: Optional[metrics.Exporter] = None
+        self._configure_dispatcher()
+
+    def _check_expired(self) -> None:
         """
-        检查 Token 是否处于有效期
-        :return: 未过期返回 (True, 过期时间) 否则返回 (False, 过期时间)
+        提示 Token 已经过期的用户, 过期的用户不会参与抢票, 参考 config.Config.active
         """
-        return utils.decode(token) > int(time.time())
+        active = self.config.active()
+        for user in self.config.users:
+            if not user.shakedown and user not in active:
+                self.logger.warning(f'{user.name} 用户 Token 已过期或无法解析, 将不会参与抢票, 请更新 Token')
 
     def _check_dingtalk(self) -> None:
         """
         检查钉钉机器人的 Token 和 签名是否存在
         """
         try:
-            content: dict = json.loads(self.file_content)
-            token, sign = content.get('dingTalkToken'), content.get('dingTalkSign')
-            assert token and sign, '未配置钉钉 webhook 或 sign'
+            assert self.config.ding_token and self.config.ding_sign, '未配置钉钉 webhook 或 sign'
         except AssertionError as error:
             self.logger.error('未配置钉钉 webhook 或 sign')
             raise error
 
-    def _check_content(self, content: str) -> Tuple[bool, Type[Exception]]:
-        """
-        检查文件内容是否符合 项目 要求
-        :param content: 要检查的内容
-        :return: 如果符合 项目 要求则返回 (True, '成功') 否则返回 (False, 失败信息)
-        """
-
-        try:
-            content: dict = json.loads(content)
-            users = content.get('userAgent')
-            head = f'{self.filename} 文件中'
-            tail = f', 请参考 README 文件配置'
-
-            assert isinstance(users, list), f'{head}没有存在 userAgent 或 userAgent 不为数组{tail}'
-
-            assert len(users), f'{head} userAgent 未配置任何数据{tail}'
-
-            required = ['lineName', 'stationName', 'timeSlot', 'token', 'name']
-            for index, user in enumerate(users):
-
-                # 校验 userAgent 中的数据类型
-                assert isinstance(user, dict), f'{head} userAgent 的 item 非对象{tail}'
-
-                # 如果此信息标记为非抢票模式则跳过
-                if user.get('shakedown'):
-                    continue
-
-                tooltip = f'{user.get("name")} 用户'
-                # 校验必填项, 必填项不可为空
-                for item in required:
-                    value = user.get(item)
-                    assert item in user.keys() and value, f'{head} userAgent 的 {tooltip} {item} 未填写或为空{tail}'
-
-                # 校验 Token 是否处于有效期
-                assert self._check_token(user.get('token')), f'{head} userAgent 的 {tooltip} Token 已过期{tail}'
-
-            return True, Exception
-        except (ValueError, AssertionError) as error:
-            self.logger.error(f'校验 conf 文件内容失败: {error}')
-            return False, error
-
     def async_task(self) -> None:
         """
         启动异步任务的钩子
@@ -180,320 +194,397 @@ class Subway:
 
     def run(self) -> None:
         """
-        执行抢票任务的主入口, 过滤国家法定节假日
+        执行抢票任务的主入口, 按多日抢票计划依次执行每个抢票时刻, 参考 planner.Planner
         :return:
         """
-        # 启动异步程序
-        self.async_task()
 
-        while True:
-            now = datetime.datetime.now()
-            today = now - datetime.timedelta(
-                hours=now.hour,
-                minutes=now.minute,
-                seconds=now.second,
-                microseconds=now.microsecond
-            )
-            tomorrow = (today + datetime.timedelta(days=1))
-            self.logger.debug(f'今日: {today.strftime(TIME_FORMAT)} 明日: {tomorrow.strftime(TIME_FORMAT)}')
+        from subway import metrics, profiler
 
-            # 如果为节假日则不需要进行抢票
-            if chinese_calendar.is_holiday(tomorrow):
-                self.logger.info('明天是节假日, 不需要抢票哦~')
-                utils.timer(tomorrow.timestamp())
-                continue
+        # 在启动任何线程之前创建常驻进程池, 之后每个抢票时段复用
+        self.pool = self.create_pool()
 
-            start_time = None
-            # 获取当前时间距离可以抢票的时间戳
-            for item in self.subscribe_time:
-                runtime = (today + datetime.timedelta(hours=item)).timestamp()
-                if time.time() < runtime:
-                    start_time = runtime
-                    self.logger.warning(f'准备今天 {item} 点抢明天({tomorrow.strftime(TIME_FORMAT)})的票!')
-                    break
-
-            # start_time = time.time() + 15  # 调试代码段
-
-            # 如果当前运行时间已经超出了抢票时间则明天运行, 并初始化用户列表
-            if start_time is None:
-                self.ticket.clear()  # 当前结束后清空数据
-                self.logger.info('已经错过今天抢票时间, 明天开始抢票~')
-                utils.timer(tomorrow.timestamp())
-                continue
+        try:
+            # 启动异步程序
+            self.async_task()
+
+            if self.metrics_port:
+                self.exporter = metrics.Exporter(self.metrics.registry, self.metrics_port)
+                self.exporter.start()
+                self.logger.info(f'指标服务已启动: {self.exporter.url}')
+
+            day = None
+            while True:
+                # 抢票时刻由多日计划一次计算, 配置文件或节假日数据变化时才会重新计算
+                grab = self.planner.next()
+                if grab is None:
+                    self.logger.info(f'未来 {self.planner.days} 天没有需要抢票的时段, 不需要抢票哦~')
+                    self.planner.wait(self.scheduler, self.planner.horizon, '计划刷新')
+                    continue
 
-            self.logger.debug(f'下次抢票时间为: {time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(start_time))}')
-            utils.timer(start_time - 10)
+                # 乘车日期变化后清空已抢票成功的用户
+                if grab.date != day:
+                    self.ticket.clear()
+                    day = grab.date
 
-            result = self.start_task(start_time)
+                start_time = grab.instant
+                self.logger.warning(f'准备在 {grab.clock} 抢 {grab.date} 的票! 用户: {grab.clocks}')
+                self.logger.debug(f'下次抢票时间为: {time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(start_time))}')
+                # 等待期间配置文件发生变化时重新获取计划
+                if not self.planner.wait(self.scheduler, start_time - 10, '抢票准备'):
+                    continue
+                try:
+                    self.dns.prepare()
+                except (Exception, ) as error:
+                    self.logger.error(f'预解析域名失败, 使用系统解析: {error}')
+
+                if self.pool is not None:
+                    self.pool.check()
+
+                self.grab = grab
+                fire_time = self.fire_time(start_time)
+                # 性能分析只覆盖抢票时段, 每个用户的任务在各自的进程或线程中单独分析
+                with profiler.Profiler(self.profile_path, 'start_task', fire_time, logger=self.logger):
+                    result = self.start_task(fire_time)
+                self.planner.done(grab)
+                self.grab = None
+                self.scheduler.log_report()
+                self.write_trace(fire_time, result)
+                self.metrics.record(fire_time, result, time.time(), {user.name: user.key for user in self.config.users})
+
+                digest = []
+                for item in result:
+
+                    if self.app:
+                        _logger_list = item.get('loggerList', [])
+                        for __logger in _logger_list:
+                            try:
+                                logger_message = getattr(self.logger, 'message')
+                                logger_message(*__logger)
+                            except AttributeError:
+                                break
+
+                    # 如果存在用户未抢到票, 则重置用户列表, 进行下次尝试
+                    if item.get('result'):
+                        self.ticket.append(item.get('name'))
+
+                    _message = f'{item.get("name")}抢票: {"成功" if item.get("result") else "失败"}'
+                    self.logger.info(_message)
+                    digest.append(_message)
+
+                # 本时段所有用户的结果汇总为一条通知, 由后台线程发送到每个渠道
+                _clock = time.strftime('%H:%M', time.localtime(start_time))
+                self.dispatcher.digest(
+                    f'{grab.date} 抢票结果 ({_clock} 时段)', digest, key=f'digest:{int(start_time)}'
+                )
+        finally:
+            # 退出时关闭进程池及 Manager, 避免遗留工作进程及信号量
+            self.close()
+
+    def write_trace(self, start_time: float, result: list) -> None:
+        """
+        将本时段所有用户的事件写入 JSONL 文件, 可以通过 subway trace 命令转换为 Chrome / Perfetto trace 格式
+        :param start_time: 抢票时刻
+        :param result: 抢票任务的结果
+        :return:
+        """
+        from subway import trace
+        filename = trace.path(self.trace_path, start_time)
+        try:
+            count = trace.write(filename, (event for item in result for event in item.get('trace', [])))
+        except OSError as error:
+            self.logger.error(f'写入抢票事件失败: {error}')
+            return
+        self.logger.debug(f'已写入 {count} 个抢票事件: {filename}')
 
-            for item in result:
+    def fire_time(self, start_time: float) -> float:
+        """
+        在抢票前的等待时间内校准服务器时钟偏差及单程延迟, 使请求到达服务器时恰好为放票时刻
+        :param start_time: 本地时钟下的放票时间戳
+        :return: 返回校准后的发出时间戳
+        """
 
-                if self.app:
-                    _logger_list = item.get('loggerList', [])
-                    for __logger in _logger_list:
-                        try:
-                            logger_message = getattr(self.logger, 'message')
-                            logger_message(*__logger)
-                        except AttributeError:
-                            break
+        if not self.calibrate:
+            return start_time
 
-                # 如果存在用户未抢到票, 则重置用户列表, 进行下次尝试
-                if item.get('result'):
-                    self.ticket.append(item.get('name'))
+        _metro = metro.Metro(None, pool_size=1, dns=self.dns, domain=self.domain)
+        try:
+            result = calibration.calibrate(_metro, logger=self.logger)
+        finally:
+            _metro.close()
 
-                _message = f'{item.get("name")}抢票: {"成功" if item.get("result") else "失败"}'
-                self.logger.info(_message)
+        if not result.samples:
+            return start_time
 
-                if self.dingtalk:
-                    _conf_data = json.loads(self.file_content)
-                    _token, _sign = _conf_data.get('dingTalkToken'), _conf_data.get('dingTalkSign')
-                    _ding = message.DingTalk(_token, _sign, logger=self.logger)
-                    _ding.text(_message)
+        fire_time = result.fire(start_time)
+        self.logger.info(
+            f'服务器时钟偏差 {round(result.offset * 1000, 1)} ms (±{round(result.uncertainty * 1000, 1)} ms), '
+            f'单程延迟 {round(result.latency * 1000, 1)} ms, 提前 {round((start_time - fire_time) * 1000, 1)} ms 发出'
+        )
+        return fire_time
 
-    def task_continue(self, item: dict) -> bool:
+    def task_continue(self, user: config.User) -> bool:
         # 忽略用户
-        if item.get('shakedown'):
+        if user.shakedown:
             return True
 
         # 如果用户 Token 已经过期则忽略此用户
-        if not self._check_token(item.get('token')):
+        if user.expired():
             return True
 
         # 如果用户当前已经抢票成功则忽略
-        if item.get('name') in self.ticket:
+        if user.name in self.ticket:
             return True
 
-    def start_task(self, start_time: float) -> list:
-        # 启动进程池
-        pool = multiprocessing.Pool(self.processes)
-        task_result = []
-        for item in json.loads(self.file_content).get('userAgent'):
+        # 用户不在本次抢票时刻的计划中, 如配置了其他抢票时间或跳过了当天
+        if self.grab is not None and user.name not in self.grab.users:
+            return True
 
-            _continue = self.task_continue(item)
+    def task_items(self, start_time: float, cache=None) -> list:
+        """
+        生成需要执行抢票任务的用户参数, 过滤掉屏蔽、Token 过期及已经抢票成功的用户
+        :param start_time: 开始执行的时间
+        :param cache: 所有用户共享的余票缓存, 参考 coalesce.BalanceCache
+        :return: 返回 Subway.task 的 kwargs 列表
+        """
+
+        items = []
+        for user in self.config.users:
+
+            _continue = self.task_continue(user)
             if _continue:
                 continue
 
-            item['startTime'] = start_time
+            # 只传递抢票任务需要的字段, 抢票计划已经在解析配置时合并了全局计划
+            item = user.task_kwargs()
+            # 合并到同一个抢票时刻的用户按各自的抢票时间发出请求
+            item['startTime'] = start_time + (self.grab.offset(user.name) if self.grab is not None else 0)
             item['level'] = self.logger_level
             item['logPath'] = self.log_path
             item['logConf'] = self.log_conf
-            result = pool.apply_async(self.task, kwds=dict(kwargs=item, subway_result=None))
-            task_result.append(result)
-
-        pool.close()
-        pool.join()
+            item['app'] = self.app is not None  # 只有通过 app 启动时才需要将日志带回主进程展示
+            item['profile'] = self.profile_path
+            item['dns'] = self.dns
+            item['domain'] = self.domain
+            item['balanceCache'] = cache
+            items.append(item)
 
-        return list(map(lambda x: x.get(), task_result))
+        return items
 
-    @staticmethod
-    def task(kwargs: dict, subway_result: list = None) -> dict:
+    def create_pool(self) -> Optional[pool.WorkerPool]:
+        """
+        创建常驻进程池, 协程引擎不需要进程池
+        :return:
         """
-        执行抢票程序任务
-        :param kwargs:
-                startTime -> int: 开始执行的时间
-                lineName -> str: 线路名称
-                stationName -> str: 站点名称
-                timeSlot -> str: 抢票时段
-                token -> str: 地铁系统的 Authorization 字段
-                interval -> Union[int, float]: 抢票失败后的重试间隔
-                frequency -> int: 抢票失败后的重试次数
-                level -> str: 日志等级
-                name -> str: 当前用户名称
-                logPath -> str: 日志记录路径
-                logConf -> str: 日志配置路径
-        :param subway_result: 线程存储信息数据表
-        :return: 返回是否抢票成功
-        """
-
-        _start = kwargs.pop('startTime', 0)
-        _line = kwargs.pop('lineName', '昌平线')
-        _station = kwargs.pop('stationName', '沙河站')
-        time_slot = kwargs.pop('timeSlot', '0720-0730')
-        token = kwargs.pop('token', None)
-        interval = kwargs.pop('interval', 1)
-        frequency = kwargs.pop('frequency', 7)
-        level = kwargs.pop('level', 'INFO')
-        kwargs['result'] = True
-        log_path = kwargs.pop('logPath', None)
-        try:
-            _logger = logger.LoggingOutput(
-                level,
-                log_path=log_path,
-                log_conf=kwargs.pop('logConf', None),
-                handle=True,
-                progress=True
-            )
-        except (Exception, ):
-            _logger = logging
-        _metro = metro.Metro(token)
-        name = kwargs.get('name')
-
-        # 如果已存在当前时段的预约则终止
-        exist = _metro.appointment(stationName=_station, arrivalTime=time_slot, timeout=2)
-        if exist:
-            _logger.info('检测到已存在预约, 终止程序')
-            kwargs['loggerList'] = _logger.log_list
-            if subway_result is not None:
-                subway_result.append(kwargs)
-
-            return kwargs
-
-        utils.timer(_start)
-
-        for item in range(frequency):
-            _balance = _metro.balance(stationName=_station, timeSlot=time_slot)
-            exist = _metro.appointment(stationName=_station, arrivalTime=time_slot, timeout=2)
-
-            # 如果存在预约则终止
-            if exist:
-                _logger.info('抢票成功')
-                break
-
-            if _balance or not item:
-                _logger.info(f'{_station}-{time_slot} 时段存在余票, 准备抢票')
-
-                thread_list = []
-                for _ in range(3):
-                    thread = threading.Thread(target=_metro.shakedown, kwargs=dict(
-                        lineName=_line,
-                        stationName=_station,
-                        timeSlot=time_slot
-                    ), daemon=True)
-                    thread.start()
-                    thread_list.append(thread)
-
-                for _thread in thread_list:
-                    _thread.join()
-
-                result = _metro.appointment(stationName=_station, arrivalTime=time_slot, timeout=5)
-                if result:
-                    break
-            else:
-                _logger.info(f'{_station}-{time_slot} 时段已经没有余票了...')
-            time.sleep(interval)
 
-        else:
-            _logger.info(f'程序运行了 {frequency} 次, 没有抢到票...')
-            kwargs['result'] = False
+        if self.engine == ASYNC:
+            return None
+
+        # 工作进程的日志写入主进程的日志队列, 由主进程唯一的监听线程写入文件
+        _pool = pool.WorkerPool(
+            self.shards if self.engine == SHARD else self.processes,
+            logger=self.logger,
+            logQueue=logger.log_queue(),
+            level=self.logger_level
+        )
+        _pool.start()
+        if self.engine == PROCESS:
+            self.balance_cache = coalesce.BalanceCache.shared(_pool.manager())
+        return _pool
+
+    def worker_pool(self) -> pool.WorkerPool:
+        """ 获取常驻进程池, 未通过 run 启动时临时创建 """
+        if self.pool is None:
+            self.pool = self.create_pool()
+        return self.pool
+
+    def close_pool(self) -> None:
+        """ 关闭常驻进程池及其 Manager """
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
+            self.balance_cache = None
+
+    def close(self) -> None:
+        """ 停止指标服务, 关闭进程池及通知分发器 """
+        if self.exporter is not None:
+            self.exporter.stop()
+            self.exporter = None
+        self.close_pool()
+        self.dispatcher.close()
 
-        # 由于高峰期接口容易超时, 最后程序运行完成后再进行一次断言
-        kwargs['result'] = _metro.appointment(stationName=_station, arrivalTime=time_slot)
-        _logger.log_list.insert(0, [f'↘↘↘↘↘↘↘↘↘↘ {name} ↙↙↙↙↙↙↙↙↙↙', logger.WARNING, 'warning'])
-        _logger.log_list.append([f'↗↗↗↗↗↗↗↗↗↗ {name} ↖↖↖↖↖↖↖↖↖↖', logger.WARNING, 'warning'])
-        kwargs['loggerList'] = _logger.log_list
+    def start_task(self, start_time: float) -> list:
+        if self.engine == ASYNC:
+            return asyncio.run(self.start_task_async(start_time))
 
-        if subway_result is not None:
-            subway_result.append(kwargs)
+        if self.engine == SHARD:
+            return self.start_task_shard(start_time)
 
-        return kwargs
+        # 任务下发到常驻进程池, 余票缓存由进程池的 Manager 托管以便在进程间共享
+        # 下发 booking 中的任务函数, 工作进程不需要导入本模块
+        from subway import booking
+        temporary = self.pool is None
+        _pool = self.worker_pool()
+        try:
+            items = self.task_items(start_time, self.balance_cache)
+            return _pool.run(
+                booking.task, items, failure=booking.failure, deadline=booking.deadline(items), subway_result=None
+            )
+        finally:
+            # 未通过 run 启动时进程池只用于本时段
+            if temporary:
+                self.close_pool()
 
-    def notification(self) -> None:
+    @staticmethod
+    def task(kwargs: dict, subway_result: list = None) -> dict:
+        """ 执行抢票程序任务, 参考 booking.task """
+        from subway import booking
+        return booking.task(kwargs, subway_result)
+
+    async def start_task_async(self, start_time: float, items: list = None) -> list:
         """
-        获取配置文件中的数据并发送钉钉通知
-        异步调用此函数, 否则会出现死循环
+        在当前线程的事件循环中以协程的方式运行所有用户的抢票任务
+        所有用户共享同一个连接池, 避免为每个用户创建进程或线程
+        :param start_time: 开始执行的时间
+        :param items: 已经生成的用户参数, 参考 task_items, 为 None 时按 start_time 生成
         :return:
         """
 
-        # 如果未启动 钉钉 则返回
-        if not self.dingtalk:
-            return
-
-        while True:
-            conf: dict = json.loads(self.file_content)
-            users = conf.get('userAgent')
-            token, sign = conf.get('dingTalkToken'), conf.get('dingTalkSign')
-            ding = message.DingTalk(token, sign, logger=self.logger)
+        from subway import booking
+        if items is None:
+            items = self.task_items(start_time, coalesce.AsyncBalanceCache())
+        return await booking.gather_async(items, self.dns)
 
-            # 遍历用户列表
-            for user in users:
-                user_name = user.get('name')
-                user_token = user.get('token')
-
-                # shakedown 视为废弃用户, 跳过消息
-                if user.get('shakedown'):
-                    self.logger.debug(f'{user_name} shakedown 参数为 True')
-                    continue
-
-                # 检查用户是否符合发送条件
-                whether = self._check_notification(user_token, user_name)
+    def start_task_shard(self, start_time: float) -> list:
+        """
+        将用户按站点及时段均衡分片到多个进程中, 每个进程在自己的事件循环中以协程运行分片内的所有用户
+        进程数量只与分片数量有关, 不随用户数量增长
+        :param start_time: 开始执行的时间
+        :return:
+        """
 
-                # 如果不需要则跳过此用户
-                if whether is None:
-                    self.logger.debug(f'{user_name} 不需要发送通知')
-                    continue
+        from subway import booking
+        users = self.task_items(start_time)
+        shards = shard.partition(users, self.shards, booking.concurrency)
+        for index, items in enumerate(shards):
+            slots = len({(x.get('stationName'), x.get('timeSlot')) for x in items})
+            self.logger.debug(f'分片 {index}: {len(items)} 个用户, {slots} 个站点时段')
+            if len(items) > shard.USERS:
+                self.logger.warning(f'分片 {index} 承载了 {len(items)} 个用户, 超过建议值 {shard.USERS}, 请增加分片数量')
 
-                ding.text(whether)
-                self.logger.warning(whether)
+        if not shards:
+            return []
 
-            # 定时器为明天 10 点
-            now = datetime.datetime.now()
-            today = now - datetime.timedelta(
-                hours=now.hour,
-                minutes=now.minute,
-                seconds=now.second,
-                microseconds=now.microsecond
+        temporary = self.pool is None
+        try:
+            result = self.worker_pool().run(
+                booking.task_shard, shards, key='users', failure=lambda items, error: [
+                    booking.failure(item, error) for item in items
+                ], deadline=booking.deadline(users)
             )
-            tomorrow = (today + datetime.timedelta(days=1, hours=10)).timestamp()
-            utils.timer(tomorrow)
+        finally:
+            if temporary:
+                self.close_pool()
+        return [item for items in result for item in items]
 
-    def _check_notification(self, token: str, key: str, default: int = 86400) -> Optional[str]:
+    def notification(self) -> None:
         """
-        检查是否需要发送通知
-        :param token: 需要检查的 token
-        :param key: 用户的 Key
-        :param default: token 小于 default 后会发送通知
+        注册所有用户的 Token 预警及过期通知, 通知会在条件成立的时刻由调度器触发
         :return:
         """
 
-        # 如果用户的 Key 不存在于通知容器中则添加
-        if key not in self.user_notification:
-            self.logger.debug(f'{key} 没有在用户容器中')
-            self.user_notification[key] = None
+        # 如果未配置任何通知渠道则返回
+        if not self.dispatcher.channels or self.tokens is not None:
+            return
 
-        # 如果用户容器中的 Key 类型不是 dict 则进行初始化
-        if not isinstance(self.user_notification[key], dict):
-            self.logger.debug(f'{key} 用户在容器中未发送过任何通知')
-            self.user_notification[key] = dict(
-                overdue=True,
-                warning=True
-            )
+        self.tokens = tokens.TokenRegistry(self.scheduler, self._notify, logger=self.logger)
+        self.tokens.update(self.config.users)
 
-        overdue = utils.decode(token)
-        if overdue < int(time.time()) and self.user_notification.get(key).get('overdue'):
-            self.user_notification[key]['overdue'] = False
-            return f'{key} 用户 Token 已过期'
-        elif 0 < overdue - int(time.time()) < default and self.user_notification.get(key).get('warning'):
-            self.user_notification[key]['warning'] = False
-            return f'{key} 用户 Token 将在 {round((overdue - int(time.time())) / 3600, 1)} 小时后过期'
+    def _notify(self, text: str, key: str = None) -> None:
+        """
+        发送 Token 通知, 只负责写入发件箱
+        :param text: 通知内容
+        :param key: 幂等键, 重启后相同的通知不会重复发送
+        :return:
+        """
+        self.logger.warning(text)
+        self.dispatcher.send(text, key=key)
 
-    def _check_file_change(self, interval: float = 5.0) -> None:
+    def _configure_dispatcher(self) -> None:
+        """
+        按当前配置版本更新通知渠道, 启动钉钉通知时发送到钉钉, 配置了 larkToken 时发送到飞书
+        :return:
+        """
+        from subway import dispatcher
+        senders = dict()
+        if self.dingtalk and self.config.ding_token:
+            senders[dispatcher.DINGTALK] = self.dispatcher.dingtalk(self.config.ding_token, self.config.ding_sign)
+        if self.config.lark_token:
+            senders[dispatcher.LARK] = self.dispatcher.lark(self.config.lark_token, self.config.lark_sign)
+        self.dispatcher.configure(senders)
+
+    def _check_file_change(self, interval: float = watcher.INTERVAL) -> None:
         """
-        检查文件是否出现变更
+        监听文件变更, Linux 下由内核通知, 其他平台按 interval 检查文件状态
         异步调用此函数, 否则会出现死循环
+        :param interval: 不支持 inotify 时检查文件状态的间隔
         :return:
         """
 
-        while True:
-            # 检查文件内容是否发生变化
-            new_content = self._read_file_content()
-            _result, _message = self._check_content(new_content)
-            if new_content != self.file_content and _result:
-                self.logger.info('文件发生变化')
+        self.watcher = watcher.Watcher(self.filename, self._reload, interval=interval, logger=self.logger)
+        self.watcher.run()
 
-                # 处理文件内容变化的逻辑
-                self.file_content = new_content
-                self.user_notification.clear()
-                self.ticket.clear()
+    def _reload(self) -> None:
+        """
+        重新加载配置文件, 只重置新增、删除及内容发生变化的用户的抢票及通知状态
+        :return:
+        """
+
+        error = self.loader.error
+        try:
+            _config, changed = self.loader.load()
+        except OSError as _error:
+            self.logger.error(f'读取 conf 文件失败: {_error}')
+            return
 
-            # 每隔一段时间检查一次文件内容变化
-            time.sleep(interval)
+        # 同一个错误版本只输出一次
+        if self.loader.error is not None and self.loader.error is not error:
+            self.logger.error(f'校验 conf 文件内容失败: {self.loader.error}')
+
+        if not changed:
+            return
+
+        names = config.diff(self.config, _config)
+        self.config = _config
+        self.logger.info(f'文件发生变化, 变更的用户: {", ".join(map(str, sorted(names, key=str))) or "无"}')
+
+        # 处理文件内容变化的逻辑
+        self._check_expired()
+        self.planner.update(_config)
+        self._configure_dispatcher()
+        if self.tokens is not None:
+            self.tokens.update(_config.users)
+        else:
+            self.notification()
+        self.ticket[:] = [name for name in self.ticket if name not in names]
 
 
-__subscribe = '设置抢票时间段, 官方提示为每日12点、20点方法次日预约名额, 默认值为 "12,20" 如需多个时间点请以英文 , 分割'
+__subscribe = (
+    '设置抢票时间段, 官方提示为每日12点、20点方法次日预约名额, 默认值为 "12,20" 如需多个时间点请以英文 , 分割, '
+    '支持精确到毫秒的时间, 如 "12:00:00.150,20"'
+)
 __processes = '进程池最多同时运行的数量, 默认最多同时启动 5 个线程'
 __dingtalk = '是否启动钉钉机器人通知, 启动为 1 , 默认不启动 0, 如需启动请在配置文件中指定钉钉机器人的 webhook 和 sign'
 __path = '指定的配置文件路径, 如不指定则使用项目下 conf/conf.json 文件'
 __level = '日志等级, 可选值为 INFO, DEBUG'
+__calibrate = '是否在抢票前校准服务器时钟偏差及单程延迟, 启动为 1 , 不启动为 0, 默认启动'
+__domain = '地铁接口地址, 默认为 https://webapi.mybti.cn, 可以指向本地替身服务进行演练, 参考 subway/server.py'
+__engine = (
+    '抢票引擎, process 为每个用户启动一个进程, async 为所有用户运行在同一个事件循环中, '
+    'shard 为将用户分片到多个进程中并在进程内以协程运行, 适合上百个用户, 默认 process'
+)
+__shards = 'shard 引擎的分片(进程)数量, 默认与 CPU 核数一致'
+__profile = '是否对每个抢票时段进行性能分析 (cProfile 及 tracemalloc), 启动为 1, 报告写入日志文件目录下的 profile 目录, 默认 0 不启动'
+__metrics = '以 Prometheus 文本格式在 http://127.0.0.1:<端口>/metrics 提供指标, 默认 0 不启动'
 
 
 @click.command()
@@ -502,13 +593,44 @@ __level = '日志等级, 可选值为 INFO, DEBUG'
 @click.option('--dingtalk', '-dt', help=__dingtalk, default=0)
 @click.option('--path', '-p', help=__path, default='')
 @click.option('--level', '-l', help=__level, default='INFO')
-def command(subscribe: str, processes: int, dingtalk: int, path: str, level: str) -> None:
-    subscribe = list(map(lambda x: int(x), subscribe.split(',')))
+@click.option('--engine', '-e', help=__engine, default=PROCESS, type=click.Choice(ENGINES))
+@click.option('--calibrate', '-c', help=__calibrate, default=1)
+@click.option('--domain', '-d', help=__domain, default='')
+@click.option('--shards', '-sh', help=__shards, default=0)
+@click.option('--metrics', '-m', 'metrics_port', help=__metrics, default=0)
+@click.option('--profile', '-pf', help=__profile, default=0)
+def command(
+        subscribe: str,
+        processes: int,
+        dingtalk: int,
+        path: str,
+        level: str,
+        engine: str,
+        calibrate: int,
+        domain: str,
+        shards: int,
+        metrics_port: int,
+        profile: int
+) -> None:
+    """ 启动抢票程序 """
+    subscribe = utils.subscribe(subscribe)
     dingtalk = bool(dingtalk)
     path = path if path else None
     level_list = ['INFO', 'DEBUG']
     level = 'INFO' if level.upper() not in level_list else level
-    Subway(subscribeTime=subscribe, processes=processes, dingTalk=dingtalk, confPath=path, level=level).run()
+    Subway(
+        subscribeTime=subscribe,
+        processes=processes,
+        dingTalk=dingtalk,
+        confPath=path,
+        level=level,
+        engine=engine,
+        calibrate=bool(calibrate),
+        domain=domain or None,
+        shards=shards or None,
+        metricsPort=metrics_port or None,
+        profile=bool(profile)
+    ).run()
 
 
 if __name__ == '__main__':
@@ -28,15 +28,23 @@ class DingTalk:
         :param own: 是否 @ 所有人
         :param kwargs:
                 logger -> Type: <logger.LoggingOutput> 类
+                session -> requests.Session: 复用连接的会话, 默认每次请求新建连接
         """
-        self.url = webhook
+        self.webhook = webhook
+        self.secret = secret
         self.body = {
             'at': dict(atMobiles=mobile, atUserIds=user, isAtAll=own)
         }
-        if secret:
-            timestamp, sign = self.sign(secret)
-            self.url += f'&timestamp={timestamp}&sign={sign}'
-        self.logger = kwargs.pop('logger')
+        self.logger = kwargs.pop('logger', None) or logging
+        self.session = kwargs.pop('session', None) or requests
+
+    @property
+    def url(self) -> str:
+        """ 签名的有效期为一小时, 每次请求时重新签名 """
+        if not self.secret:
+            return self.webhook
+        timestamp, sign = self.sign(self.secret)
+        return f'{self.webhook}&timestamp={timestamp}&sign={sign}'
 
     @staticmethod
     def sign(secret) -> Tuple[str, str]:
@@ -55,7 +63,7 @@ class DingTalk:
     @property
     def request(self):
         try:
-            response = requests.request('POST', self.url, json=self.body)
+            response = self.session.request('POST', self.url, json=self.body, timeout=10)
             if response.status_code != 200:
                 self.logger.error(f'发送机器人信息失败, 服务状态码 "{response.status_code}"')
                 return
@@ -145,13 +153,20 @@ class Lark:
     详情请查看官方地址: https://open.feishu.cn/document/ukTMukTMukTM/ucTM5YjL3ETO24yNxkjN#d65d109d
     """
 
-    def __init__(self, webhook, secret=None):
+    def __init__(self, webhook, secret=None, **kwargs):
+        """
+        发送飞书机器人消息
+        :param webhook: 群机器人的 webhook
+        :param secret: 是否加签, 如果加签则需要传递签名Key
+        :param kwargs:
+                logger -> Type: <logger.LoggingOutput> 类
+                session -> requests.Session: 复用连接的会话, 默认每次请求新建连接
+        """
         self.url = webhook
+        self.secret = secret
         self.body = {}
-        if secret:
-            timestamp, sign = self.sign(secret)
-            self.body['timestamp'] = timestamp
-            self.body['sign'] = sign
+        self.logger = kwargs.pop('logger', None) or logging
+        self.session = kwargs.pop('session', None) or requests
 
     @staticmethod
     def sign(secret) -> Tuple[int, str]:
@@ -167,29 +182,48 @@ class Lark:
 
     @property
     def request(self) -> Union[dict, None]:
+        # 签名的有效期为一小时, 每次请求时重新签名
+        if self.secret:
+            self.body['timestamp'], self.body['sign'] = self.sign(self.secret)
+
         try:
-            response = requests.request('POST', self.url, json=self.body)
+            response = self.session.request('POST', self.url, json=self.body, timeout=10)
 
             if response.status_code != 200:
-                logging.info(f'发送飞书通知错误, 状态码: {response.status_code}')
+                self.logger.error(f'发送飞书通知错误, 状态码: {response.status_code}')
                 return
 
             code = response.json().get('code')
             if code:
-                logging.info(f'发送飞书通知错误, 错误信息: {response.json().get("msg")}')
+                self.logger.error(f'发送飞书通知错误, 错误信息: {response.json().get("msg")}')
                 return
 
-            logging.info('飞书机器人消息发送成功')
+            self.logger.info('飞书机器人消息发送成功')
             return response.json()
 
         except Exception as e:
-            logging.error(e)
+            self.logger.error(f'发送飞书通知报错: {e}')
 
     def text(self, text) -> request:
         self.body['msg_type'] = 'text'
         self.body['content'] = dict(text=text)
         return self.request
 
+    def markdown(self, title, text) -> request:
+        """
+        飞书机器人 markdown 消息, 以不带按钮的卡片发送
+        :param title: 标题
+        :param text: 内容, 支持 lark_md 语法
+        :return:
+        """
+        self.body['msg_type'] = 'interactive'
+        self.body['card'] = dict(
+            config=dict(wide_screen_mode=True),
+            header=dict(template='turquoise', title=dict(content=title, tag='plain_text')),
+            elements=[dict(tag='div', text=dict(tag='lark_md', content=text))]
+        )
+        return self.request
+
     def interactive(self, title, content, button_text, url) -> requests:
         self.body['msg_type'] = 'interactive'
         self.body['card'] = {}
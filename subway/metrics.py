@@ -0,0 +1,279 @@
+# _author: Coke
+# _date: 2023/9/24 15:38
+
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import threading
+import bisect
+import math
+import abc
+
+from subway import trace
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'  # Prometheus 文本格式
+HOST = '127.0.0.1'  # 只监听本机, 由本机的 Prometheus 或 node_exporter 转发抓取
+
+# 请求耗时的分桶, 单位秒, 覆盖从本地替身服务到高峰期超时的范围
+LATENCY = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0)
+# 定时器唤醒误差的分桶, 单位秒
+LATENESS = (0.0001, 0.0005, 0.001, 0.002, 0.005, 0.01, 0.05)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names: Tuple[str, ...], values: Tuple, extra: str = '') -> str:
+    items = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        items.append(extra)
+    return '{' + ','.join(items) + '}' if items else ''
+
+
+def _number(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric(abc.ABC):
+    """ 指标的基类, 每组标签值对应一个时间序列 """
+
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple, object] = dict()
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> Tuple:
+        assert set(labels) == set(self.labels), f'{self.name} 的标签必须为 {", ".join(self.labels)}'
+        return tuple(labels[name] for name in self.labels)
+
+    @abc.abstractmethod
+    def samples(self) -> List[str]:
+        """ 每个时间序列的文本格式, 不包含 HELP 及 TYPE """
+
+    def render(self) -> str:
+        head = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        return '\n'.join(head + self.samples())
+
+
+class Counter(Metric):
+    """ 只增不减的计数器 """
+
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f'{self.name}{_labels(self.labels, key)} {_number(value)}' for key, value in items]
+
+
+class Gauge(Metric):
+    """ 可增可减的瞬时值, 也可以在抓取时由函数计算 """
+
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()):
+        super(Gauge, self).__init__(name, documentation, labels)
+        self._function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def function(self, func: Callable[[], float]) -> None:
+        """ 抓取时调用 func 获取当前值, 只支持没有标签的指标 """
+        self._function = func
+
+    def samples(self) -> List[str]:
+        if self._function is not None:
+            try:
+                return [f'{self.name} {_number(self._function())}']
+            except (Exception, ):
+                return []
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f'{self.name}{_labels(self.labels, key)} {_number(value)}' for key, value in items]
+
+
+class Histogram(Metric):
+    """ 固定分桶的直方图, 每次观测只需要一次二分查找 """
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = (), buckets: Iterable[float] = LATENCY):
+        super(Histogram, self).__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+
+        lines = []
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf, ), counts):
+                cumulative += count
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f'{self.name}_bucket{_labels(self.labels, key, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.labels, key)} {_number(total)}')
+            lines.append(f'{self.name}_count{_labels(self.labels, key)} {cumulative}')
+        return lines
+
+
+class Registry:
+    """ 指标注册表, 按注册顺序输出 Prometheus 文本格式 """
+
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = dict()
+
+    def register(self, metric: Metric) -> Metric:
+        assert metric.name not in self.metrics, f'指标 {metric.name} 已存在'
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: Iterable[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labels))
+
+    def gauge(self, name: str, documentation: str, labels: Iterable[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labels))
+
+    def histogram(self, name: str, documentation: str, labels: Iterable[str] = (),
+                  buckets: Iterable[float] = LATENCY) -> Histogram:
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def render(self) -> str:
+        return '\n'.join(metric.render() for metric in self.metrics.values()) + '\n'
+
+
+class GrabMetrics:
+    """
+    抢票程序的指标
+    工作进程之间不共享内存, 各进程只在 trace.Tracer 中记录事件, 事件随抢票结果返回主进程后再合并到指标中
+    因此指标只在主进程中更新, 不需要跨进程的锁或共享内存
+    """
+
+    def __init__(self, registry: Registry = None):
+        self.registry = registry if registry is not None else Registry()
+        self.requests = self.registry.counter(
+            'subway_requests_total', '地铁接口请求数量, outcome 为 ok、error(非 200)、timeout、network(连接重置等网络异常)、exception 或 cancelled',
+            ('phase', 'outcome')
+        )
+        self.responses = self.registry.counter(
+            'subway_responses_total', '地铁接口响应数量, 按状态码区分', ('phase', 'status')
+        )
+        self.latency = self.registry.histogram(
+            'subway_request_duration_seconds', '地铁接口请求耗时', ('phase', ), LATENCY
+        )
+        self.lateness = self.registry.histogram(
+            'subway_wake_lateness_seconds', '定时器实际唤醒时间与计划时间的误差', (), LATENESS
+        )
+        self.grabs = self.registry.counter(
+            'subway_grabs_total', '抢票结果数量, 按站点及时段区分', ('station', 'slot', 'result')
+        )
+        self.windows = self.registry.counter('subway_windows_total', '已完成的抢票时段数量')
+        self.window = self.registry.gauge('subway_window_duration_seconds', '最近一个抢票时段从抢票时刻到全部任务完成的耗时')
+        self.last = self.registry.gauge('subway_window_timestamp_seconds', '最近一个抢票时段的抢票时刻')
+        self.pending = self.registry.gauge('subway_outbox_pending', '通知发件箱中待发送的通知数量')
+
+    def observe(self, events: Iterable[dict]) -> None:
+        """ 合并一个用户的事件, 参考 trace.Tracer """
+        for item in events:
+            phase = item.get('phase')
+            if item.get('uri') is not None:
+                self.requests.inc(phase=phase, outcome=item.get('outcome'))
+                if item.get('status') is not None:
+                    self.responses.inc(phase=phase, status=item['status'])
+                self.latency.observe(item.get('latency', 0) / 1000, phase=phase)
+            elif phase == trace.WAKE:
+                self.lateness.observe(max(item.get('latency', 0), 0) / 1000)
+
+    def record(self, start_time: float, result: List[dict], finished: float,
+               keys: Dict[str, Tuple[str, str]] = None) -> None:
+        """
+        合并一个抢票时段的结果
+        :param start_time: 抢票时刻
+        :param result: 抢票任务的结果, 参考 Subway.task
+        :param finished: 全部任务完成的时间戳
+        :param keys: 用户名称: (站点, 时段), 参考 config.User.key
+        :return:
+        """
+
+        keys = keys or dict()
+        for item in result:
+            self.observe(item.get('trace', []))
+            # 抢到备选站点或时段时按实际预约的站点及时段统计
+            station, slot = item.get('booked') or keys.get(item.get('name'), ('', ''))
+            self.grabs.inc(station=station, slot=slot, result='success' if item.get('result') else 'failure')
+        self.windows.inc()
+        self.window.set(max(finished - start_time, 0))
+        self.last.set(start_time)
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+
+        body = self.server.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class Exporter:
+    """ 以 Prometheus 文本格式提供指标的本地 HTTP 服务, 在后台线程中运行 """
+
+    def __init__(self, registry: Registry, port: int, host: str = HOST):
+        """
+        :param registry: <Registry> 类
+        :param port: 监听端口, 为 0 时随机选择
+        :param host: 监听地址, 默认只监听本机
+        """
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    @property
+    def url(self) -> str:
+        return f'http://{self.host}:{self.port}/metrics'
+
+    def start(self) -> None:
+        self._server = ThreadingHTTPServer((self.host, self.port), _Handler)
+        self._server.daemon_threads = True
+        self._server.registry = self.registry
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, name='metrics', daemon=True).start()
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
@@ -1,24 +1,172 @@
 # _author: Coke
 # _date: 2023/3/16 13:06
 
-from typing import Union, Dict, List
-from requests.exceptions import ReadTimeout
+from typing import Generator, Union, Dict, List, Optional
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ReadTimeout, RequestException
 from urllib3.exceptions import ReadTimeoutError
 
+import urllib.parse
+import threading
 import datetime
 import requests
+import asyncio
 import logging
+import time
+
+from subway import resolver, coalesce, record, utils
+
+aiohttp = utils.lazy_import('aiohttp')  # 只有协程引擎使用, 进程及线程引擎不需要导入
 
 DOMAIN = 'https://webapi.mybti.cn'  # 域名
 FORMAT = '%Y%m%d'  # 格式化时间
+POOL_SIZE = 3  # 连接池大小, 与 Subway.task 单次并发抢票的请求数量保持一致
+NETWORK = (RequestException, OSError)  # 连接被重置、拒绝等网络异常, 与超时一样只视为本次请求失败
+
+
+def _lookup(records: record.AppointmentIndex, station_name: Optional[str], arrival_time: Optional[str],
+            enter_date: Optional[str]) -> bool:
+    """
+    在预约记录索引中检查是否存在指定站点及时段的预约, Metro 与 AsyncMetro 共用
+    :param records: 预约记录索引
+    :param station_name: 站点名称, 格式: 沙河站
+    :param arrival_time: 预约时段, 格式: 0640-0650
+    :param enter_date: 进站日期, 默认为明天
+    :return:
+    """
+
+    if not (station_name and arrival_time):
+        return bool(len(records))
+
+    if enter_date is None:
+        enter_date = (datetime.date.today() + datetime.timedelta(1)).strftime(FORMAT)
+    return records.exists(enter_date, station_name, arrival_time)
+
+
+def _refresh(records: record.AppointmentIndex) -> Generator[str, Union[Dict, List, str, int, None], object]:
+    """
+    跟随 lastid 分页刷新预约记录索引, 增量刷新时遇到已索引的记录后停止, 超过有效期时获取所有分页全量重建
+    流程本身不发送请求, 每次产出下一页的 lastid, 由 Metro 或 AsyncMetro 请求预约列表接口后传回响应
+    :param records: 预约记录索引
+    :return: 返回第一页的响应, 第一页请求失败时索引保持失效
+    """
+
+    first = None
+    lastid = ''
+    generation = records.generation
+    # 超过有效期时全量重建以移除已经取消的预约, 否则增量刷新到已索引的记录为止
+    full, pages = records.expired, []
+    for index in range(record.PAGES):
+        response = yield lastid
+        if not index:
+            first = response
+        if not isinstance(response, list):
+            if not index:
+                return response
+            if full:
+                # 全量获取中途失败时只合并已经获取的记录, 索引保持失效, 下次检查时重新全量获取
+                records.update(pages)
+                return first
+            break
+
+        if full:
+            pages.extend(response)
+        elif not records.update(response):
+            break
+        if not response:
+            break
+        lastid = record.record_id(response[-1])
+        if not lastid:
+            break
+
+    if full:
+        records.rebuild(pages, generation)
+    else:
+        records.validate(generation)
+    return first
 
 
 class Metro:
     """ 地铁相关接口 """
 
-    def __init__(self, token, logger=None):
+    def __init__(self, token, logger=None, pool_size: int = POOL_SIZE, dns: Optional[resolver.Resolver] = None,
+                 cache: Optional[coalesce.BalanceCache] = None, domain: Optional[str] = None, tracer=None):
         self.token = token  # 地铁系统的 Authorization 字段
+        self.domain = domain or DOMAIN  # 接口域名, 可以指向本地替身服务
         self.logger = logger if logger is not None else logging
+        self.pool_size = max(pool_size, 1)
+        self.dns = dns  # 预解析及测速后的 <resolver.Resolver>, 传递后连接会固定到最快的节点
+        self.cache = cache  # 多个用户共享的 <coalesce.BalanceCache>, 相同站点的余票查询只会发出一次
+        self.records = record.AppointmentIndex()  # 本实例的预约记录索引, 每个抢票时段重新建立
+        self.session = self._session()
+        self.start_time: Optional[float] = None  # 抢票时刻, 用于统计首个请求的发送耗时
+        self.first_send: Optional[float] = None  # 抢票时刻到首个请求发出的耗时(秒)
+        self.tracer = tracer  # <trace.Tracer> 类, 传递后记录每个请求的耗时、状态码及结果
+
+    def _session(self) -> requests.Session:
+        """
+        创建一个长连接会话, 连接池大小与并发抢票的请求数量一致, 保证并发请求都能复用已建立的连接
+        :return:
+        """
+        session = requests.Session()
+        if self.dns is not None:
+            session.mount('https://', resolver.PinnedAdapter(self.dns, pool_connections=1, pool_maxsize=self.pool_size))
+            session.mount('http://', resolver.PinnedAdapter(
+                self.dns, tls=False, pool_connections=1, pool_maxsize=self.pool_size
+            ))
+        else:
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+        session.headers.update(
+            Host=urllib.parse.urlsplit(self.domain).netloc,
+            Connection='keep-alive',
+            Accept='application/json, text/plain, */*',
+            Origin='https://webui.mybti.cn',
+            Referer='https://webui.mybti.cn/'
+        )
+        return session
+
+    def warm_up(self, timeout: float = 3) -> int:
+        """
+        预热连接池, 并发完成 pool_size 次 TCP + TLS 握手, 使抢票时刻的请求直接复用已打开的连接
+        需要在抢票前的等待时间内调用, 连接空闲过久可能会被服务器关闭
+        :param timeout: 单次握手的超时时间
+        :return: 返回成功建立的连接数量
+        """
+
+        succeed = []
+
+        def handshake():
+            try:
+                response = self.session.request('HEAD', f'{self.domain}/', timeout=timeout)
+                response.close()
+                succeed.append(response.status_code)
+            except RequestException as error:
+                self.logger.debug(f'预热连接失败: {error}')
+
+        start = time.time()
+        threads = [threading.Thread(target=handshake, daemon=True) for _ in range(self.pool_size)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.logger.debug(f'预热连接 {len(succeed)}/{self.pool_size} 个, 耗时 {round((time.time() - start) * 1000)} ms')
+        return len(succeed)
+
+    def mark(self, start_time: float) -> None:
+        """
+        标记抢票时刻, 标记后的首个请求会记录并输出距离抢票时刻的发送耗时
+        :param start_time: 抢票时刻的时间戳
+        :return:
+        """
+        self.start_time = start_time
+        self.first_send = None
+
+    def close(self) -> None:
+        """ 关闭连接池 """
+        self.session.close()
 
     def request(self, method: str, uri: str, **kwargs) -> Union[Dict, List, str, int, None]:
         """
@@ -32,45 +180,58 @@ class Metro:
 
         _error = kwargs.pop('exceptions', ())
         default = kwargs.pop('default', False)
-        url = f'{DOMAIN}{uri}'
+        url = f'{self.domain}{uri}'
 
-        header = dict(
-            Host='webapi.mybti.cn',
-            Connection='keep-alive',
-            Accept='application/json, text/plain, */*',
-            Origin='https://webui.mybti.cn',
-            Authorization=self.token,
-            Referer='https://webui.mybti.cn/'
-        )
+        header = dict(Authorization=self.token)
         self.logger.debug(f'请求信息: {uri}')
         self.logger.debug(f'{kwargs.get("json")}')
 
+        first = self.start_time is not None and self.first_send is None
+        if first:
+            self.first_send = time.time() - self.start_time
+
+        wall, start, status, outcome = time.time(), time.monotonic(), None, 'exception'
         try:
-            response = requests.request(method, url, headers=header, **kwargs)
+            response = self.session.request(method, url, headers=header, **kwargs)
+            status = response.status_code
+
+            if first:
+                self.logger.info(
+                    f'首个请求距离抢票时刻 {round(self.first_send * 1000, 1)} ms 发出, '
+                    f'响应耗时 {round(response.elapsed.total_seconds() * 1000, 1)} ms'
+                )
 
             if response.status_code != 200:
                 _message = f'服务器内部错误, 接口: {uri} 状态码: {response.status_code}'
                 self.logger.error(_message)
+                outcome = 'error'
                 return default
 
             body = response.json()
             self.logger.debug(f'响应信息: {body}')
+            outcome = 'ok'
             return body
 
         except _error:
             # self.logger.debug(traceback.format_exc())
+            outcome = 'timeout'
             return {}
 
-    def shakedown(self, **kwargs) -> bool:
+        except NETWORK as error:
+            self.logger.warning(f'网络异常, 接口: {uri} {type(error).__name__}: {error}')
+            outcome = 'network'
+            return {}
+
+        finally:
+            if self.tracer is not None:
+                self.tracer.request(uri, start, time.monotonic() - start, wall, status, outcome)
+
+    @staticmethod
+    def _shakedown_body(kwargs: dict) -> dict:
         """
-        发送抢票信息
-        :param kwargs:
-                lineName: 需要填写要抢票的线路
-                stationName: 要抢票的站点名称
-                enterDate: 需要抢哪天的票
-                timeSlot: 时间段信息
-                snapshotWeekOffset: 0
-        :return: 返回 True or False
+        生成抢票接口的请求体
+        :param kwargs: 参考 Metro.shakedown
+        :return:
         """
 
         line_name = kwargs.pop('lineName', '昌平线')
@@ -80,7 +241,7 @@ class Metro:
         time_slot = kwargs.pop('timeSlot', '0630-0640')
         snapshot_week_offset = kwargs.pop('snapshotWeekOffset', 0)
 
-        body = dict(
+        return dict(
             lineName=line_name,
             snapshotWeekOffset=snapshot_week_offset,
             stationName=station_name,
@@ -88,18 +249,18 @@ class Metro:
             timeSlot=time_slot,
             snapshotTimeSlot='0630-0930'
         )
-        uri = '/Appointment/CreateAppointment'
-        response = self.request('POST', uri, json=body, timeout=2, exceptions=(ReadTimeout, ReadTimeoutError))
+
+    @staticmethod
+    def _shakedown_result(response) -> bool:
+        """ 根据抢票接口的响应判断是否抢票成功 """
         return isinstance(response, dict) and isinstance(response.get('balance'), int) and response.get('balance') > 0
 
-    def balance(self, **kwargs) -> List:
+    @staticmethod
+    def _balance_body(kwargs: dict) -> dict:
         """
-        获取余票信息
-        :param kwargs:
-                stationName: 站点名称
-                enterDates: 查询时段 开始天数~结束天数
-                timeSlot: 查询预约时段, 0630-0930
-        :return: 返回当前所有可预约的时段
+        生成余票接口的请求体
+        :param kwargs: 参考 Metro.balance
+        :return:
         """
         today = datetime.date.today()
         tomorrow = today + datetime.timedelta(1)
@@ -111,41 +272,27 @@ class Metro:
         ])
         time_slot = kwargs.pop('timeSlot', '0630-0930')
 
-        body = dict(
+        return dict(
             stationName=station_name,
             enterDates=enter_dates,
             timeSlot=time_slot
         )
-        response = self.request('POST', '/Appointment/GetBalance', json=body, default=[])
 
+    @staticmethod
+    def _balance_result(response) -> List:
+        """ 过滤出余票接口响应中可预约的时段 """
         return list(filter(lambda x: x.get('balance') and not x.get('status'), response))
 
-    def appointment(self, **kwargs) -> bool:
+    @staticmethod
+    def _appointment_result(response, station_name: Optional[str], arrival_time: Optional[str]) -> bool:
         """
-        获取当前是否存在进站码, 当传递 kwargs 参数后则会匹配站点信息是否符合
-        :param kwargs:
-                stationName: 站点名称, 格式: 沙河站
-                arrivalTime: 查询预约时段, 格式: 0640-0650
-                timeout: 接口超时时间, 如果为 None 则一直等待
-        :return: 返回预约是否存在, 存在此阶段预约则返回 True, 否则为 False
+        根据预约列表接口的响应判断是否存在指定站点及时段的预约
+        :param response: 预约列表接口的响应
+        :param station_name: 站点名称, 格式: 沙河站
+        :param arrival_time: 预约时段, 格式: 0640-0650
+        :return:
         """
 
-        station_name = kwargs.pop('stationName', None)
-        arrival_time = kwargs.pop('arrivalTime', None)
-        timeout = kwargs.pop('timeout', None)
-
-        params = dict(
-            status=0,
-            lastid=''
-        )
-        response = self.request(
-            'GET',
-            '/AppointmentRecord/GetAppointmentList',
-            params=params,
-            timeout=timeout,
-            exceptions=(ReadTimeout, ReadTimeoutError)
-        )
-
         if not response:
             return False
 
@@ -164,6 +311,295 @@ class Metro:
 
         return True
 
+    def shakedown(self, **kwargs) -> bool:
+        """
+        发送抢票信息
+        :param kwargs:
+                lineName: 需要填写要抢票的线路
+                stationName: 要抢票的站点名称
+                enterDate: 需要抢哪天的票
+                timeSlot: 时间段信息
+                snapshotWeekOffset: 0
+        :return: 返回 True or False
+        """
+
+        body = self._shakedown_body(kwargs)
+        uri = '/Appointment/CreateAppointment'
+        try:
+            response = self.request('POST', uri, json=body, timeout=2, exceptions=(ReadTimeout, ReadTimeoutError))
+        finally:
+            # 超时的抢票请求也可能已经在服务器生效, 无论结果如何都需要刷新预约记录
+            self.records.invalidate()
+        return self._shakedown_result(response)
+
+    def balance(self, **kwargs) -> List:
+        """
+        获取余票信息
+        :param kwargs:
+                stationName: 站点名称
+                enterDates: 查询时段 开始天数~结束天数
+                timeSlot: 查询预约时段, 0630-0930
+        :return: 返回当前所有可预约的时段
+        """
+
+        body = self._balance_body(kwargs)
+
+        def load():
+            return self.request('POST', '/Appointment/GetBalance', json=body, default=[])
+
+        response = load() if self.cache is None else self.cache.get(coalesce.balance_key(body), load)
+        return self._balance_result(response)
+
+    def appointment(self, **kwargs) -> bool:
+        """
+        获取当前是否存在进站码, 当传递 kwargs 参数后则会匹配站点信息是否符合
+        :param kwargs:
+                stationName: 站点名称, 格式: 沙河站
+                arrivalTime: 查询预约时段, 格式: 0640-0650
+                enterDate: 进站日期, 格式: 20230317, 默认为明天
+                timeout: 接口超时时间, 如果为 None 则一直等待
+        :return: 返回预约是否存在, 存在此阶段预约则返回 True, 否则为 False
+        索引有效时直接在本地查询, 失效时会先跟随分页刷新索引
+        """
+
+        station_name = kwargs.pop('stationName', None)
+        arrival_time = kwargs.pop('arrivalTime', None)
+        enter_date = kwargs.pop('enterDate', None)
+        timeout = kwargs.pop('timeout', None)
+
+        if not self.records.valid:
+            flow = _refresh(self.records)
+            try:
+                lastid = next(flow)
+                while True:
+                    lastid = flow.send(self.request(
+                        'GET',
+                        '/AppointmentRecord/GetAppointmentList',
+                        params=dict(status=0, lastid=lastid),
+                        timeout=timeout,
+                        exceptions=(ReadTimeout, ReadTimeoutError)
+                    ))
+            except StopIteration as stop:
+                response = stop.value
+            if not isinstance(response, list):
+                return self._appointment_result(response, station_name, arrival_time)
+
+        return _lookup(self.records, station_name, arrival_time, enter_date)
+
+
+class AsyncMetro:
+    """
+    基于 asyncio 的地铁相关接口, 与 Metro 保持相同的余票、抢票、预约查询语义
+    多个用户可以共享同一个 aiohttp.TCPConnector, 在一个事件循环中承载大量并发请求
+    """
+
+    def __init__(self, token, logger=None, pool_size: int = POOL_SIZE, connector=None, dns=None, cache=None,
+                 domain: Optional[str] = None, tracer=None):
+        """
+        :param token: 地铁系统的 Authorization 字段
+        :param logger: <logger.LoggingOutput> 类
+        :param pool_size: 未传递 connector 时新建连接池的大小
+        :param connector: 共享的 <aiohttp.TCPConnector>, 传递后由调用方负责关闭
+        :param dns: 未传递 connector 时新建连接池使用的 <resolver.Resolver>
+        :param cache: 多个协程共享的 <coalesce.AsyncBalanceCache>
+        :param domain: 接口域名, 可以指向本地替身服务
+        :param tracer: <trace.Tracer> 类, 参考 Metro
+        """
+        self.token = token
+        self.domain = domain or DOMAIN
+        self.logger = logger if logger is not None else logging
+        self.pool_size = max(pool_size, 1)
+        self.connector = connector
+        self.dns = dns
+        self.cache = cache
+        self.records = record.AppointmentIndex()
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.start_time: Optional[float] = None
+        self.first_send: Optional[float] = None
+        self.tracer = tracer
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def open(self) -> None:
+        """ 创建长连接会话, 必须在事件循环中调用 """
+        if self.session is not None:
+            return
+
+        connector = self.connector
+        if connector is None:
+            connector = self.create_connector(self.pool_size, self.dns)
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            connector_owner=self.connector is None,
+            headers=dict(
+                Host=urllib.parse.urlsplit(self.domain).netloc,
+                Connection='keep-alive',
+                Accept='application/json, text/plain, */*',
+                Origin='https://webui.mybti.cn',
+                Referer='https://webui.mybti.cn/'
+            )
+        )
+
+    @staticmethod
+    def create_connector(limit: int, dns: Optional[resolver.Resolver] = None) -> 'aiohttp.TCPConnector':
+        """
+        创建连接池, 必须在事件循环中调用
+        :param limit: 连接池大小
+        :param dns: 传递后连接会固定到 <resolver.Resolver> 测速最快的节点
+        :return:
+        """
+        if dns is None:
+            return aiohttp.TCPConnector(limit=limit)
+        return aiohttp.TCPConnector(limit=limit, resolver=resolver.PinnedResolver(dns))
+
+    async def close(self) -> None:
+        """ 关闭会话, 共享的连接池不会被关闭 """
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def warm_up(self, timeout: float = 3) -> int:
+        """
+        预热连接池, 并发完成 pool_size 次 TCP + TLS 握手
+        :param timeout: 单次握手的超时时间
+        :return: 返回成功建立的连接数量
+        """
+
+        async def handshake():
+            try:
+                async with self.session.head(f'{self.domain}/', timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                    return response.status
+            except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+                self.logger.debug(f'预热连接失败: {error}')
+
+        await self.open()
+        result = await asyncio.gather(*(handshake() for _ in range(self.pool_size)))
+        return len([item for item in result if item is not None])
+
+    def mark(self, start_time: float) -> None:
+        """ 参考 Metro.mark """
+        self.start_time = start_time
+        self.first_send = None
+
+    async def request(self, method: str, uri: str, **kwargs) -> Union[Dict, List, str, int, None]:
+        """
+        参考 Metro.request, exceptions 中的异常会被捕获并返回空字典
+        :param method: 请求类型
+        :param uri: 请求的路径
+        :param kwargs: json, params, timeout, exceptions, default
+        :return: 返回服务器返回消息体中的 data 数据
+        """
+
+        _error = kwargs.pop('exceptions', ())
+        default = kwargs.pop('default', False)
+        timeout = aiohttp.ClientTimeout(total=kwargs.pop('timeout', None))
+        url = f'{self.domain}{uri}'
+
+        header = dict(Authorization=self.token)
+        self.logger.debug(f'请求信息: {uri}')
+        self.logger.debug(f'{kwargs.get("json")}')
+
+        first = self.start_time is not None and self.first_send is None
+        if first:
+            self.first_send = time.time() - self.start_time
+
+        await self.open()
+        wall, monotonic, status, outcome = time.time(), time.monotonic(), None, 'exception'
+        try:
+            start = time.time()
+            async with self.session.request(method, url, headers=header, timeout=timeout, **kwargs) as response:
+                status = response.status
+
+                if first:
+                    self.logger.info(
+                        f'首个请求距离抢票时刻 {round(self.first_send * 1000, 1)} ms 发出, '
+                        f'响应耗时 {round((time.time() - start) * 1000, 1)} ms'
+                    )
+
+                if response.status != 200:
+                    _message = f'服务器内部错误, 接口: {uri} 状态码: {response.status}'
+                    self.logger.error(_message)
+                    outcome = 'error'
+                    return default
+
+                body = await response.json(content_type=None)
+                self.logger.debug(f'响应信息: {body}')
+                outcome = 'ok'
+                return body
+
+        except _error:
+            outcome = 'timeout'
+            return {}
+
+        except (aiohttp.ClientError, OSError) as error:
+            # 参考 NETWORK, 连接被重置等网络异常不会中断整个抢票任务
+            self.logger.warning(f'网络异常, 接口: {uri} {type(error).__name__}: {error}')
+            outcome = 'network'
+            return {}
+
+        except asyncio.CancelledError:
+            # 请求组中任意请求成功后会取消其余的请求
+            outcome = 'cancelled'
+            raise
+
+        finally:
+            if self.tracer is not None:
+                self.tracer.request(uri, monotonic, time.monotonic() - monotonic, wall, status, outcome)
+
+    async def shakedown(self, **kwargs) -> bool:
+        """ 参考 Metro.shakedown """
+        body = Metro._shakedown_body(kwargs)
+        uri = '/Appointment/CreateAppointment'
+        try:
+            response = await self.request('POST', uri, json=body, timeout=2, exceptions=(asyncio.TimeoutError, ))
+        finally:
+            self.records.invalidate()
+        return Metro._shakedown_result(response)
+
+    async def balance(self, **kwargs) -> List:
+        """ 参考 Metro.balance """
+        body = Metro._balance_body(kwargs)
+
+        def load():
+            return self.request('POST', '/Appointment/GetBalance', json=body, default=[])
+
+        if self.cache is None:
+            response = await load()
+        else:
+            response = await self.cache.get(coalesce.balance_key(body), load)
+        return Metro._balance_result(response)
+
+    async def appointment(self, **kwargs) -> bool:
+        """ 参考 Metro.appointment """
+        station_name = kwargs.pop('stationName', None)
+        arrival_time = kwargs.pop('arrivalTime', None)
+        enter_date = kwargs.pop('enterDate', None)
+        timeout = kwargs.pop('timeout', None)
+
+        if not self.records.valid:
+            flow = _refresh(self.records)
+            try:
+                lastid = next(flow)
+                while True:
+                    lastid = flow.send(await self.request(
+                        'GET',
+                        '/AppointmentRecord/GetAppointmentList',
+                        params=dict(status=0, lastid=lastid),
+                        timeout=timeout,
+                        exceptions=(asyncio.TimeoutError, )
+                    ))
+            except StopIteration as stop:
+                response = stop.value
+            if not isinstance(response, list):
+                return Metro._appointment_result(response, station_name, arrival_time)
+
+        return _lookup(self.records, station_name, arrival_time, enter_date)
+
 
 if __name__ == '__main__':
     _token = "=="
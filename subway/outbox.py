@@ -0,0 +1,237 @@
+# _author: Coke
+# _date: 2023/9/18 21:05
+
+from typing import NamedTuple, Optional
+
+import threading
+import sqlite3
+import logging
+import time
+import uuid
+
+PENDING = 0
+SENT = 1
+DEAD = 2  # 超过最大重试次数后放弃发送
+
+ATTEMPTS = 8  # 每条通知最多尝试发送的次数
+BACKOFF = 5.0  # 首次重试的等待时间, 之后每次翻倍, 单位秒
+MAX_BACKOFF = 600.0  # 重试等待时间的上限
+RETAIN = 30 * 86400  # 已发送的通知保留的时间, 在此期间相同幂等键的通知不会重复发送
+COMPACT = 3600  # 压缩的最小间隔
+LEASE = 120.0  # 取出通知后的租约时长, 期间其他进程不会发送同一条通知, 超时未完成时可以被重新取出
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    channel TEXT NOT NULL,
+    key TEXT NOT NULL,
+    title TEXT NOT NULL,
+    text TEXT NOT NULL,
+    markdown INTEGER NOT NULL,
+    state INTEGER NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL,
+    due REAL NOT NULL,
+    finished REAL,
+    error TEXT,
+    owner TEXT,
+    lease REAL,
+    UNIQUE (channel, key)
+);
+CREATE INDEX IF NOT EXISTS outbox_due ON outbox (channel, state, due);
+"""
+
+
+class Record(NamedTuple):
+    """ 发件箱中待发送的通知 """
+
+    id: int
+    channel: str
+    key: str  # 幂等键, 同一个渠道中相同的键只会发送一次
+    title: str
+    text: str
+    markdown: bool
+    attempts: int
+
+
+class Outbox:
+    """
+    持久化的通知发件箱, 使用 WAL 模式的 SQLite 保存每条通知及其发送状态
+    通知先写入发件箱再由后台线程发送, 进程崩溃或重启后未发送的通知会继续发送, 已发送的通知不会因为重启而重复发送
+    多个进程共用同一个文件时, 每条通知取出时会加上租约, 租约期间只有取出的进程会发送
+    发送成功到标记完成之间崩溃时会在租约到期后再次发送, 即至少送达一次
+    """
+
+    def __init__(self, filename: str = ':memory:', **kwargs):
+        """
+        :param filename: 数据库文件路径, 默认为内存数据库, 不会持久化
+        :param kwargs:
+                attempts -> int: 每条通知最多尝试发送的次数
+                backoff -> float: 首次重试的等待时间
+                maxBackoff -> float: 重试等待时间的上限
+                retain -> float: 已发送的通知保留的时间
+                lease -> float: 取出通知后的租约时长
+                logger -> Type: <logger.LoggingOutput> 类
+        """
+        self.filename = filename
+        self.attempts = kwargs.pop('attempts', ATTEMPTS)
+        self.backoff = kwargs.pop('backoff', BACKOFF)
+        self.max_backoff = kwargs.pop('maxBackoff', MAX_BACKOFF)
+        self.retain = kwargs.pop('retain', RETAIN)
+        self.lease = kwargs.pop('lease', LEASE)
+        self.logger = kwargs.pop('logger', None) or logging
+        self.owner = uuid.uuid4().hex  # 租约的持有者, 每个实例不同
+        self._lock = threading.Lock()
+        self._compacted = 0.0
+
+        # 所有线程共享同一个连接, 由锁保证串行访问, 每条语句自动提交
+        self._connection = sqlite3.connect(filename, check_same_thread=False, isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.executescript(SCHEMA)
+        # 兼容没有租约字段的旧版本发件箱
+        columns = {row[1] for row in self._connection.execute('PRAGMA table_info(outbox)')}
+        for column, kind in (('owner', 'TEXT'), ('lease', 'REAL')):
+            if column not in columns:
+                self._connection.execute(f'ALTER TABLE outbox ADD COLUMN {column} {kind}')
+        self.compact()
+
+    def put(self, channel: str, key: str, title: str, text: str, markdown: bool = False) -> bool:
+        """
+        写入一条通知
+        :param channel: 渠道名称
+        :param key: 幂等键
+        :param title: 标题
+        :param text: 内容
+        :param markdown: 是否以 markdown 发送
+        :return: 写入成功返回 True, 已存在相同幂等键的通知时返回 False
+        """
+
+        now = time.time()
+        with self._lock:
+            cursor = self._connection.execute(
+                'INSERT OR IGNORE INTO outbox (channel, key, title, text, markdown, created, due) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (channel, key, title, text, int(markdown), now, now)
+            )
+        return cursor.rowcount > 0
+
+    def due(self, channel: str, now: float = None) -> Optional[Record]:
+        """
+        取出渠道中最早到期且没有被其他进程租用的待发送通知, 取出的同时加上租约
+        查询及加租约在同一个写事务中完成, 多个进程不会取出同一条通知
+        """
+
+        now = now if now is not None else time.time()
+        with self._lock:
+            self._connection.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._connection.execute(
+                    'SELECT id, channel, key, title, text, markdown, attempts FROM outbox '
+                    'WHERE channel = ? AND state = ? AND due <= ? AND (lease IS NULL OR lease <= ?) '
+                    'ORDER BY due, id LIMIT 1',
+                    (channel, PENDING, now, now)
+                ).fetchone()
+                if row is not None:
+                    self._connection.execute(
+                        'UPDATE outbox SET owner = ?, lease = ? WHERE id = ?', (self.owner, now + self.lease, row[0])
+                    )
+                self._connection.execute('COMMIT')
+            except (Exception, ):
+                self._connection.execute('ROLLBACK')
+                raise
+        return Record(*row[:5], bool(row[5]), row[6]) if row is not None else None
+
+    def next_due(self, channel: str) -> Optional[float]:
+        """ 渠道中下一条待发送通知的到期时间, 被其他进程租用的通知按租约到期时间计算, 没有待发送的通知时返回 None """
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT MIN(MAX(due, COALESCE(lease, 0))) FROM outbox WHERE channel = ? AND state = ?',
+                (channel, PENDING)
+            ).fetchone()
+        return row[0]
+
+    def done(self, record: Record) -> None:
+        """ 标记通知发送成功 """
+        with self._lock:
+            self._connection.execute(
+                'UPDATE outbox SET state = ?, attempts = attempts + 1, finished = ?, error = NULL, lease = NULL '
+                'WHERE id = ?',
+                (SENT, time.time(), record.id)
+            )
+
+    def retry(self, record: Record, error: str) -> Optional[float]:
+        """
+        记录一次发送失败, 按指数退避重新安排发送时间
+        :param record: 发送失败的通知
+        :param error: 失败原因
+        :return: 返回下次发送的时间戳, 超过最大重试次数时返回 None
+        """
+
+        now = time.time()
+        attempts = record.attempts + 1
+        if attempts >= self.attempts:
+            with self._lock:
+                self._connection.execute(
+                    'UPDATE outbox SET state = ?, attempts = ?, finished = ?, error = ?, lease = NULL WHERE id = ?',
+                    (DEAD, attempts, now, error, record.id)
+                )
+            self.logger.error(f'{record.channel} 通知 {record.key} 发送 {attempts} 次均失败, 放弃发送: {error}')
+            return None
+
+        due = now + min(self.backoff * 2 ** (attempts - 1), self.max_backoff)
+        with self._lock:
+            self._connection.execute(
+                'UPDATE outbox SET attempts = ?, due = ?, error = ?, lease = NULL WHERE id = ?',
+                (attempts, due, error, record.id)
+            )
+        return due
+
+    def pending(self) -> int:
+        """ 待发送的通知数量 """
+        with self._lock:
+            return self._connection.execute('SELECT COUNT(*) FROM outbox WHERE state = ?', (PENDING, )).fetchone()[0]
+
+    def maintain(self) -> int:
+        """
+        距离上次压缩超过 COMPACT 时压缩发件箱, 由发送线程在空闲时调用, 写入通知时不会压缩
+        :return: 返回删除的通知数量
+        """
+        with self._lock:
+            if time.time() - self._compacted <= COMPACT:
+                return 0
+            self._compacted = time.time()
+        return self.compact()
+
+    def compact(self) -> int:
+        """
+        压缩发件箱, 删除超过保留时间的已完成通知, 并将 WAL 文件合并回数据库
+        :return: 返回删除的通知数量
+        """
+
+        now = time.time()
+        with self._lock:
+            self._compacted = now
+            removed = self._connection.execute(
+                'DELETE FROM outbox WHERE state != ? AND finished < ?',
+                (PENDING, now - self.retain)
+            ).rowcount
+            self._connection.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+            # 空闲页超过四分之一时重建数据库文件
+            pages = self._connection.execute('PRAGMA page_count').fetchone()[0]
+            free = self._connection.execute('PRAGMA freelist_count').fetchone()[0]
+            if pages and free * 4 > pages:
+                self._connection.execute('VACUUM')
+
+        if removed:
+            self.logger.debug(f'通知发件箱已压缩, 删除 {removed} 条过期记录')
+        return removed
+
+    def close(self) -> None:
+        """ 释放本实例持有的租约, 未发送的通知可以立即由其他进程发送 """
+        with self._lock:
+            self._connection.execute(
+                'UPDATE outbox SET owner = NULL, lease = NULL WHERE owner = ? AND state = ?', (self.owner, PENDING)
+            )
+            self._connection.close()
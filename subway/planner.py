@@ -0,0 +1,272 @@
+# _author: Coke
+# _date: 2023/9/28 20:36
+
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import collections
+import threading
+import datetime
+import logging
+import click
+import time
+import os
+
+from subway import config, utils
+
+DAYS = 7  # 计划覆盖的天数
+WINDOW = 60.0  # 间隔小于此值的抢票时刻合并为一次执行, 抢票时刻按顺序执行, 窗口内的时刻无法单独执行
+TIME_FORMAT = '%Y-%m-%d'
+
+_WARNED = set()  # 已经提示过超出节假日数据范围的年份
+
+
+class Grab(NamedTuple):
+    """
+    计划中的一个抢票时刻, 同一时刻及 WINDOW 内其他时刻抢票的用户合并为一项
+    每个用户保留自己的抢票时间, 抢票任务按各自的时间发出请求
+    """
+
+    instant: float  # 本地时钟下的放票时间戳, 即合并的时刻中最早的一个
+    date: str  # 预约的乘车日期, 即放票日期的次日
+    users: Tuple[str, ...]  # 在此时刻抢票的用户名称
+    starts: Tuple[float, ...] = ()  # 与 users 一一对应的抢票时间戳, 为空时均为 instant
+
+    @property
+    def clock(self) -> str:
+        """ 放票时刻, 精确到毫秒, 如 12:00:00.150 """
+        return _clock(self.instant)
+
+    def offset(self, name: str) -> float:
+        """ 用户的抢票时间相对于 instant 的偏移, 单位秒 """
+        if name not in self.users or not self.starts:
+            return 0.0
+        return self.starts[self.users.index(name)] - self.instant
+
+    @property
+    def clocks(self) -> str:
+        """ 每个用户的抢票时刻, 如 alice, bob 12:00:00.150 """
+        return ', '.join(
+            name + (f' {_clock(self.instant + self.offset(name))}' if self.offset(name) else '') for name in self.users
+        )
+
+
+def _clock(instant: float) -> str:
+    return time.strftime('%H:%M:%S', time.localtime(instant)) + f'.{int(instant * 1000) % 1000:03d}'
+
+
+def calendar_version() -> str:
+    """ 节假日数据的版本, 升级 chinesecalendar 后计划会重新计算 """
+    import chinese_calendar
+    return getattr(chinese_calendar, '__version__', '')
+
+
+def is_holiday(day: datetime.date, logger=None) -> bool:
+    """
+    判断是否为节假日, 调休的工作日不是节假日
+    超出 chinese_calendar 数据范围的年份 (通常为次年的节假日尚未公布) 只按周末判断
+    :param day: 日期
+    :param logger: <logger.LoggingOutput> 类
+    :return:
+    """
+
+    import chinese_calendar
+    try:
+        return chinese_calendar.is_holiday(day)
+    except NotImplementedError:
+        if day.year not in _WARNED:
+            _WARNED.add(day.year)
+            (logger or logging).warning(f'节假日数据不包含 {day.year} 年, 只按周末判断, 请升级 chinesecalendar')
+        return day.weekday() >= 5
+
+
+def build(users: Iterable[config.User], subscribe_time: Iterable, start: datetime.date, days: int = DAYS,
+          holiday: Callable[[datetime.date], bool] = is_holiday) -> List[Grab]:
+    """
+    一次计算 start 起 days 天内的所有抢票时刻, 每天只判断一次节假日
+    :param users: 配置文件中的用户, 参考 config.User
+    :param subscribe_time: 全局的抢票时间, 用户配置了 subscribeTime 时使用用户自己的抢票时间
+    :param start: 第一个放票日期
+    :param days: 天数
+    :param holiday: 判断乘车日期是否为节假日的函数
+    :return: 返回按时间排序的抢票时刻, 间隔小于 WINDOW 的时刻合并为一项,
+             屏蔽、已跳过当天及 Token 在放票前过期的用户不会出现在计划中
+    """
+
+    users = [user for user in users if not user.shakedown]
+    clocks: Dict[object, datetime.timedelta] = dict()
+    instants: Dict[float, Tuple[str, List[str]]] = dict()
+    for offset in range(days):
+        day = start + datetime.timedelta(days=offset)
+        travel = day + datetime.timedelta(days=1)
+        date = travel.strftime(TIME_FORMAT)
+        midnight = datetime.datetime.combine(day, datetime.time())
+        rest = holiday(travel)
+
+        for user in users:
+            if (rest and not user.holiday) or date in user.skip:
+                continue
+
+            for item in user.subscribe or subscribe_time:
+                if item not in clocks:
+                    clocks[item] = utils.clock(item)
+                instant = (midnight + clocks[item]).timestamp()
+                # Token 在放票前已经过期的用户不需要抢票
+                if instant < user.expire:
+                    instants.setdefault(instant, (date, []))[1].append(user.name)
+
+    grabs: List[Grab] = []
+    for instant, (date, names) in sorted(instants.items()):
+        previous = grabs[-1] if grabs else None
+        if previous is None or instant - previous.instant >= WINDOW or date != previous.date:
+            grabs.append(Grab(instant, date, tuple(names), (instant, ) * len(names)))
+            continue
+
+        # 与上一个时刻合并, 同一个用户在窗口内只保留最早的抢票时间
+        names = [name for name in names if name not in previous.users]
+        grabs[-1] = previous._replace(
+            users=previous.users + tuple(names), starts=previous.starts + (instant, ) * len(names)
+        )
+
+    return grabs
+
+
+class Planner:
+    """
+    多日抢票计划, 一次计算未来 days 天内的所有抢票时刻, 按时间排序后作为队列消费
+    只有配置文件版本、抢票时间或节假日数据发生变化, 以及计划覆盖的天数用完后才会重新计算
+    """
+
+    def __init__(self, subscribe_time: Iterable, days: int = DAYS, logger=None):
+        """
+        :param subscribe_time: 全局的抢票时间, 参考 Subway 的 subscribeTime
+        :param days: 计划覆盖的天数
+        :param logger: <logger.LoggingOutput> 类
+        """
+        self.subscribe_time = tuple(subscribe_time)
+        self.days = days
+        self.logger = logger if logger is not None else logging
+        self.config: Optional[config.Config] = None
+        self.horizon = 0.0  # 计划覆盖的截止时间戳, 到达后重新计算
+        self._queue: collections.deque = collections.deque()
+        self._key: Optional[tuple] = None
+        self._last = 0.0  # 最近一个已经执行的抢票时刻, 重新计算时不会再次执行
+        self._lock = threading.Lock()
+        self._event = threading.Event()
+
+    def update(self, _config: config.Config) -> None:
+        """
+        更新配置, 版本发生变化时计划会在下次 next 时重新计算, 并唤醒正在 wait 的线程
+        :param _config: <config.Config> 类
+        :return:
+        """
+        with self._lock:
+            self.config = _config
+            changed = self._key is not None and self._key[0] != _config.version
+        if changed:
+            self._event.set()
+
+    def build(self, now: float = None) -> List[Grab]:
+        """ 从 now 所在的日期开始计算计划, 不会修改当前的队列 """
+        start = datetime.date.fromtimestamp(now if now is not None else time.time())
+        return build(
+            self.config.users, self.subscribe_time, start, self.days, lambda day: is_holiday(day, self.logger)
+        )
+
+    def next(self, now: float = None) -> Optional[Grab]:
+        """
+        获取下一个尚未到达的抢票时刻, 不会从队列中移除, 执行完成后需要调用 done
+        :param now: 当前时间戳
+        :return: 计划中没有剩余的抢票时刻时返回 None, 可以 wait 到 horizon 后再次获取
+        """
+
+        now = now if now is not None else time.time()
+        with self._lock:
+            key = (self.config.version, self.subscribe_time, calendar_version())
+            if key != self._key or now >= self.horizon:
+                self._event.clear()
+                self._queue = collections.deque(self.build(now))
+                self._key = key
+                start = datetime.datetime.combine(datetime.date.fromtimestamp(now), datetime.time())
+                self.horizon = (start + datetime.timedelta(days=self.days)).timestamp()
+                self.logger.debug(f'已生成未来 {self.days} 天的抢票计划, 共 {len(self._queue)} 个抢票时刻')
+
+            # 丢弃已经错过或已经执行的抢票时刻, 程序运行期间错过的时刻需要提示
+            while self._queue and self._queue[0].instant <= max(now, self._last):
+                grab = self._queue.popleft()
+                if self._last and grab.instant > self._last:
+                    self.logger.warning(f'已错过 {grab.date} 在 {grab.clock} 的抢票时刻, 用户: {", ".join(grab.users)}')
+            return self._queue[0] if self._queue else None
+
+    def done(self, grab: Grab) -> None:
+        """ 标记抢票时刻已经执行 """
+        with self._lock:
+            self._last = max(self._last, grab.instant)
+            if self._queue and self._queue[0] == grab:
+                self._queue.popleft()
+
+    def pending(self) -> List[Grab]:
+        """ 队列中剩余的抢票时刻 """
+        with self._lock:
+            return list(self._queue)
+
+    def wait(self, scheduler, deadline: float, name: str = 'default') -> bool:
+        """
+        通过调度器阻塞当前线程直到 deadline, 期间配置发生变化时提前返回
+        :param scheduler: <scheduler.Scheduler> 类
+        :param deadline: 触发的时间戳
+        :param name: 任务名称
+        :return: 到达 deadline 时返回 True, 计划需要重新计算时返回 False
+        """
+
+        fired = threading.Event()
+
+        def callback(_):
+            fired.set()
+            self._event.set()
+
+        entry = scheduler.register(deadline, callback, name)
+        self._event.wait()
+        self._event.clear()
+        if fired.is_set():
+            return True
+
+        scheduler.cancel(entry)
+        return False
+
+
+@click.command()
+@click.option('--path', '-p', help='配置文件路径, 如不指定则使用项目下 conf/conf.json 文件', default='')
+@click.option('--subscribe', '-s', help='全局的抢票时间, 与 subway run 的 --subscribe 一致', default='12,20')
+@click.option('--days', '-n', help='计划覆盖的天数', default=DAYS)
+def command(path: str, subscribe: str, days: int) -> None:
+    """ 输出未来几天的抢票计划 """
+
+    path = path or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'conf', 'conf.json')
+    loader = config.Loader(path)
+    _config = loader.load()[0]
+    if _config is None:
+        raise click.ClickException(f'校验 conf 文件内容失败: {loader.error}')
+
+    planner = Planner(utils.subscribe(subscribe), days)
+    planner.update(_config)
+    grabs = collections.defaultdict(list)
+    for grab in planner.build():
+        grabs[grab.date].append(grab)
+
+    now, today = time.time(), datetime.date.today()
+    for offset in range(days):
+        travel = today + datetime.timedelta(days=offset + 1)
+        date = travel.strftime(TIME_FORMAT)
+        if date not in grabs:
+            click.echo(f'{date} 无需抢票 ({"节假日" if is_holiday(travel) else "没有需要抢票的用户"})')
+            continue
+        for grab in grabs[date]:
+            day = time.strftime(TIME_FORMAT, time.localtime(grab.instant))
+            passed = ' (已过)' if grab.instant <= now else ''
+            click.echo(f'{date} 在 {day} {grab.clock} 抢票: {grab.clocks}{passed}')
+
+    click.echo(f'未来 {days} 天共 {sum(map(len, grabs.values()))} 个抢票时刻, 节假日数据版本 {calendar_version() or "未知"}')
+
+
+if __name__ == '__main__':
+    command()
@@ -0,0 +1,13 @@
+# _author: Coke
+# _date: 2023/9/2 11:40
+
+import pytest
+
+from subway import server
+
+
+@pytest.fixture
+def stand_in():
+    """ 启动一个本地替身服务, 通过 stand_in.url 作为 Metro 的 domain """
+    with server.StandIn() as _server:
+        yield _server
@@ -0,0 +1,198 @@
+# _author: Coke
+# _date: 2023/8/28 21:05
+
+from typing import Callable, Iterable, List
+
+import multiprocessing
+import importlib
+import logging
+import time
+import os
+
+# 工作进程预先导入的模块, 抢票时刻的任务无需再导入
+# 工作进程只执行 booking 中的任务函数, 不导入 subway.main 及只在主进程中使用的通知、指标、计划等子系统
+PRELOAD = (
+    'subway.logger',
+    'subway.metro',
+    'subway.burst',
+    'subway.scheduler',
+    'subway.coalesce',
+    'subway.record',
+    'subway.booking'
+)
+
+
+def start_method() -> str:
+    """ 优先使用 forkserver, 由干净的服务进程派生工作进程, 避免在已经启动了线程的进程中 fork; 不支持时使用 spawn """
+    return 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+
+def _initialize(preload: Iterable[str], log_queue=None, level=None) -> None:
+    """ 工作进程的初始化函数, 导入预加载的模块并接入主进程的日志管道 """
+    for name in preload:
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            pass
+
+    if log_queue is not None:
+        from subway import logger
+        logger.attach(log_queue, level or logging.INFO)
+
+
+def _ping(_) -> int:
+    """ 健康检查任务, 返回工作进程的 pid """
+    return os.getpid()
+
+
+class WorkerPool:
+    """
+    常驻的预派生进程池, 在程序启动时创建一次并跨抢票时段复用
+    工作进程启动时预先导入抢票所需的模块, 每个时段只通过进程池的任务队列下发任务, 抢票前进行健康检查, 异常时重建
+    """
+
+    def __init__(self, processes: int, preload: Iterable[str] = PRELOAD, method: str = None, logger=None, **kwargs):
+        """
+        :param processes: 工作进程数量
+        :param preload: 预加载的模块
+        :param method: 进程启动方式, 默认参考 start_method
+        :param logger: <logger.LoggingOutput> 类
+        :param kwargs:
+                logQueue -> multiprocessing.Queue: 主进程的日志队列, 参考 logger.setup, 工作进程的日志写入此队列
+                level -> str: 工作进程的日志等级
+        """
+        self.processes = processes
+        self.preload = tuple(preload)
+        self.method = method or start_method()
+        self.logger = logger if logger is not None else logging
+        self.log_queue = kwargs.pop('logQueue', None)
+        self.level = kwargs.pop('level', None)
+        self.context = multiprocessing.get_context(self.method)
+        if self.method == 'forkserver':
+            self.context.set_forkserver_preload(list(self.preload))
+        self._pool = None
+        self._manager = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def started(self) -> bool:
+        return self._pool is not None
+
+    def start(self) -> None:
+        """ 启动工作进程, 已经启动时不做任何操作 """
+        if self._pool is not None:
+            return
+
+        start = time.perf_counter()
+        self._pool = self.context.Pool(
+            self.processes,
+            initializer=_initialize,
+            initargs=(self.preload, self.log_queue, self.level)
+        )
+        self.logger.debug(
+            f'进程池已启动: {self.processes} 个工作进程, 启动方式 {self.method}, '
+            f'耗时 {round((time.perf_counter() - start) * 1000, 1)} ms'
+        )
+
+    def manager(self):
+        """ 获取常驻的 multiprocessing.Manager, 用于托管跨进程共享的数据 """
+        if self._manager is None:
+            self._manager = self.context.Manager()
+        return self._manager
+
+    def check(self, timeout: float = 5) -> bool:
+        """
+        健康检查, 向每个工作进程下发一个空任务, 超时或失败时重建进程池
+        :param timeout: 等待所有空任务完成的超时时间
+        :return: 检查通过返回 True, 重建后返回 False
+        """
+
+        if self._pool is None:
+            self.start()
+            return False
+
+        start = time.perf_counter()
+        try:
+            pids = self._pool.map_async(_ping, range(self.processes), chunksize=1).get(timeout)
+        except (Exception, ) as error:
+            self.logger.error(f'进程池健康检查失败, 重建进程池: {error!r}')
+            self.restart()
+            return False
+
+        self.logger.debug(
+            f'进程池健康检查通过: {len(set(pids))} 个工作进程响应, '
+            f'耗时 {round((time.perf_counter() - start) * 1000, 1)} ms'
+        )
+        return True
+
+    def restart(self) -> None:
+        """ 终止并重建工作进程 """
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+        self.start()
+
+    def submit(self, func: Callable, args: tuple = (), kwds: dict = None):
+        """
+        下发一个任务
+        :param func: 任务函数, 必须可以被 pickle
+        :param args: 位置参数
+        :param kwds: 关键字参数
+        :return: 返回 multiprocessing.pool.AsyncResult
+        """
+        self.start()
+        return self._pool.apply_async(func, args, kwds or dict())
+
+    def run(self, func: Callable, items: List[dict], key: str = 'kwargs', failure: Callable = None,
+            deadline: float = None, **kwargs) -> List:
+        """
+        并发执行一批任务并等待全部完成, 进程池在完成后保持运行
+        :param func: 任务函数
+        :param items: 每个任务的参数
+        :param key: 参数传递给任务函数时使用的关键字
+        :param failure: 任务抛出异常或超时时调用 failure(item, error) 生成该任务的结果, 为 None 时直接抛出异常
+        :param deadline: 所有任务最晚完成的时间戳, 超过后不再等待并重建进程池, 为 None 时一直等待
+                         工作进程被 OOM 终止或崩溃时其任务永远不会完成, 需要通过 deadline 避免主进程一直阻塞
+        :param kwargs: 传递给每个任务的其他关键字参数
+        :return: 按 items 顺序返回任务结果
+        """
+        results = [self.submit(func, kwds={key: item, **kwargs}) for item in items]
+        output = []
+        hung = False
+        try:
+            for item, result in zip(items, results):
+                try:
+                    output.append(result.get(None if deadline is None else max(deadline - time.time(), 0)))
+                except multiprocessing.TimeoutError:
+                    hung = True
+                    error = TimeoutError(f'任务在 {time.strftime("%H:%M:%S", time.localtime(deadline))} 前没有完成')
+                    if failure is None:
+                        raise error
+                    output.append(failure(item, error))
+                except (Exception, ) as error:
+                    if failure is None:
+                        raise
+                    output.append(failure(item, error))
+        finally:
+            # 超时的任务所在的工作进程可能已经退出或卡死, 重建进程池, 之后的抢票时段不受影响
+            if hung:
+                self.logger.error('进程池中存在未完成的任务, 重建进程池')
+                self.restart()
+        return output
+
+    def close(self) -> None:
+        """ 关闭进程池及 Manager """
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+        if self._manager is not None:
+            self._manager.shutdown()
+            self._manager = None
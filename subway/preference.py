@@ -0,0 +1,96 @@
+# _author: Coke
+# _date: 2023/10/2 15:12
+
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import datetime
+import re
+
+FORMAT = '%Y%m%d'  # 与 metro.FORMAT 一致
+SLOT = re.compile(r'^\d{4}-\d{4}$')  # 时段格式, 如 0720-0730
+
+
+class Choice(NamedTuple):
+    """ 用户可以接受的一个站点及时段 """
+
+    line: str  # 线路名称, 如 昌平线
+    station: str  # 站点名称, 如 沙河站
+    slot: str  # 时段, 如 0720-0730
+
+    @property
+    def label(self) -> str:
+        return f'{self.station}-{self.slot}'
+
+
+def parse(items: Optional[Iterable[dict]], line: str, station: str) -> Tuple[Choice, ...]:
+    """
+    解析用户配置的 preferences, 未填写的线路及站点与用户的首选一致
+    :param items: 按优先级排列的候选, 如 [{"timeSlot": "0730-0740"}, {"stationName": "天通苑站", "lineName": "5号线", ...}]
+    :param line: 用户首选的线路
+    :param station: 用户首选的站点
+    :return: 不符合要求时抛出 AssertionError
+    """
+
+    choices = []
+    for item in items or ():
+        assert isinstance(item, dict), 'preferences 的 item 非对象'
+        slot = item.get('timeSlot')
+        assert isinstance(slot, str) and SLOT.match(slot), f'preferences 中的时段 {slot} 格式不正确, 格式为 0720-0730'
+        choices.append(Choice(item.get('lineName') or line, item.get('stationName') or station, slot))
+    return tuple(choices)
+
+
+def ranked(line: str, station: str, slot: str, preferences: Iterable[Choice] = ()) -> List[Choice]:
+    """ 按优先级排列的所有候选, 第一项为用户的首选, 重复的候选只保留优先级最高的一项 """
+    choices = []
+    for choice in (Choice(line, station, slot), *preferences):
+        if choice not in choices:
+            choices.append(choice)
+    return choices
+
+
+def windows(choices: Iterable[Choice]) -> Dict[str, str]:
+    """
+    每个站点需要查询余票的时段范围, 一个站点只需要查询一次余票
+    只有首选时查询范围与首选时段一致, 与没有配置 preferences 时的请求相同
+    :param choices: 候选列表
+    :return: 返回 站点: 查询时段, 如 {'沙河站': '0720-0750'}
+    """
+
+    result = dict()
+    for choice in choices:
+        start, end = choice.slot.split('-')
+        if choice.station in result:
+            _start, _end = result[choice.station].split('-')
+            start, end = min(start, _start), max(end, _end)
+        result[choice.station] = f'{start}-{end}'
+    return result
+
+
+def choose(snapshot: Dict[str, List[dict]], choices: Iterable[Choice], enter_date: str = None) -> Optional[Choice]:
+    """
+    根据同一轮的余票查询结果选择优先级最高且仍有余票的候选
+    :param snapshot: 站点: 余票接口返回的可预约时段, 参考 Metro.balance
+    :param choices: 按优先级排列的候选
+    :param enter_date: 进站日期, 默认为明天, 格式: 20230317
+    :return: 所有候选都没有余票时返回 None; 没有匹配的候选但首选站点的查询结果非空时 (如接口返回的日期或时段格式有变化)
+             与没有配置 preferences 时一致, 返回首选
+    """
+
+    choices = list(choices)
+    if enter_date is None:
+        enter_date = (datetime.date.today() + datetime.timedelta(1)).strftime(FORMAT)
+
+    available = set()
+    for station, items in snapshot.items():
+        for item in items or ():
+            date = str(item.get('enterDate') or enter_date).replace('-', '')
+            if date == enter_date:
+                available.add((station, item.get('timeSlot')))
+
+    for choice in choices:
+        if (choice.station, choice.slot) in available:
+            return choice
+
+    if choices and snapshot.get(choices[0].station):
+        return choices[0]
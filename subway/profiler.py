@@ -0,0 +1,122 @@
+# _author: Coke
+# _date: 2023/9/26 21:40
+
+from typing import Optional
+
+import tracemalloc
+import threading
+import cProfile
+import logging
+import pstats
+import time
+import io
+import os
+
+FORMAT = '%Y%m%d-%H%M%S'  # 与 trace.FORMAT 一致, 同一个抢票时段的文件前缀相同
+TOP = 30  # 报告中输出的函数及内存分配位置数量
+FRAMES = 5  # tracemalloc 记录的调用栈深度
+
+_local = threading.local()
+
+
+class Profiler:
+    """
+    只覆盖一个抢票时段的性能分析, 同时记录 cProfile 耗时及 tracemalloc 内存分配
+    退出时在 directory 中写入 <时段>-<名称>-<pid>.prof (可以通过 snakeviz、pstats 查看) 及同名的 .txt 文本报告
+    同一个线程中已经有分析器运行时不做任何操作, 例如协程引擎的每个用户已经被父级的 start_task 覆盖
+    """
+
+    def __init__(self, directory: Optional[str], label: str, release: float = None, top: int = TOP, logger=None):
+        """
+        :param directory: 输出目录, 为 None 时不做任何操作
+        :param label: 名称, 如 start_task、task-<用户名称>
+        :param release: 抢票时刻, 用于文件名前缀, 默认为当前时间
+        :param top: 报告中输出的数量
+        :param logger: <logger.LoggingOutput> 类
+        """
+        self.directory = directory
+        self.label = label
+        self.release = release if release is not None else time.time()
+        self.top = top
+        self.logger = logger if logger is not None else logging
+        self._profile: Optional[cProfile.Profile] = None
+        self._snapshot: Optional[tracemalloc.Snapshot] = None
+        self._tracing = False
+        self._active = False
+        self._start = 0.0
+
+    @property
+    def prefix(self) -> str:
+        name = ''.join(char if char.isalnum() or char in '-_' else '_' for char in self.label)
+        return os.path.join(
+            self.directory, f'{time.strftime(FORMAT, time.localtime(self.release))}-{name}-{os.getpid()}'
+        )
+
+    def __enter__(self):
+        if self.directory is None or getattr(_local, 'active', False):
+            return self
+
+        _local.active = self._active = True
+        self._start = time.perf_counter()
+
+        # tracemalloc 对整个进程生效, 已经由其他分析器启动时只比较快照
+        self._tracing = not tracemalloc.is_tracing()
+        if self._tracing:
+            tracemalloc.start(FRAMES)
+        self._snapshot = tracemalloc.take_snapshot()
+
+        self._profile = cProfile.Profile()
+        try:
+            self._profile.enable()
+        except ValueError:
+            # Python 3.12 起同一时间只能有一个 cProfile, 其他线程的分析器已经覆盖了当前线程
+            self._profile = None
+        return self
+
+    def __exit__(self, *args):
+        if not self._active:
+            return
+
+        if self._profile is not None:
+            self._profile.disable()
+        elapsed = time.perf_counter() - self._start
+        snapshot = tracemalloc.take_snapshot() if tracemalloc.is_tracing() else None
+        current, peak = tracemalloc.get_traced_memory()
+        if self._tracing:
+            tracemalloc.stop()
+        _local.active = self._active = False
+
+        try:
+            self.write(snapshot, elapsed, current, peak)
+        except OSError as error:
+            self.logger.error(f'写入性能分析报告失败: {error}')
+
+    def write(self, snapshot: Optional[tracemalloc.Snapshot], elapsed: float, current: int, peak: int) -> None:
+        """ 写入 .prof 文件及文本报告 """
+
+        os.makedirs(self.directory, exist_ok=True)
+        prefix = self.prefix
+        report = io.StringIO()
+        report.write(f'{self.label} pid={os.getpid()} 耗时 {round(elapsed * 1000, 1)} ms\n')
+        report.write(f'tracemalloc 当前 {round(current / 1024, 1)} KiB, 峰值 {round(peak / 1024, 1)} KiB\n\n')
+
+        if self._profile is not None:
+            self._profile.dump_stats(f'{prefix}.prof')
+            report.write(f'==== 累计耗时前 {self.top} 的函数 ====\n')
+            stats = pstats.Stats(self._profile, stream=report)
+            stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(self.top)
+
+        # 其他线程的分析器已经停止了 tracemalloc 时没有内存报告
+        if snapshot is not None:
+            report.write(f'\n==== 本时段新增内存前 {self.top} 的分配位置 ====\n')
+            filters = (
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, '<frozen importlib._bootstrap*>')
+            )
+            differences = snapshot.filter_traces(filters).compare_to(self._snapshot.filter_traces(filters), 'lineno')
+            for item in differences[:self.top]:
+                report.write(f'{item}\n')
+
+        with open(f'{prefix}.txt', 'w', encoding='utf-8') as file:
+            file.write(report.getvalue())
+        self.logger.debug(f'性能分析报告已写入 {prefix}.txt')
@@ -0,0 +1,176 @@
+# _author: Coke
+# _date: 2023/8/19 15:06
+
+from typing import Dict, List, Optional, Tuple
+
+import threading
+import datetime
+import re
+import time
+
+FORMAT = '%Y%m%d'  # 格式化时间
+PAGES = 10  # 单次刷新最多跟随的分页数量
+TTL = 60  # 索引的最长有效期, 过期后全量重建, 用于兜底用户在其他设备上取消预约等无法感知的变化
+ID_FIELDS = ('id', 'appointmentId')  # 预约记录中可以作为 lastid 的字段
+
+# 预约记录中的进站时间, 格式: 3月17日 (07:20~07:30)
+_ARRIVAL = re.compile(r'(\d{1,2})月(\d{1,2})日\s*\((\d{2}):(\d{2})~(\d{2}):(\d{2})\)')
+
+
+def record_id(record: dict) -> Optional[str]:
+    """ 获取预约记录的 ID, 用于分页及增量刷新 """
+    for field in ID_FIELDS:
+        value = record.get(field)
+        if value:
+            return str(value)
+
+
+def parse_arrival(text: str, today: datetime.date = None) -> Optional[Tuple[str, str]]:
+    """
+    解析预约记录中的进站时间
+    :param text: 格式: 3月17日 (07:20~07:30)
+    :param today: 用于推断年份的日期, 默认为今天
+    :return: 返回 (进站日期, 时段) 格式: ('20230317', '0720-0730'), 格式不正确时返回 None
+    """
+
+    match = _ARRIVAL.search(text or '')
+    if match is None:
+        return None
+
+    today = today or datetime.date.today()
+    month, day, start_hour, start_minute, end_hour, end_minute = match.groups()
+    try:
+        date = datetime.date(today.year, int(month), int(day))
+    except ValueError:
+        return None
+
+    # 跨年时记录中的月份会小于当前月份
+    if (today - date).days > 180:
+        date = date.replace(year=today.year + 1)
+
+    return date.strftime(FORMAT), f'{start_hour}{start_minute}-{end_hour}{end_minute}'
+
+
+def _order(record: dict) -> Optional[tuple]:
+    """ 预约记录的新旧顺序, 优先使用数字 ID (即创建顺序), 没有时使用进站时间 """
+    _id = record_id(record)
+    if _id is not None and _id.isdigit():
+        return 0, int(_id)
+    arrival = parse_arrival(record.get('arrivalTime'))
+    return None if arrival is None else (1, *arrival)
+
+
+def newest_first(records: List[dict]) -> bool:
+    """ 一页预约记录是否按从新到旧排列, 无法比较时返回 False """
+    keys = [_order(record) for record in records]
+    if None in keys or len({key[0] for key in keys}) > 1:
+        return False
+    return all(a >= b for a, b in zip(keys, keys[1:]))
+
+
+class AppointmentIndex:
+    """
+    单个 Metro 的预约记录索引 (即一个用户的一个抢票时段), 以 (进站日期, 站点, 时段) 为 Key
+    索引只会被可能改变预约记录的事件 (如抢票请求) 置为失效, 有效期内的存在性检查不需要访问网络
+    失效后增量刷新, 超过有效期后全量重建, 已经取消的预约会被移除
+    """
+
+    def __init__(self, ttl: float = TTL):
+        self.ttl = ttl
+        self._index: Dict[Tuple[str, str, str], dict] = dict()
+        self._ids = set()
+        self._updated = 0.0
+        self._valid = False
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._index)
+
+    @property
+    def valid(self) -> bool:
+        """ 索引是否可以直接使用 """
+        return self._valid and not self.expired
+
+    @property
+    def expired(self) -> bool:
+        """ 索引从未建立或已经超过有效期, 需要全量重建 """
+        return not self._updated or time.time() - self._updated > self.ttl
+
+    @property
+    def generation(self) -> int:
+        """ 索引的失效次数, 刷新前记录此值, 刷新期间如果再次失效则刷新结果不会被置为有效 """
+        return self._generation
+
+    def invalidate(self) -> None:
+        """ 将索引置为失效, 下次检查时会增量刷新 """
+        with self._lock:
+            self._valid = False
+            self._generation += 1
+
+    @staticmethod
+    def _add(record: dict, index: dict, ids: set) -> None:
+        _id = record_id(record)
+        if _id is not None:
+            ids.add(_id)
+
+        arrival = parse_arrival(record.get('arrivalTime'))
+        if arrival is not None:
+            index[(arrival[0], record.get('stationName'), arrival[1])] = record
+
+    def update(self, records: List[dict]) -> bool:
+        """
+        将一页预约记录合并到索引中, 用于增量刷新
+        只有此页按从新到旧排列且出现了已索引的记录时, 之后的分页才一定都已经索引过; 无法确认顺序时继续获取下一页
+        :param records: 预约列表接口返回的一页数据
+        :return: 需要继续获取下一页时返回 True
+        """
+
+        known = False
+        with self._lock:
+            for record in records:
+                _id = record_id(record)
+                if _id is not None and _id in self._ids:
+                    known = True
+                    continue
+                self._add(record, self._index, self._ids)
+
+        return bool(records) and not (known and newest_first(records))
+
+    def rebuild(self, records: List[dict], generation: int) -> None:
+        """
+        以全量获取的预约记录替换索引, 索引中已经不存在于记录中的预约 (如在其他设备上取消) 会被移除
+        :param records: 所有分页的预约记录
+        :param generation: 开始获取时的 generation, 参考 validate
+        :return:
+        """
+
+        index, ids = dict(), set()
+        for record in records:
+            self._add(record, index, ids)
+
+        with self._lock:
+            self._index, self._ids = index, ids
+        self.validate(generation)
+
+    def validate(self, generation: int) -> None:
+        """
+        完成刷新后将索引置为有效
+        :param generation: 开始刷新时的 generation
+        :return:
+        """
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._valid = True
+            self._updated = time.time()
+
+    def exists(self, enter_date: str, station_name: str, time_slot: str) -> bool:
+        """
+        检查是否存在指定的预约
+        :param enter_date: 进站日期, 格式: 20230317
+        :param station_name: 站点名称, 格式: 沙河站
+        :param time_slot: 时段, 格式: 0720-0730
+        :return:
+        """
+        return (enter_date, station_name, time_slot) in self._index
@@ -0,0 +1,224 @@
+# _author: Coke
+# _date: 2023/8/2 21:10
+
+from typing import List, Optional, Tuple
+from requests.adapters import HTTPAdapter
+
+import urllib.parse
+import threading
+import logging
+import socket
+import time
+import ssl
+
+HOST = 'webapi.mybti.cn'  # 地铁接口的主机名
+TTL = 300  # DNS 缓存有效期, 单位秒
+
+
+class Resolver:
+    """
+    DNS 预解析及节点测速
+    在抢票前解析出主机的所有地址并缓存, 逐个测量握手耗时后将连接固定到最快的节点
+    """
+
+    def __init__(self, host: str = HOST, port: int = 443, **kwargs):
+        """
+        :param host: 需要解析的主机名
+        :param port: 测速使用的端口
+        :param kwargs:
+                ttl -> int: 解析结果的缓存时间
+                tls -> bool: 测速时是否完成 TLS 握手, 本地替身服务使用 http 时传递 False
+                timeout -> float: 单个节点测速的超时时间
+                addresses -> list: 固定的地址列表, 传递后不再进行 DNS 解析, 用于指向本地替身服务的多个回环地址
+                logger -> Type: <logger.LoggingOutput> 类
+        """
+        self.host = host
+        self.port = port
+        self.ttl = kwargs.pop('ttl', TTL)
+        self.tls = kwargs.pop('tls', True)
+        self.timeout = kwargs.pop('timeout', 2)
+        self.static = kwargs.pop('addresses', None)
+        self.logger = kwargs.pop('logger', None) or logging
+        self.addresses: List[str] = []  # 解析出的所有地址
+        self.resolved_at = 0.0  # 最近一次解析的时间
+        self.ranking: List[Tuple[float, str]] = []  # 按握手耗时升序排列的 (耗时, 地址)
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_lock')
+        state['logger'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.logger = logging
+        self._lock = threading.Lock()
+
+    @property
+    def expired(self) -> bool:
+        """ 缓存是否已过期 """
+        return time.time() - self.resolved_at > self.ttl
+
+    def resolve(self, force: bool = False) -> List[str]:
+        """
+        解析主机的所有地址, 在缓存有效期内直接返回缓存
+        :param force: 是否忽略缓存强制解析
+        :return: 返回地址列表
+        """
+
+        with self._lock:
+            if not force and self.addresses and not self.expired:
+                return self.addresses
+
+            if self.static:
+                addresses = list(self.static)
+            else:
+                try:
+                    info = socket.getaddrinfo(self.host, self.port, type=socket.SOCK_STREAM)
+                except socket.gaierror as error:
+                    self.logger.error(f'解析 {self.host} 失败: {error}')
+                    return self.addresses
+                addresses = list(dict.fromkeys(item[4][0] for item in info))
+
+            self.addresses = addresses
+            self.resolved_at = time.time()
+            self.logger.debug(f'{self.host} 解析结果: {addresses}')
+            return addresses
+
+    def probe(self, address: str) -> float:
+        """
+        测量与指定地址完成 TCP (及 TLS) 握手的耗时
+        :param address: 需要测速的地址
+        :return: 返回握手耗时, 失败时返回 inf
+        """
+
+        start = time.perf_counter()
+        try:
+            with socket.create_connection((address, self.port), timeout=self.timeout) as sock:
+                if self.tls:
+                    context = ssl.create_default_context()
+                    with context.wrap_socket(sock, server_hostname=self.host):
+                        pass
+        except (OSError, ssl.SSLError) as error:
+            self.logger.debug(f'{address} 测速失败: {error}')
+            return float('inf')
+
+        return time.perf_counter() - start
+
+    def rank(self) -> List[Tuple[float, str]]:
+        """
+        解析并并发测速所有地址, 按握手耗时排序
+        :return: 返回 [(耗时, 地址), ...]
+        """
+
+        addresses = self.resolve()
+        result = {}
+
+        def probe(address):
+            result[address] = self.probe(address)
+
+        threads = [threading.Thread(target=probe, args=(item, ), daemon=True) for item in addresses]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        ranking = sorted((latency, address) for address, latency in result.items())
+        self.ranking = ranking
+        for latency, address in ranking:
+            self.logger.debug(f'{self.host} 节点 {address} 握手耗时 {round(latency * 1000, 1)} ms')
+
+        return ranking
+
+    def prepare(self) -> Optional[str]:
+        """
+        在抢票前调用, 刷新解析结果并测速, 之后的连接都会固定到最快的节点
+        :return: 返回最快的地址
+        """
+        self.resolve(force=True)
+        self.rank()
+        address = self.fastest()
+        if address is not None:
+            self.logger.info(f'{self.host} 已固定到节点 {address}')
+        return address
+
+    def fastest(self) -> Optional[str]:
+        """
+        获取握手耗时最短的可用地址, 只读取缓存, 不会在关键时刻触发 DNS 查询
+        :return: 未测速或全部不可用时返回 None, 此时使用系统解析
+        """
+        for latency, address in self.ranking:
+            if latency != float('inf'):
+                return address
+
+
+class PinnedAdapter(HTTPAdapter):
+    """ 将请求固定到 Resolver 中最快节点的适配器, 保持 Host 请求头及 TLS SNI 为原主机名 """
+
+    def __init__(self, resolver: Resolver, tls: bool = True, **kwargs):
+        """
+        :param resolver: <Resolver> 类
+        :param tls: 是否挂载在 https 协议上, 为 True 时连接池会以原主机名进行 SNI 及证书校验
+        :param kwargs: 参考 requests.adapters.HTTPAdapter
+        """
+        self.resolver = resolver
+        self.tls = tls
+        super(PinnedAdapter, self).__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        # 连接到 IP 时仍以原主机名进行 SNI 及证书校验
+        if self.tls:
+            kwargs['server_hostname'] = self.resolver.host
+            kwargs['assert_hostname'] = self.resolver.host
+        super(PinnedAdapter, self).init_poolmanager(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        url = urllib.parse.urlsplit(request.url)
+        address = self.resolver.fastest()
+        if address is not None and url.hostname == self.resolver.host:
+            netloc = f'[{address}]' if ':' in address else address
+            if url.port:
+                netloc = f'{netloc}:{url.port}'
+            request.headers.setdefault('Host', url.netloc)
+            request.url = url._replace(netloc=netloc).geturl()
+
+        return super(PinnedAdapter, self).send(request, **kwargs)
+
+
+class PinnedResolver:
+    """
+    aiohttp 使用的解析器, 按 Resolver 的测速结果返回地址, 其他主机使用默认解析
+    实现了 aiohttp.abc.AbstractResolver 的接口, 不继承是为了只在创建时才导入 aiohttp
+    """
+
+    def __init__(self, resolver: Resolver):
+        from aiohttp.resolver import DefaultResolver
+
+        self.resolver = resolver
+        self.default = DefaultResolver()
+
+    async def resolve(self, host, port=0, family=socket.AF_INET):
+        address = self.resolver.fastest()
+        if address is None or host != self.resolver.host:
+            return await self.default.resolve(host, port, family)
+
+        addresses = [item for latency, item in self.resolver.ranking if latency != float('inf')]
+        return [
+            dict(
+                hostname=host,
+                host=item,
+                port=port,
+                family=socket.AF_INET6 if ':' in item else socket.AF_INET,
+                proto=0,
+                flags=socket.AI_NUMERICHOST
+            ) for item in addresses
+        ]
+
+    async def close(self):
+        await self.default.close()
+
+
+if __name__ == '__main__':
+    _resolver = Resolver()
+    print(_resolver.prepare(), _resolver.ranking)
@@ -1,34 +1,46 @@
 # _author: Coke
 # _date: 2023/7/24 14:00
 
-from subway import Subway
+from subway import Subway, coalesce
+from subway.main import ASYNC, SHARD
 
 import threading
-import json
+import asyncio
 
 
 class RewriteSubway(Subway):
-    """ 线程抢票 """
+    """
+    线程抢票, 指定 async 引擎时以协程抢票, 用户数量较多时可以显式指定 async 或 shard 引擎
+    传递 profile=True 时与 Subway 相同, 父级的 start_task 及每个线程中的用户任务分别输出性能分析报告
+    """
+
+    def create_pool(self):
+        """ 线程及协程引擎不需要进程池, 只有 shard 引擎使用常驻进程池 """
+        return super(RewriteSubway, self).create_pool() if self.engine == SHARD else None
 
     def start_task(self, start_time: float) -> list:
         """
-        通过线程启动任务
+        通过线程启动任务, 如果指定了 async 引擎则在当前线程的事件循环中以协程启动任务
         :param start_time:
         :return:
         """
 
-        task_result = []
-        subway_result = []
-        for item in json.loads(self.file_content).get('userAgent'):
+        if self.engine == SHARD:
+            return self.start_task_shard(start_time)
 
-            _continue = self.task_continue(item)
-            if _continue:
-                continue
+        # 用户参数只生成一次, 按实际使用的引擎设置余票缓存
+        items = self.task_items(start_time)
+        asynchronous = self.engine == ASYNC
+        cache = coalesce.AsyncBalanceCache() if asynchronous else coalesce.BalanceCache()
+        for item in items:
+            item['balanceCache'] = cache
 
-            item['startTime'] = start_time
-            item['level'] = self.logger_level
-            item['logPath'] = self.log_path
-            item['logConf'] = self.log_conf
+        if asynchronous:
+            return asyncio.run(self.start_task_async(start_time, items))
+
+        task_result = []
+        subway_result = []
+        for item in items:
             result = threading.Thread(
                 target=self.task,
                 kwargs=dict(
@@ -0,0 +1,229 @@
+# _author: Coke
+# _date: 2023/8/6 10:32
+
+from typing import Callable, Dict, List, Optional
+
+import collections
+import threading
+import statistics
+import logging
+import heapq
+import time
+
+COARSE = 0.05  # 距离目标时间大于此值时使用粗粒度休眠, 之后进入精确逼近阶段
+SPIN = 0.002  # 精确逼近阶段最后的自旋时长
+MAX_SLEEP = 30.0  # 单次休眠的最长时间, 每次醒来都会以系统时间重新计算, 用于应对系统时间跳变及休眠唤醒
+
+
+def _approach(deadline: float) -> None:
+    """
+    精确逼近阶段, 将剩余的时间换算为单调时钟, 避免最后几十毫秒受到系统时间校准的影响
+    :param deadline: 目标时间戳
+    :return:
+    """
+    target = time.monotonic() + deadline - time.time()
+    while True:
+        # 每轮只读取一次时钟, 避免两次读取之间越过自旋边界时休眠时长为负数
+        remaining = target - time.monotonic() - SPIN
+        if remaining <= 0:
+            break
+        time.sleep(remaining / 2)
+    while time.monotonic() < target:
+        pass
+
+
+def wait(deadline: float) -> float:
+    """
+    阻塞当前线程直到到达指定时间
+    距离目标较远时粗粒度休眠, 每次醒来以系统时间重新计算剩余时间, 最后以单调时钟精确逼近
+    :param deadline: 目标时间戳
+    :return: 返回实际触发时间与目标时间的误差, 单位秒
+    """
+
+    while True:
+        remaining = deadline - time.time()
+        if remaining <= COARSE:
+            break
+        time.sleep(min(remaining - COARSE, MAX_SLEEP))
+
+    _approach(deadline)
+    return time.time() - deadline
+
+
+async def async_wait(deadline: float) -> float:
+    """
+    wait 的协程版本, 粗粒度休眠阶段不会阻塞事件循环
+    :param deadline: 目标时间戳
+    :return: 返回实际触发时间与目标时间的误差, 单位秒
+    """
+
+    # 只有协程引擎才会用到, 不在模块顶层导入, 避免线程及进程引擎的冷启动导入 asyncio
+    import asyncio
+
+    while True:
+        remaining = deadline - time.time()
+        if remaining <= COARSE:
+            break
+        await asyncio.sleep(min(remaining - COARSE, MAX_SLEEP))
+
+    remaining = deadline - time.time()
+    if remaining > SPIN:
+        await asyncio.sleep(remaining - SPIN)
+    while time.time() < deadline:
+        await asyncio.sleep(0)
+    return time.time() - deadline
+
+
+class Scheduler:
+    """
+    中心调度器, 使用最小堆维护所有的定时任务, 由一个后台线程按时间顺序触发
+    抢票时刻、通知定时器和每日切换都注册在此调度器中, 并记录每次触发的误差
+    """
+
+    def __init__(self, logger=None, history: int = 256):
+        """
+        :param logger: <logger.LoggingOutput> 类
+        :param history: 每个名称保留的误差记录数量
+        """
+        self.logger = logger if logger is not None else logging
+        self._heap: List[list] = []
+        self._counter = 0
+        self._condition = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._errors: Dict[str, collections.deque] = collections.defaultdict(
+            lambda: collections.deque(maxlen=history)
+        )
+
+    def start(self) -> None:
+        """ 启动调度线程, 重复调用不会启动多个线程 """
+        with self._condition:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._loop, daemon=True)
+            self._thread.start()
+
+    def register(self, deadline: float, callback: Callable[[float], None], name: str = 'default') -> list:
+        """
+        注册一个定时任务
+        :param deadline: 触发的时间戳
+        :param callback: 触发时在调度线程中调用, 参数为触发误差, 不应执行耗时操作
+        :param name: 任务名称, 触发误差按名称统计
+        :return: 返回任务句柄, 可用于 cancel
+        """
+        self.start()
+        with self._condition:
+            self._counter += 1
+            entry = [deadline, self._counter, callback, name]
+            heapq.heappush(self._heap, entry)
+            self._condition.notify()
+        return entry
+
+    def cancel(self, entry: list) -> None:
+        """
+        取消已注册的定时任务
+        :param entry: register 返回的任务句柄
+        :return:
+        """
+        with self._condition:
+            entry[2] = None
+            self._condition.notify()
+
+    def wait(self, deadline: float, name: str = 'default') -> float:
+        """
+        注册定时任务并阻塞当前线程直到触发
+        :param deadline: 触发的时间戳
+        :param name: 任务名称
+        :return: 返回触发误差, 单位秒
+        """
+        event = threading.Event()
+        result = []
+
+        def callback(error):
+            result.append(error)
+            event.set()
+
+        self.register(deadline, callback, name)
+        event.wait()
+        return result[0]
+
+    def _loop(self) -> None:
+        """ 调度线程, 在最近的任务到期前粗粒度等待, 有更早的任务注册时会被唤醒 """
+
+        while True:
+            with self._condition:
+                while self._heap and self._heap[0][2] is None:
+                    heapq.heappop(self._heap)
+
+                if not self._heap:
+                    self._condition.wait()
+                    continue
+
+                deadline = self._heap[0][0]
+                remaining = deadline - time.time()
+                if remaining > COARSE:
+                    # 每次醒来都以系统时间重新计算, 系统时间跳变或休眠唤醒后也能及时触发
+                    self._condition.wait(min(remaining - COARSE, MAX_SLEEP))
+                    continue
+
+                entry = heapq.heappop(self._heap)
+
+            # 逼近阶段及回调的任何异常都不能终止调度线程, 否则所有等待中的任务都不会再触发
+            try:
+                _approach(entry[0])
+            except (Exception, ) as e:
+                self.logger.error(f'定时任务 {entry[3]} 精确逼近失败, 立即触发: {e}')
+
+            callback = entry[2]
+            if callback is None:
+                continue
+
+            error = time.time() - entry[0]
+            self._errors[entry[3]].append(error)
+            try:
+                callback(error)
+            except (Exception, ) as e:
+                self.logger.error(f'定时任务 {entry[3]} 执行失败: {e}')
+
+    def report(self) -> Dict[str, dict]:
+        """
+        统计每个任务名称的触发误差
+        :return: {name: dict(count, mean, p50, p99, max)} 单位毫秒
+        """
+        result = dict()
+        for name, errors in list(self._errors.items()):
+            if not errors:
+                continue
+            values = sorted(abs(item) * 1000 for item in errors)
+            result[name] = dict(
+                count=len(values),
+                mean=round(statistics.mean(values), 3),
+                p50=round(values[int(len(values) * 0.5)], 3),
+                p99=round(values[min(int(len(values) * 0.99), len(values) - 1)], 3),
+                max=round(values[-1], 3)
+            )
+        return result
+
+    def log_report(self) -> None:
+        """ 将触发误差统计输出到日志 """
+        for name, item in self.report().items():
+            self.logger.info(
+                f'定时器 {name} 触发 {item["count"]} 次, 误差均值 {item["mean"]} ms, '
+                f'P50 {item["p50"]} ms, P99 {item["p99"]} ms, 最大 {item["max"]} ms'
+            )
+
+
+def jitter(samples: int = 20, delay: float = 0.2) -> dict:
+    """
+    测量当前主机上调度器的触发误差
+    :param samples: 采样次数
+    :param delay: 每次采样的定时间隔
+    :return: 返回误差统计, 单位毫秒
+    """
+    scheduler = Scheduler()
+    for _ in range(samples):
+        scheduler.wait(time.time() + delay, 'jitter')
+    return scheduler.report().get('jitter', {})
+
+
+if __name__ == '__main__':
+    print(jitter())
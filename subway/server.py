@@ -0,0 +1,362 @@
+# _author: Coke
+# _date: 2023/8/23 21:37
+
+from typing import Dict, List, Optional, Tuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import urllib.parse
+import collections
+import threading
+import datetime
+import random
+import struct
+import socket
+import base64
+import click
+import json
+import time
+import sys
+
+FORMAT = '%Y%m%d'  # 格式化时间
+PAGE_SIZE = 10  # 预约列表每页的数量
+CREATE = 'CreateAppointment'
+BALANCE = 'GetBalance'
+RECORD = 'GetAppointmentList'
+ENDPOINTS = {
+    '/Appointment/CreateAppointment': CREATE,
+    '/Appointment/GetBalance': BALANCE,
+    '/AppointmentRecord/GetAppointmentList': RECORD
+}
+
+
+def make_token(uid: str, expire: Optional[float] = None) -> str:
+    """
+    生成替身服务可以识别的 Token, 格式与地铁系统一致: base64(uid,过期毫秒时间戳,签名), 可以被 utils.decode 解析
+    :param uid: 用户 ID
+    :param expire: 过期时间戳, 默认为 7 天后
+    :return:
+    """
+    expire = expire if expire is not None else time.time() + 7 * 86400
+    return base64.b64encode(f'{uid},{int(expire * 1000)},stand-in'.encode()).decode()
+
+
+def read_token(token: Optional[str]) -> Optional[str]:
+    """
+    解析替身服务的 Token
+    :param token: Authorization 请求头
+    :return: 返回用户 ID, Token 不正确或已过期时返回 None
+    """
+    try:
+        uid, expire, _ = base64.b64decode(token or '').decode().split(',')
+        return uid if int(expire) / 1000 > time.time() else None
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+class Fault:
+    """
+    单个接口的故障注入配置, 配置格式如下, 时间单位均为毫秒:
+        {
+            "latency": {"distribution": "uniform", "low": 20, "high": 200},  // 或 {"distribution": "normal", "mean": 80, "std": 30}
+            "timeout": 0.05,  // 请求挂起直到客户端超时的概率
+            "error": 0.1,  // 返回 5xx 的概率
+            "reset": 0.02,  // 直接重置连接的概率
+            "hang": 10000  // 超时请求挂起的时长
+        }
+    """
+
+    __slots__ = ('latency', 'timeout', 'error', 'reset', 'hang')
+
+    def __init__(self, conf: Optional[dict] = None):
+        conf = conf or dict()
+        self.latency = conf.get('latency') or dict()
+        self.timeout = conf.get('timeout', 0)
+        self.error = conf.get('error', 0)
+        self.reset = conf.get('reset', 0)
+        self.hang = conf.get('hang', 10000)
+
+    def delay(self) -> float:
+        """ 按延迟分布生成本次请求的延迟, 单位秒 """
+        distribution = self.latency.get('distribution', 'uniform')
+        if distribution == 'normal':
+            value = random.gauss(self.latency.get('mean', 0), self.latency.get('std', 0))
+        else:
+            value = random.uniform(self.latency.get('low', 0), self.latency.get('high', 0))
+        return max(value, 0) / 1000
+
+    def draw(self) -> Optional[str]:
+        """ 抽取本次请求注入的故障, 返回 timeout, error, reset 或 None """
+        value = random.random()
+        for name in ('reset', 'timeout', 'error'):
+            probability = getattr(self, name)
+            if value < probability:
+                return name
+            value -= probability
+
+
+class _Server(ThreadingHTTPServer):
+    """ 忽略客户端主动断开连接的异常, 抢票成功后客户端会取消尚未完成的请求 """
+
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super(_Server, self).handle_error(request, client_address)
+
+
+class StandIn:
+    """
+    webapi.mybti.cn 的本地替身服务, 实现了余票、抢票和预约列表接口
+    支持按站点及时段配置库存、放票时刻, 以及按接口注入延迟、超时、5xx 和连接重置
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, **kwargs):
+        """
+        :param host: 监听地址, 需要多个回环地址时使用 0.0.0.0
+        :param port: 监听端口, 0 为随机端口
+        :param kwargs:
+                inventory -> dict: 库存, {"沙河站": {"0720-0730": 10}}
+                release -> float: 放票时间戳, 之前查询余票为 0 且抢票失败, 默认立即放票
+                faults -> dict: 故障注入, {"CreateAppointment": {...}} 参考 Fault
+        """
+        self.host = host
+        self.port = port
+        self.release = kwargs.pop('release', 0)
+        self.faults: Dict[str, Fault] = {key: Fault(value) for key, value in (kwargs.pop('faults', None) or {}).items()}
+        self.inventory: Dict[Tuple[str, str], int] = dict()
+        for station, slots in (kwargs.pop('inventory', None) or {}).items():
+            for slot, count in slots.items():
+                self.inventory[(station, slot)] = count
+        self.records: Dict[str, List[dict]] = collections.defaultdict(list)  # 按用户 ID 保存的预约记录, 新记录在前
+        self.stats = collections.Counter()  # 按接口及结果统计的请求数量
+        self._sequence = 0
+        self._lock = threading.Lock()
+        self._server: Optional[_Server] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    @property
+    def url(self) -> str:
+        """ 服务地址, 可以作为 Metro 的 domain """
+        host = '127.0.0.1' if self.host == '0.0.0.0' else self.host
+        return f'http://{host}:{self.port}'
+
+    def start(self) -> None:
+        """ 在后台线程中启动服务 """
+        handler = type('Handler', (_Handler, ), dict(stand_in=self))
+        self._server = _Server((self.host, self.port), handler)
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """ 停止服务 """
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def token(self, uid: str, expire: Optional[float] = None) -> str:
+        """ 参考 make_token """
+        return make_token(uid, expire)
+
+    def balance(self, station: str, enter_dates: List[str], window: str) -> List[dict]:
+        """
+        查询余票, 返回时段落在 window 内的库存
+        :param station: 站点名称
+        :param enter_dates: 进站日期列表
+        :param window: 查询时段, 格式: 0630-0930
+        :return:
+        """
+        start, end = (window or '0000-2400').split('-')
+        released = time.time() >= self.release
+        result = []
+        with self._lock:
+            for (_station, slot), count in sorted(self.inventory.items()):
+                if _station != station or not (start <= slot[:4] and slot[5:] <= end):
+                    continue
+                for date in enter_dates:
+                    balance = count if released else 0
+                    result.append(dict(
+                        stationName=station,
+                        enterDate=date,
+                        timeSlot=slot,
+                        balance=balance,
+                        status=0 if balance else 1
+                    ))
+        return result
+
+    def create(self, uid: str, body: dict) -> dict:
+        """
+        抢票, 库存充足且放票后扣减库存并生成预约记录
+        :param uid: 用户 ID
+        :param body: 抢票接口的请求体
+        :return: 成功时 balance 为正数
+        """
+        station, slot, date = body.get('stationName'), body.get('timeSlot'), body.get('enterDate')
+        with self._lock:
+            if time.time() < self.release or self.inventory.get((station, slot), 0) <= 0:
+                return dict(balance=0)
+
+            for item in self.records[uid]:
+                if item['stationName'] == station and item['enterDate'] == date and item['timeSlot'] == slot:
+                    return dict(balance=0)
+
+            self.inventory[(station, slot)] -= 1
+            self._sequence += 1
+            day = datetime.datetime.strptime(date, FORMAT)
+            self.records[uid].insert(0, dict(
+                id=str(self._sequence),
+                stationName=station,
+                lineName=body.get('lineName'),
+                enterDate=date,
+                timeSlot=slot,
+                arrivalTime=f'{day.month}月{day.day}日 ({slot[:2]}:{slot[2:4]}~{slot[5:7]}:{slot[7:]})'
+            ))
+            return dict(balance=self.inventory[(station, slot)] + 1, appointmentId=str(self._sequence))
+
+    def appointments(self, uid: str, lastid: str) -> List[dict]:
+        """
+        获取预约列表, 按 lastid 分页
+        :param uid: 用户 ID
+        :param lastid: 上一页最后一条记录的 ID, 第一页为空字符串
+        :return:
+        """
+        with self._lock:
+            records = list(self.records[uid])
+        if lastid:
+            ids = [item['id'] for item in records]
+            records = records[ids.index(lastid) + 1:] if lastid in ids else []
+        return records[:PAGE_SIZE]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """ 替身服务的请求处理 """
+
+    protocol_version = 'HTTP/1.1'
+    stand_in: StandIn = None
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status: int, body=None) -> None:
+        data = json.dumps(body, ensure_ascii=False).encode() if body is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(data)
+
+    def _fault(self, endpoint: str) -> bool:
+        """
+        按接口注入故障
+        :return: 如果请求已经被故障处理则返回 True
+        """
+        fault = self.stand_in.faults.get(endpoint)
+        if fault is None:
+            return False
+
+        time.sleep(fault.delay())
+        kind = fault.draw()
+        if kind is None:
+            return False
+
+        self.stand_in.stats[f'{endpoint}:{kind}'] += 1
+        if kind == 'reset':
+            # SO_LINGER 为 0 时关闭连接会发送 RST
+            self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+            self.close_connection = True
+            self.connection.close()
+        elif kind == 'timeout':
+            time.sleep(fault.hang / 1000)
+            self.close_connection = True
+        else:
+            self._send(503, dict(message='Service Unavailable'))
+        return True
+
+    def _dispatch(self, body: Optional[dict]) -> None:
+        url = urllib.parse.urlsplit(self.path)
+        endpoint = ENDPOINTS.get(url.path)
+        if endpoint is None:
+            self._send(200 if url.path == '/' else 404)
+            return
+
+        if self._fault(endpoint):
+            return
+
+        uid = read_token(self.headers.get('Authorization'))
+        if uid is None:
+            self.stand_in.stats[f'{endpoint}:401'] += 1
+            self._send(401, dict(message='Unauthorized'))
+            return
+
+        self.stand_in.stats[endpoint] += 1
+        body = body or dict()
+        if endpoint == BALANCE:
+            result = self.stand_in.balance(body.get('stationName'), body.get('enterDates') or [], body.get('timeSlot'))
+        elif endpoint == CREATE:
+            result = self.stand_in.create(uid, body)
+        else:
+            query = urllib.parse.parse_qs(url.query)
+            result = self.stand_in.appointments(uid, (query.get('lastid') or [''])[0])
+        self._send(200, result)
+
+    def do_HEAD(self):
+        self._send(200)
+
+    def do_GET(self):
+        self._dispatch(None)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            self._send(400)
+            return
+        self._dispatch(body)
+
+
+__port = '监听端口'
+__conf = '替身服务配置文件, 包含 inventory, faults 字段, 参考 StandIn'
+__release = '距离启动多少秒后放票, 默认立即放票'
+__host = '监听地址, 需要多个回环地址时使用 0.0.0.0'
+
+
+@click.command()
+@click.option('--port', '-p', help=__port, default=8080)
+@click.option('--conf', '-c', help=__conf, default='')
+@click.option('--release', '-r', help=__release, default=0.0)
+@click.option('--host', '-h', help=__host, default='127.0.0.1')
+def command(port: int, conf: str, release: float, host: str) -> None:
+    """ 启动 webapi.mybti.cn 的本地替身服务 """
+    content = dict()
+    if conf:
+        with open(conf, 'r', encoding='utf-8') as file:
+            content = json.loads(file.read())
+
+    server = StandIn(
+        host,
+        port,
+        inventory=content.get('inventory') or {'沙河站': {'0720-0730': 10}},
+        faults=content.get('faults'),
+        release=time.time() + release
+    )
+    server.start()
+    click.echo(f'替身服务已启动: {server.url}, 测试 Token: {server.token("stand-in")}')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    command()
@@ -0,0 +1,60 @@
+# _author: Coke
+# _date: 2023/8/26 14:52
+
+from typing import Callable, Dict, List, Optional, Tuple
+
+import collections
+import heapq
+import math
+import os
+
+LIMIT = 256  # 单个分片连接池的上限, 超出的请求会在连接池中排队, 避免文件描述符随用户数量线性增长
+USERS = 150  # 单个分片建议承载的用户数量上限, 超过后抢票时刻的事件循环调度延迟会明显增加
+
+
+def default_shards() -> int:
+    """ 默认分片数量, 与 CPU 核数一致 """
+    return os.cpu_count() or 1
+
+
+def partition(users: List[dict], shards: int, weight: Optional[Callable[[dict], int]] = None) -> List[List[dict]]:
+    """
+    将用户按 (站点, 时段) 分组后均衡分配到多个分片中
+    同一站点及时段的用户分配到同一分片, 使分片内的余票缓存可以合并查询, 各分片的负载最多相差一个组;
+    只有负载超过平均负载两倍的组会被拆分, 避免单个分片承载大部分用户
+    :param users: 用户列表, 参考 Subway.task_items
+    :param shards: 分片数量, 实际数量不会超过用户数量
+    :param weight: 计算单个用户负载的函数, 默认为 1, 可以传递用户抢票计划的并发数量
+    :return: 返回每个分片的用户列表, 不包含没有分配到用户的分片
+    """
+
+    if not users:
+        return []
+
+    weight = weight or (lambda x: 1)
+    shards = max(1, min(shards, len(users)))
+
+    groups: Dict[Tuple[str, str], List[Tuple[int, dict]]] = collections.OrderedDict()
+    for user in users:
+        key = (user.get('stationName'), user.get('timeSlot'))
+        groups.setdefault(key, []).append((weight(user), user))
+
+    target = sum(item[0] for group in groups.values() for item in group) / shards
+    parts: List[Tuple[int, List[dict]]] = []
+    for group in groups.values():
+        load = sum(item[0] for item in group)
+        count = math.ceil(load / target) if load > 2 * target else 1
+        size = math.ceil(len(group) / count)
+        for index in range(0, len(group), size):
+            part = group[index:index + size]
+            parts.append((sum(item[0] for item in part), [item[1] for item in part]))
+
+    # 负载最大的组优先, 每个组分配到当前负载最小的分片
+    result: List[List[dict]] = [[] for _ in range(shards)]
+    heap = [(0, index) for index in range(shards)]
+    for load, part in sorted(parts, key=lambda x: -x[0]):
+        current, index = heapq.heappop(heap)
+        result[index].extend(part)
+        heapq.heappush(heap, (current + load, index))
+
+    return [item for item in result if item]
@@ -0,0 +1,106 @@
+# _author: Coke
+# _date: 2023/9/12 19:44
+
+from typing import Callable, Dict, Iterable, List, Set, Tuple
+
+import threading
+import hashlib
+import logging
+import time
+
+from subway import config, scheduler
+
+WARNING = 86400  # Token 剩余有效期小于此值时发送预警, 单位秒
+EXPIRING = 'warning'
+EXPIRED = 'overdue'
+
+
+class TokenRegistry:
+    """
+    Token 过期通知的注册表, 每个 Token 在配置版本中只解码一次
+    "即将过期" 及 "已过期" 两个时刻直接注册到调度器的最小堆中, 在条件成立的时刻触发, 而不是每天定时检查
+    """
+
+    def __init__(self, _scheduler: scheduler.Scheduler, notify: Callable[[str, str], None], **kwargs):
+        """
+        :param _scheduler: <scheduler.Scheduler> 类
+        :param notify: 发送通知的函数, 接收 (通知内容, 幂等键), 在独立线程中调用
+        :param kwargs:
+                warning -> int: 剩余有效期小于此值时发送预警
+                logger -> Type: <logger.LoggingOutput> 类
+        """
+        self.scheduler = _scheduler
+        self.notify = notify
+        self.warning = kwargs.pop('warning', WARNING)
+        self.logger = kwargs.pop('logger', None) or logging
+        self.sent: Dict[str, Set[str]] = dict()  # 每个用户已经发送过的通知, 重启后由发件箱的幂等键去重
+        self._entries: Dict[str, Tuple[str, List[list]]] = dict()  # 用户名称: (Token, 调度器任务句柄)
+        self._lock = threading.Lock()
+
+    def update(self, users: Iterable[config.User]) -> None:
+        """
+        按新的配置版本更新注册表, Token 未变化的用户保留已注册的时刻及发送状态
+        :param users: 配置中的用户, 屏蔽的用户不会发送通知
+        :return:
+        """
+
+        users = {user.name: user for user in users if not user.shakedown}
+        with self._lock:
+            for name in list(self._entries):
+                user = users.get(name)
+                if user is None or user.token != self._entries[name][0]:
+                    self._cancel(name)
+
+            for name, user in users.items():
+                if name not in self._entries:
+                    self._register(user)
+
+    def clear(self) -> None:
+        """ 取消所有已注册的时刻 """
+        with self._lock:
+            for name in list(self._entries):
+                self._cancel(name)
+
+    def _cancel(self, name: str) -> None:
+        for entry in self._entries.pop(name)[1]:
+            self.scheduler.cancel(entry)
+        self.sent.pop(name, None)
+
+    def _register(self, user: config.User) -> None:
+        now = time.time()
+        entries = []
+        # 已经过期时只发送过期通知, 与预警互斥
+        if user.expire > now:
+            entries.append(self.scheduler.register(
+                max(user.expire - self.warning, now),
+                lambda error, _user=user: self._fire(_user, EXPIRING),
+                'Token 预警'
+            ))
+        entries.append(self.scheduler.register(
+            max(user.expire, now),
+            lambda error, _user=user: self._fire(_user, EXPIRED),
+            'Token 过期'
+        ))
+        self._entries[user.name] = (user.token, entries)
+        self.logger.debug(f'{user.name} 用户 Token 将在 {time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(user.expire))} 过期')
+
+    def _fire(self, user: config.User, kind: str) -> None:
+        """ 在调度线程中调用, 只生成消息, 发送在独立线程中进行 """
+
+        with self._lock:
+            sent = self.sent.setdefault(user.name, set())
+            if kind in sent or (kind == EXPIRING and EXPIRED in sent):
+                return
+            sent.add(kind)
+
+        if kind == EXPIRED:
+            text = f'{user.name} 用户 Token 已过期'
+        else:
+            text = f'{user.name} 用户 Token 将在 {round((user.expire - time.time()) / 3600, 1)} 小时后过期'
+
+        threading.Thread(target=self.notify, args=(text, key(user, kind)), daemon=True).start()
+
+
+def key(user: config.User, kind: str) -> str:
+    """ 通知的幂等键, 同一个 Token 的同一种通知只发送一次, 更换 Token 后重新计算 """
+    return f'token-{kind}:{user.name}:{hashlib.sha1(user.token.encode("utf-8")).hexdigest()[:16]}'
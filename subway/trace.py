@@ -0,0 +1,207 @@
+# _author: Coke
+# _date: 2023/9/21 20:14
+
+from typing import Iterable, List, Optional
+
+import threading
+import asyncio
+import json
+import time
+import os
+
+FORMAT = '%Y%m%d-%H%M%S'  # 每个抢票时段的事件文件名
+
+# 事件阶段
+PRECHECK = 'precheck'  # 抢票前检查是否已存在预约
+WAKE = 'wake'  # 定时器唤醒, latency 为实际唤醒时间与计划时间的误差
+BALANCE = 'balance'
+SHAKEDOWN = 'shakedown'
+APPOINTMENT = 'appointment'
+VERIFY = 'verify'  # 抢票结束后的最终断言
+RESULT = 'result'  # 单个用户的抢票结果
+
+# 接口路径对应的阶段
+PHASES = {
+    '/Appointment/CreateAppointment': SHAKEDOWN,
+    '/Appointment/GetBalance': BALANCE,
+    '/AppointmentRecord/GetAppointmentList': APPOINTMENT
+}
+
+
+def _lane() -> int:
+    """ 当前的执行单元, 协程中为当前任务, 否则为当前线程, 用于在时间线上区分并发的请求 """
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        task = None
+    return id(task) if task is not None else threading.get_ident()
+
+
+class Span:
+    """ 一个计时的阶段, 参考 Tracer.span """
+
+    __slots__ = ('tracer', 'phase', 'fields', 'status', 'outcome', '_start', '_wall')
+
+    def __init__(self, tracer: 'Tracer', phase: str, **fields):
+        self.tracer = tracer
+        self.phase = phase
+        self.fields = fields
+        self.status = None
+        self.outcome = None
+
+    def __enter__(self):
+        self._wall = time.time()
+        self._start = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None and self.outcome is None:
+            self.outcome = exc_type.__name__
+        self.tracer.event(
+            self.phase,
+            self._start,
+            time.monotonic() - self._start,
+            wall=self._wall,
+            status=self.status,
+            outcome=self.outcome,
+            **self.fields
+        )
+
+
+class Tracer:
+    """
+    单个用户在一个抢票时段内的结构化事件记录
+    每个事件包含单调时钟的开始时间、距离抢票时刻的偏移、耗时、状态码及结果, 事件随抢票结果返回主进程写入文件
+    """
+
+    def __init__(self, user: str, release: float):
+        """
+        :param user: 用户名称
+        :param release: 抢票时刻的时间戳
+        """
+        self.user = user
+        self.release = release
+        self.pid = os.getpid()
+        self.events: List[dict] = []  # list.append 是线程安全的, 并发的请求可以直接记录
+
+    def span(self, phase: str, **fields) -> Span:
+        """
+        记录一个阶段, 用法:
+            with tracer.span(trace.PRECHECK) as span:
+                span.outcome = 'exist'
+        :param phase: 阶段名称
+        :param fields: 其他需要记录的字段
+        :return:
+        """
+        return Span(self, phase, **fields)
+
+    def event(self, phase: str, start: float, latency: float, wall: float = None, status: Optional[int] = None,
+              outcome: Optional[str] = None, **fields) -> None:
+        """
+        记录一个事件
+        :param phase: 阶段名称
+        :param start: 单调时钟的开始时间
+        :param latency: 耗时, 单位秒
+        :param wall: 开始时的系统时间, 用于计算距离抢票时刻的偏移, 默认为当前时间减去耗时
+        :param status: 接口状态码
+        :param outcome: 结果
+        :param fields: 其他需要记录的字段
+        :return:
+        """
+
+        wall = wall if wall is not None else time.time() - latency
+        item = dict(
+            user=self.user,
+            phase=phase,
+            mono=round(start, 6),
+            offset=round((wall - self.release) * 1000, 3),
+            latency=round(latency * 1000, 3),
+            pid=self.pid,
+            lane=_lane()
+        )
+        if status is not None:
+            item['status'] = status
+        if outcome is not None:
+            item['outcome'] = outcome
+        item.update(fields)
+        self.events.append(item)
+
+    def request(self, uri: str, start: float, latency: float, wall: float, status: Optional[int],
+                outcome: str) -> None:
+        """ 记录一次接口请求, 阶段按接口路径区分, 参考 PHASES """
+        self.event(PHASES.get(uri, 'request'), start, latency, wall=wall, status=status, outcome=outcome, uri=uri)
+
+    def wake(self, planned: float) -> None:
+        """ 记录定时器唤醒, 在计划时间到达后立即调用 """
+        now = time.time()
+        self.event(WAKE, time.monotonic(), now - planned, wall=planned, outcome='late' if now > planned else 'early')
+
+
+def path(directory: str, release: float) -> str:
+    """ 抢票时段对应的事件文件路径 """
+    return os.path.join(directory, f'{time.strftime(FORMAT, time.localtime(release))}.jsonl')
+
+
+def write(filename: str, events: Iterable[dict]) -> int:
+    """
+    将事件以紧凑的 JSONL 格式追加到文件
+    :param filename: 文件路径
+    :param events: 事件列表
+    :return: 返回写入的事件数量
+    """
+
+    os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+    count = 0
+    with open(filename, 'a', encoding='utf-8') as file:
+        for item in events:
+            file.write(json.dumps(item, ensure_ascii=False, separators=(',', ':')))
+            file.write('\n')
+            count += 1
+    return count
+
+
+def read(filename: str) -> List[dict]:
+    """ 读取事件文件 """
+    with open(filename, 'r', encoding='utf-8') as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def chrome(events: Iterable[dict]) -> dict:
+    """
+    转换为 Chrome / Perfetto 的 trace event 格式, 可以在 chrome://tracing 或 ui.perfetto.dev 中打开
+    每个用户为一个进程, 每个线程或协程为一条时间线, 时间轴以抢票时刻为 0
+    :param events: 事件列表
+    :return:
+    """
+
+    users, lanes, trace_events = dict(), dict(), []
+    for item in events:
+        pid = users.setdefault(item['user'], len(users) + 1)
+        tid = lanes.setdefault((pid, item.get('pid'), item.get('lane')), len(lanes) + 1)
+        args = {key: value for key, value in item.items() if key not in ('user', 'phase', 'offset', 'latency', 'lane')}
+        name = item['phase'] if item.get('outcome') is None else f'{item["phase"]}: {item["outcome"]}'
+        if item['phase'] in (WAKE, RESULT):
+            trace_events.append(dict(name=name, ph='i', s='t', ts=item['offset'] * 1000, pid=pid, tid=tid, args=args))
+        else:
+            trace_events.append(dict(
+                name=name, cat=item['phase'], ph='X', ts=item['offset'] * 1000, dur=item['latency'] * 1000,
+                pid=pid, tid=tid, args=args
+            ))
+
+    for user, pid in users.items():
+        trace_events.append(dict(name='process_name', ph='M', pid=pid, args=dict(name=user)))
+    trace_events.append(dict(name='release', ph='i', s='g', ts=0, pid=0, tid=0))
+    return dict(traceEvents=trace_events, displayTimeUnit='ms')
+
+
+def export(filename: str, output: str = '') -> str:
+    """
+    将抢票时段的事件文件转换为 Chrome / Perfetto trace 格式
+    :param filename: 事件文件路径
+    :param output: 输出文件路径, 默认与事件文件同名的 .trace.json 文件
+    :return: 返回输出文件路径
+    """
+    output = output or f'{os.path.splitext(filename)[0]}.trace.json'
+    with open(output, 'w', encoding='utf-8') as file:
+        json.dump(chrome(read(filename)), file, ensure_ascii=False)
+    return output
@@ -1,19 +1,22 @@
 # _author: Coke
 # _date: 2023/3/16 11:16
 
-from requests.exceptions import ConnectionError, ReadTimeout
-from urllib3.exceptions import ReadTimeoutError
+from types import ModuleType
+from subway import scheduler
 
+import importlib.util
+import functools
 import datetime
-import requests
 import warnings
 import base64
 import time
+import sys
 
 
+@functools.lru_cache(maxsize=1024)
 def decode(token) -> int:
     """
-    将 base64 加密的 token解密并返回 token 过期时间
+    将 base64 加密的 token解密并返回 token 过期时间, 同一个 token 只会解密一次
     :param token: 需要解析的 base64 token
     :return: 解密后的时间戳
     """
@@ -36,6 +39,10 @@ def holiday(date) -> bool:
     warnings.warn(
         "此节假日服务器已经废弃", DeprecationWarning
     )
+    from requests.exceptions import ConnectionError, ReadTimeout
+    from urllib3.exceptions import ReadTimeoutError
+    import requests
+
     try:
         response = requests.request('GET', 'https://tool.bitefu.net/jiari', params=dict(d=date))
         if response.status_code != 200:
@@ -49,12 +56,72 @@ def holiday(date) -> bool:
 def timer(start) -> None:
     """
     定时器, 阻塞程序直到到达指定时间
+    :deprecated: 请使用 scheduler.wait 或 scheduler.Scheduler
+    :param start: 程序需要开始的时间
+    :return:
+    """
+    scheduler.wait(start)
+
+
+async def async_timer(start) -> None:
+    """
+    协程定时器, 挂起当前协程直到到达指定时间, 不会阻塞事件循环
+    :deprecated: 请使用 scheduler.async_wait
     :param start: 程序需要开始的时间
     :return:
     """
+    await scheduler.async_wait(start)
+
+
+def clock(value) -> datetime.timedelta:
+    """
+    将抢票时间解析为距离零点的时长, 支持整点及精确到毫秒的时间
+    :param value: 12, '12', '12:00', '12:00:00' 或 '12:00:00.150'
+    :return: 返回距离零点的时长
+    """
+
+    if isinstance(value, (int, float)):
+        return datetime.timedelta(hours=value)
+
+    value = str(value).strip()
+    if ':' not in value:
+        return datetime.timedelta(hours=float(value))
+
+    parts = value.split(':')
+    assert len(parts) <= 3, f'抢票时间 {value} 格式不正确, 格式为 HH:MM:SS.fff'
+    hours, minutes, seconds = (list(map(float, parts)) + [0, 0])[:3]
+    return datetime.timedelta(hours=hours, minutes=minutes, seconds=seconds)
+
+
+def subscribe(value: str) -> list:
+    """
+    解析命令行中以英文 , 分割的抢票时间
+    :param value: 如 "12,20" 或 "12:00:00.150,20"
+    :return: 返回 utils.clock 支持的抢票时间列表, 如 [12, 20] 或 ['12:00:00.150', 20]
+    """
+    return list(map(lambda x: x.strip() if ':' in x else int(x), value.split(',')))
+
+
+def lazy_import(name: str) -> ModuleType:
+    """
+    延迟导入模块, 返回的模块在第一次访问属性时才会真正执行导入, 用于只在部分代码路径中使用的重量级依赖
+    :param name: 模块名称, 如 aiohttp
+    :return: 返回模块对象, 已经导入的模块直接返回
+    """
+
+    if name in sys.modules:
+        return sys.modules[name]
+
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ImportError(f'未安装 {name}, 请参考 README 安装依赖', name=name)
 
-    while start >= time.time():
-        time.sleep(0.1)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
 
 
 def time_interval(start_time: str = '06:30', end_time: str = '09:30') -> dict:
@@ -0,0 +1,188 @@
+# _author: Coke
+# _date: 2023/9/9 16:27
+
+from typing import Callable, Optional
+
+import ctypes.util
+import threading
+import logging
+import select
+import struct
+import ctypes
+import sys
+import os
+
+DEBOUNCE = 0.3  # 最后一次变更后等待的时间, 编辑器保存时通常会产生多个事件
+INTERVAL = 5.0  # 不支持 inotify 时检查文件状态的间隔
+
+# inotify 事件, 参考 <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+
+# 监听文件所在目录而不是文件本身, 编辑器通过 写入临时文件 + 重命名 的方式原子保存时文件的 inode 会变化
+MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+_EVENT = struct.Struct('iIII')  # wd, mask, cookie, len
+
+
+def _libc():
+    """ 加载支持 inotify 的 libc, 不支持时返回 None """
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        return libc if hasattr(libc, 'inotify_init1') else None
+    except OSError:
+        return None
+
+
+class Watcher:
+    """
+    配置文件监听器, Linux 下使用 inotify 由内核通知文件变更, 没有变更时线程阻塞在 select 上不产生任何 I/O
+    不支持 inotify 时退化为按间隔检查文件的修改时间、大小及 inode
+    """
+
+    def __init__(self, filename: str, callback: Callable[[], None], **kwargs):
+        """
+        :param filename: 需要监听的文件
+        :param callback: 文件变更并且在 debounce 时间内没有新的变更后调用
+        :param kwargs:
+                debounce -> float: 防抖时间
+                interval -> float: 退化为检查文件状态时的间隔
+                logger -> Type: <logger.LoggingOutput> 类
+        """
+        self.filename = os.path.abspath(filename)
+        self.directory, self.name = os.path.split(self.filename)
+        self.callback = callback
+        self.debounce = kwargs.pop('debounce', DEBOUNCE)
+        self.interval = kwargs.pop('interval', INTERVAL)
+        self.logger = kwargs.pop('logger', None) or logging
+        self._stopped = threading.Event()
+        self._wake_read, self._wake_write = os.pipe()
+
+    def stop(self) -> None:
+        """ 停止监听, 唤醒阻塞中的线程 """
+        self._stopped.set()
+        os.write(self._wake_write, b'\0')
+
+    def run(self) -> None:
+        """ 阻塞并监听文件变更, 直到调用 stop """
+        libc = _libc()
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC) if libc is not None else -1
+        if fd < 0 or libc.inotify_add_watch(fd, self.directory.encode(), MASK) < 0:
+            if fd >= 0:
+                os.close(fd)
+            self.logger.debug(f'不支持 inotify, 每 {self.interval} 秒检查一次 {self.filename} 的状态')
+            self._poll()
+            return
+
+        self.logger.debug(f'通过 inotify 监听 {self.filename}')
+        try:
+            self._watch(fd)
+        finally:
+            os.close(fd)
+
+        # 监听的目录被删除或移动时退化为检查文件状态
+        if not self._stopped.is_set():
+            self.logger.warning(f'{self.directory} 目录已不存在, 改为每 {self.interval} 秒检查一次文件状态')
+            self._poll()
+
+    def _read(self, fd: int) -> Optional[bool]:
+        """
+        读取所有待处理的事件
+        :return: 如果存在与文件相关的事件返回 True, 监听失效时返回 None
+        """
+
+        relevant = False
+        while True:
+            try:
+                data = os.read(fd, 65536)
+            except BlockingIOError:
+                return relevant
+
+            offset = 0
+            while offset < len(data):
+                _, mask, _, length = _EVENT.unpack_from(data, offset)
+                name = data[offset + _EVENT.size:offset + _EVENT.size + length].rstrip(b'\0').decode(errors='ignore')
+                offset += _EVENT.size + length
+
+                if mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+                    return None
+
+                # 事件队列溢出时无法确定是否包含此文件, 视为发生了变更
+                if mask & IN_Q_OVERFLOW or name == self.name:
+                    relevant = True
+
+    def _wait(self, fd: int, timeout: Optional[float]) -> Optional[bool]:
+        """
+        阻塞直到有事件、超时或被唤醒
+        :return: 有事件返回 True, 超时返回 False, 被唤醒返回 None
+        """
+        readable, _, _ = select.select([fd, self._wake_read], [], [], timeout)
+        if self._wake_read in readable:
+            return None
+        return bool(readable)
+
+    def _watch(self, fd: int) -> None:
+        while not self._stopped.is_set():
+            if not self._wait(fd, None):
+                return
+
+            relevant = self._read(fd)
+            if relevant is None:
+                return
+            if not relevant:
+                continue
+
+            # 防抖: 直到 debounce 时间内没有新的事件才认为写入完成
+            while True:
+                ready = self._wait(fd, self.debounce)
+                if ready is None:
+                    return
+                if not ready:
+                    break
+                if self._read(fd) is None:
+                    self._notify()
+                    return
+
+            self._notify()
+
+    def _stat(self) -> Optional[tuple]:
+        try:
+            stat = os.stat(self.filename)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _poll(self) -> None:
+        last = self._stat()
+        while not self._stopped.wait(self.interval):
+            current = self._stat()
+            if current == last:
+                continue
+
+            # 防抖: 等待文件状态稳定
+            while not self._stopped.wait(self.debounce):
+                stable = self._stat()
+                if stable == current:
+                    break
+                current = stable
+
+            if self._stopped.is_set():
+                return
+
+            last = current
+            self._notify()
+
+    def _notify(self) -> None:
+        try:
+            self.callback()
+        except (Exception, ) as error:
+            self.logger.error(f'处理 {self.filename} 变更失败: {error!r}')
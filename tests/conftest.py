@@ -0,0 +1,62 @@
+# _author: Coke
+# _date: 2023/10/8 20:15
+
+import json
+
+import pytest
+
+from subway import server
+# 未安装本项目时 pytest11 入口不会生效, 直接从插件导入 stand_in fixture
+from subway.plugin import stand_in  # noqa: F401
+
+STATION = '沙河站'
+LINE = '昌平线'
+SLOT = '0720-0730'
+
+
+@pytest.fixture
+def subway(stand_in, tmp_path):
+    """
+    按用户配置创建指向替身服务的 Subway, 用法:
+        sw = subway([dict(name='a')], engine='async')
+    用户未填写的字段使用 沙河站 0720-0730, Token 由替身服务生成, 测试结束后关闭进程池及通知分发器
+    """
+
+    from subway.main import Subway
+
+    created = []
+
+    def factory(users: list, **kwargs) -> Subway:
+        for user in users:
+            user.setdefault('lineName', LINE)
+            user.setdefault('stationName', STATION)
+            user.setdefault('timeSlot', SLOT)
+            user.setdefault('token', stand_in.token(user['name']))
+            user.setdefault('burstPlan', dict(offsets=[0], rounds=1, interval=100))
+        filename = tmp_path / 'conf.json'
+        filename.write_text(json.dumps(dict(userAgent=users), ensure_ascii=False), encoding='utf-8')
+
+        options = dict(
+            confPath=str(filename),
+            engine='async',
+            domain=stand_in.url,
+            calibrate=False,
+            logPath=str(tmp_path / 'log.log'),
+            outboxPath=':memory:',
+            tracePath=str(tmp_path / 'trace'),
+            processes=2,
+            shards=2
+        )
+        options.update(kwargs)
+        instance = Subway(**options)
+        created.append(instance)
+        return instance
+
+    yield factory
+    for item in created:
+        item.close()
+
+
+def fault(**conf) -> server.Fault:
+    """ 生成替身服务的故障注入配置, 参考 server.Fault """
+    return server.Fault(conf)
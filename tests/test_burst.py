@@ -0,0 +1,122 @@
+# _author: Coke
+# _date: 2023/10/22 19:40
+
+import asyncio
+import time
+
+import pytest
+
+from subway import burst
+
+from conftest import SLOT, STATION
+from test_engine import grab
+
+
+def test_waves():
+    plan = burst.BurstPlan.parse(dict(offsets=[40, -30, 0], rounds=4, width=2, interval=1000, growth=2, maxInterval=3000))
+    waves = plan.waves(100.0)
+
+    assert waves[0] == burst.Wave((99.97, 100.0, 100.04), False)
+    # 重试波次的间隔按 growth 增长, 不超过 maxInterval
+    assert [wave.instants for wave in waves[1:]] == [(101.0, 101.0), (103.0, 103.0), (106.0, 106.0), (109.0, 109.0)]
+    assert all(wave.check for wave in waves[1:])
+    assert plan.concurrency == 3
+
+
+def test_legacy_options():
+    # 未配置 burstPlan 时与旧版本的 frequency、interval 及 burst 参数一致
+    plan = burst.BurstPlan.parse(None, frequency=3, interval=0.5, burst=2)
+    assert plan == burst.BurstPlan(offsets=[0, 0], rounds=2, width=2, interval=500)
+    assert burst.BurstPlan.parse(None, frequency=0).rounds == 0
+    # 配置的字段优先于旧参数
+    assert burst.BurstPlan.parse(dict(rounds=1), frequency=5).rounds == 1
+
+
+@pytest.mark.parametrize('conf', [dict(offsets=[]), dict(rounds=-1), dict(width=0), dict(growth=0.5), []])
+def test_invalid(conf):
+    with pytest.raises(AssertionError):
+        burst.BurstPlan.parse(conf or ['x'])
+
+
+@pytest.mark.parametrize('engine', ('async', 'process'))
+def test_plan_requests(stand_in, subway, engine):
+    stand_in.inventory[(STATION, SLOT)] = 0
+    plan = dict(offsets=[-20, 0, 30], rounds=2, width=2, interval=100)
+    result = grab(subway([dict(name='a', burstPlan=plan)], engine=engine))
+
+    # 首个波次不查询余票直接发出, 重试波次查询到没有余票时不发出抢票请求
+    assert result['a']['result'] is False
+    assert stand_in.stats['CreateAppointment'] == 3
+    assert stand_in.stats['GetBalance'] >= 1
+
+
+def test_group_first_success():
+    group = burst.BurstGroup()
+    calls = []
+
+    def shot(index: int, result: bool):
+        def func():
+            calls.append(index)
+            return result
+        return func
+
+    now = time.time()
+    for index, delay in enumerate((0.1, 0.4, 0.6)):
+        group.submit(now + delay, shot(index, index == 0))
+
+    # 第一个请求成功后立即返回, 尚未发出的请求不再发出
+    assert group.join() is True
+    assert time.time() - now < 0.35
+    time.sleep(0.6)
+    assert calls == [0]
+    assert group.success_at is not None
+
+
+def test_group_all_failed():
+    group = burst.BurstGroup()
+    now = time.time()
+    for delay in (0.05, 0.1):
+        group.submit(now + delay, lambda: False)
+    assert group.join() is False
+
+
+def test_async_group_cancels_in_flight():
+    cancelled = []
+
+    async def slow():
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.append(1)
+            raise
+        return False
+
+    async def fast():
+        await asyncio.sleep(0.05)
+        return True
+
+    async def main():
+        group = burst.AsyncBurstGroup()
+        now = time.time()
+        # 已经发出的请求也会被取消
+        group.submit(now + 0.05, slow)
+        group.submit(now + 0.1, fast)
+        group.submit(now + 1, slow)
+        result = await group.join()
+        await asyncio.sleep(0)
+        return result, time.time() - now
+
+    result, elapsed = asyncio.run(main())
+    assert result is True and elapsed < 1
+    assert cancelled == [1]
+
+
+@pytest.mark.parametrize('engine', ('async', 'process'))
+def test_success_skips_remaining(stand_in, subway, engine):
+    stand_in.inventory[(STATION, SLOT)] = 5
+    plan = dict(offsets=[0, 300, 600], rounds=0)
+    result = grab(subway([dict(name='a', burstPlan=plan)], engine=engine))
+
+    assert result['a']['result'] is True
+    assert stand_in.stats['CreateAppointment'] == 1
+    assert stand_in.inventory[(STATION, SLOT)] == 4
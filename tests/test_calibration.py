@@ -0,0 +1,72 @@
+# _author: Coke
+# _date: 2023/10/22 14:30
+
+import math
+
+from subway import calibration
+
+BASE = 1700000000.0
+
+
+class Recorder:
+
+    def __init__(self):
+        self.messages = []
+
+    def warning(self, message):
+        self.messages.append(message)
+
+
+def samples(offset: float, count: int, rtt: float = 0.02, interval: float = calibration.INTERVAL) -> list:
+    """
+    生成合成的采样结果, 服务器在请求发出 rtt / 2 后以整秒精度的 Date 头返回服务器时间
+    :param offset: 服务器时间 = 本地时间 + offset
+    :param count: 采样次数
+    :param rtt: 往返耗时
+    :param interval: 采样间隔
+    :return:
+    """
+    result = []
+    for index in range(count):
+        start = BASE + index * (interval + rtt)
+        result.append((start, start + rtt, float(math.floor(start + rtt / 2 + offset))))
+    return result
+
+
+def test_intersection():
+    result = calibration.estimate(samples(0.3, calibration.SAMPLES), Recorder())
+    assert result.samples == calibration.SAMPLES
+    # 真实偏差始终落在所有采样区间的交集内, 修正值也不会超出交集
+    assert abs(result.offset - 0.3) <= 2 * result.uncertainty < 0.2
+    assert abs(result.latency - 0.01) < 1e-6
+
+
+def test_precise_offset_applied():
+    recorder = Recorder()
+    result = calibration.estimate(samples(0.3, 60, rtt=0.004, interval=0.013), recorder)
+    assert result.uncertainty <= calibration.PRECISION
+    assert abs(result.offset - 0.3) <= result.uncertainty
+    assert not recorder.messages
+
+
+def test_uncertain_offset_skipped():
+    recorder = Recorder()
+    # 单次采样的区间宽度约 1 秒且包含 0, 不修正偏差
+    result = calibration.estimate(samples(0.3, 1), recorder)
+    assert result.uncertainty > calibration.PRECISION
+    assert result.offset == 0
+    assert recorder.messages and '不修正' in recorder.messages[0]
+
+
+def test_uncertain_offset_clamped():
+    recorder = Recorder()
+    result = calibration.estimate(samples(2.3, 1), recorder)
+    # 只修正到区间内最接近 0 的一端, 真实偏差不会小于修正值
+    assert 1.3 < result.offset <= 2.3
+    assert recorder.messages and '只修正' in recorder.messages[0]
+
+
+def test_no_samples():
+    recorder = Recorder()
+    assert calibration.estimate([], recorder) == calibration.UNCALIBRATED
+    assert recorder.messages
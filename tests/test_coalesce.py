@@ -0,0 +1,79 @@
+# _author: Coke
+# _date: 2023/10/22 20:15
+
+import concurrent.futures
+import threading
+import asyncio
+import time
+
+from subway import coalesce
+
+from conftest import SLOT, STATION
+from test_engine import grab
+
+
+def test_single_flight():
+    cache = coalesce.BalanceCache(ttl=1)
+    calls = []
+    barrier = threading.Barrier(8)
+
+    def loader():
+        calls.append(1)
+        time.sleep(0.1)
+        return [len(calls)]
+
+    def worker():
+        barrier.wait()
+        return cache.get(('a', ), loader)
+
+    with concurrent.futures.ThreadPoolExecutor(8) as executor:
+        result = list(executor.map(lambda _: worker(), range(8)))
+
+    assert len(calls) == 1
+    assert result == [[1]] * 8
+    # 不同的 Key 互不影响
+    assert cache.get(('b', ), loader) == [2]
+
+
+def test_ttl():
+    cache = coalesce.BalanceCache(ttl=0.05)
+    calls = []
+    loader = lambda: calls.append(1) or len(calls)  # noqa: E731
+
+    assert cache.get('a', loader) == cache.get('a', loader) == 1
+    time.sleep(0.1)
+    assert cache.get('a', loader) == 2
+
+
+def test_async_single_flight():
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        await asyncio.sleep(0.1)
+        return len(calls)
+
+    async def main():
+        cache = coalesce.AsyncBalanceCache(ttl=1)
+        tasks = [asyncio.ensure_future(cache.get('a', loader)) for _ in range(8)]
+        # 第一个等待者被取消不会影响其他等待者复用同一个查询
+        await asyncio.sleep(0.01)
+        tasks[0].cancel()
+        return await asyncio.gather(*tasks[1:])
+
+    assert asyncio.run(main()) == [1] * 7
+    assert len(calls) == 1
+
+
+def test_key():
+    body = dict(stationName=STATION, enterDates=['20231023', '20231024'], timeSlot='0630-0930')
+    assert coalesce.balance_key(body) == (STATION, ('20231023', '20231024'), '0630-0930')
+
+
+def test_users_share_balance(stand_in, subway):
+    stand_in.inventory[(STATION, SLOT)] = 0
+    plan = dict(offsets=[0], rounds=1, interval=100)
+    grab(subway([dict(name=name, burstPlan=plan) for name in 'abcdef']))
+
+    # 同一站点及时段的 6 个用户在重试波次同时查询余票, 只会发出一次余票查询
+    assert stand_in.stats['GetBalance'] == 1, stand_in.stats
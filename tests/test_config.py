@@ -0,0 +1,33 @@
+# _author: Coke
+# _date: 2023/10/22 10:05
+
+import json
+
+import pytest
+
+from subway import config, server
+
+from conftest import LINE, SLOT, STATION
+
+
+def content(**plan) -> str:
+    """ 生成只有一个用户的配置文件内容, plan 为用户的 burstPlan """
+    return json.dumps(dict(userAgent=[dict(
+        name='a', lineName=LINE, stationName=STATION, timeSlot=SLOT,
+        token=server.make_token('a', 4102444800), burstPlan=plan
+    )]))
+
+
+@pytest.mark.parametrize('plan', [dict(offsets=5), dict(interval='1000'), dict(width='3'), dict(offsets='abc')])
+def test_invalid_plan(tmp_path, plan):
+    filename = tmp_path / 'conf.json'
+    filename.write_text(content(offsets=[0]), encoding='utf-8')
+    loader = config.Loader(str(filename))
+    valid, changed = loader.load()
+    assert changed and loader.error is None
+
+    # 类型错误的计划不能使重新加载崩溃, 继续使用上一个有效的配置
+    filename.write_text(content(**plan), encoding='utf-8')
+    assert loader.load() == (valid, False)
+    assert isinstance(loader.error, (ValueError, AssertionError))
+    assert 'burstPlan' in str(loader.error)
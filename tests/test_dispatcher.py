@@ -0,0 +1,87 @@
+# _author: Coke
+# _date: 2023/10/24 20:10
+
+import threading
+import time
+
+from subway import dispatcher, outbox
+
+
+class Sender:
+    """ 记录发送时间的发送函数, results 为每次发送的结果, 用完后始终成功 """
+
+    def __init__(self, delay: float = 0, results=()):
+        self.delay = delay
+        self.results = list(results)
+        self.sent = []
+        self.event = threading.Event()
+
+    def __call__(self, item: outbox.Record) -> bool:
+        time.sleep(self.delay)
+        result = self.results.pop(0) if self.results else True
+        if result:
+            self.sent.append((time.monotonic(), item.text))
+            self.event.set()
+        return result
+
+
+def test_token_bucket():
+    bucket = dispatcher.TokenBucket(10, 2)
+    start = time.monotonic()
+    # 桶容量内的突发不会等待, 之后按补充速率发送
+    assert [bucket.acquire() for _ in range(2)] == [0.0, 0.0]
+    assert bucket.acquire() > 0.05
+    bucket.acquire()
+    assert 0.15 < time.monotonic() - start < 0.5
+
+
+def test_channel_rate_limit():
+    sender = Sender()
+    channel = dispatcher.Channel('test', sender, outbox.Outbox(), bucket=dispatcher.TokenBucket(10, 2))
+    try:
+        for index in range(5):
+            channel.put(f'key-{index}', 'title', str(index), False)
+        assert channel.wait(5)
+    finally:
+        channel.close()
+        channel.join(5)
+
+    times = [item[0] for item in sender.sent]
+    assert [item[1] for item in sender.sent] == ['0', '1', '2', '3', '4']
+    assert times[1] - times[0] < 0.05
+    assert times[4] - times[1] > 0.25
+
+
+def test_send_does_not_block():
+    slow, fast = Sender(delay=0.5), Sender()
+    _dispatcher = dispatcher.Dispatcher()
+    _dispatcher.configure({dispatcher.DINGTALK: slow, dispatcher.LARK: fast})
+    try:
+        start = time.monotonic()
+        _dispatcher.send('a', key='a')
+        _dispatcher.send('a', key='a')
+        assert time.monotonic() - start < 0.1
+
+        # 一个渠道较慢时不会影响其他渠道
+        assert fast.event.wait(0.3) and not slow.sent
+        assert _dispatcher.join(5)
+    finally:
+        _dispatcher.close()
+
+    # 相同幂等键的通知在每个渠道中只发送一次
+    assert [item[1] for item in slow.sent] == ['a']
+    assert [item[1] for item in fast.sent] == ['a']
+
+
+def test_retry():
+    sender = Sender(results=[False, False])
+    box = outbox.Outbox(backoff=0.05)
+    channel = dispatcher.Channel('test', sender, box, bucket=dispatcher.TokenBucket(100, 10))
+    try:
+        channel.put('key', 'title', 'text', False)
+        # 失败后由发件箱按指数退避重新安排, 第三次发送成功
+        assert sender.event.wait(5)
+        assert box.pending() == 0
+    finally:
+        channel.close()
+        channel.join(5)
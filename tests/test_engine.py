@@ -0,0 +1,91 @@
+# _author: Coke
+# _date: 2023/10/8 20:32
+
+import time
+
+import pytest
+
+from conftest import LINE, SLOT, STATION, fault
+
+ENGINES = ('async', 'process', 'shard')
+
+
+def grab(instance, delay: float = 0.5) -> dict:
+    """ 执行一个抢票时段, 返回 用户名称: 结果 """
+    return {item['name']: item for item in instance.start_task(time.time() + delay)}
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_booking(stand_in, subway, engine):
+    stand_in.inventory[(STATION, SLOT)] = 5
+    result = grab(subway([dict(name='a'), dict(name='b')], engine=engine))
+
+    assert [result[name]['result'] for name in ('a', 'b')] == [True, True]
+    assert result['a']['booked'] == (STATION, SLOT)
+    assert stand_in.inventory[(STATION, SLOT)] == 3
+    assert [item['stationName'] for item in stand_in.records['a']] == [STATION]
+
+
+def test_sold_out(stand_in, subway):
+    stand_in.inventory[(STATION, SLOT)] = 0
+    result = grab(subway([dict(name='a')]))
+
+    assert result['a']['result'] is False
+    assert 'booked' not in result['a']
+
+
+def test_timeout(stand_in, subway):
+    stand_in.inventory[(STATION, SLOT)] = 5
+    # 抢票接口挂起超过客户端的 2 秒超时, 请求失败但不会中断抢票任务
+    stand_in.faults['CreateAppointment'] = fault(timeout=1, hang=2500)
+    result = grab(subway([dict(name='a', burstPlan=dict(offsets=[0], rounds=0))]))
+
+    assert result['a']['result'] is False
+    assert stand_in.stats['CreateAppointment:timeout'] == 1
+    assert any(item.get('outcome') == 'timeout' for item in result['a']['trace'])
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_reset(stand_in, subway, engine):
+    stand_in.inventory[(STATION, SLOT)] = 5
+    # 查询接口的连接全部被重置, 每个用户仍然返回结果, 抢票接口正常时依然可以抢到票
+    stand_in.faults['GetBalance'] = fault(reset=1)
+    stand_in.faults['GetAppointmentList'] = fault(reset=1)
+    result = grab(subway([dict(name='a'), dict(name='b')], engine=engine))
+
+    assert sorted(result) == ['a', 'b']
+    assert all(item['result'] for item in result.values())
+    assert stand_in.stats['GetAppointmentList:reset'] > 0
+    assert stand_in.inventory[(STATION, SLOT)] == 3
+
+
+def test_reset_everything(stand_in, subway):
+    stand_in.inventory[(STATION, SLOT)] = 5
+    for endpoint in ('GetBalance', 'GetAppointmentList', 'CreateAppointment'):
+        stand_in.faults[endpoint] = fault(reset=1)
+    result = grab(subway([dict(name='a')]))
+
+    assert result['a']['result'] is False
+    assert any(item.get('outcome') == 'network' for item in result['a']['trace'])
+
+
+@pytest.mark.parametrize('engine', ('async', 'process'))
+def test_preference_fallback(stand_in, subway, engine):
+    stand_in.inventory[(STATION, SLOT)] = 0
+    stand_in.inventory[(STATION, '0730-0740')] = 0
+    stand_in.inventory[(STATION, '0740-0750')] = 2
+    preferences = [dict(timeSlot='0730-0740'), dict(timeSlot='0740-0750'), dict(stationName='天通苑站', lineName='5号线', timeSlot=SLOT)]
+    result = grab(subway([dict(name='a', preferences=preferences)], engine=engine))
+
+    # 首轮抢首选时段失败后, 根据同一轮的余票查询结果改抢仍有余票的候选
+    assert result['a']['result'] is True
+    assert result['a']['booked'] == (STATION, '0740-0750')
+    assert stand_in.records['a'][0]['lineName'] == LINE
+    assert stand_in.stats['GetBalance'] == 2  # 每个站点只查询一次余票
+
+
+def test_data_path(subway, tmp_path):
+    # 发件箱及事件文件默认写入日志文件目录下的 data 目录, 不会写入被监听的配置文件目录
+    instance = subway([dict(name='a')], outboxPath=None, tracePath=None)
+    assert instance.outbox_path == str(tmp_path / 'data' / 'outbox.db')
+    assert instance.trace_path == str(tmp_path / 'data' / 'trace')
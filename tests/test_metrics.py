@@ -0,0 +1,67 @@
+# _author: Coke
+# _date: 2023/10/22 18:10
+
+import urllib.request
+
+import pytest
+
+from subway import metrics, trace
+
+
+def test_abstract():
+    with pytest.raises(TypeError):
+        metrics.Metric('x', 'x')
+
+
+def test_exposition():
+    registry = metrics.Registry()
+    counter = registry.counter('a_total', 'a', ('phase', ))
+    histogram = registry.histogram('b_seconds', 'b', (), (0.1, 1))
+    counter.inc(phase='x"y')
+    counter.inc(2, phase='x"y')
+    for value in (0.05, 0.5, 5):
+        histogram.observe(value)
+
+    lines = registry.render().splitlines()
+    assert lines[:3] == ['# HELP a_total a', '# TYPE a_total counter', 'a_total{phase="x\\"y"} 3']
+    assert 'b_seconds_bucket{le="0.1"} 1' in lines
+    assert 'b_seconds_bucket{le="1"} 2' in lines
+    assert 'b_seconds_bucket{le="+Inf"} 3' in lines
+    assert 'b_seconds_sum 5.55' in lines
+    assert 'b_seconds_count 3' in lines
+
+    with pytest.raises(AssertionError):
+        counter.inc(station='x')
+
+
+def test_record_and_scrape():
+    grab = metrics.GrabMetrics()
+    events = [
+        dict(phase=trace.SHAKEDOWN, uri='/Appointment/CreateAppointment', outcome='ok', status=200, latency=20),
+        dict(phase=trace.SHAKEDOWN, uri='/Appointment/CreateAppointment', outcome='timeout', latency=2000),
+        dict(phase=trace.WAKE, latency=0.3)
+    ]
+    grab.record(100.0, [
+        dict(name='a', result=True, booked=('沙河站', '0720-0730'), trace=events),
+        dict(name='b', result=False)
+    ], 101.5, keys=dict(b=('沙河站', '0730-0740')))
+    grab.pending.function(lambda: 4)
+
+    exporter = metrics.Exporter(grab.registry, 0)
+    exporter.start()
+    try:
+        with urllib.request.urlopen(exporter.url, timeout=5) as response:
+            assert response.headers['Content-Type'] == metrics.CONTENT_TYPE
+            lines = response.read().decode('utf-8').splitlines()
+    finally:
+        exporter.stop()
+
+    assert f'subway_requests_total{{phase="{trace.SHAKEDOWN}",outcome="ok"}} 1' in lines
+    assert f'subway_requests_total{{phase="{trace.SHAKEDOWN}",outcome="timeout"}} 1' in lines
+    assert f'subway_responses_total{{phase="{trace.SHAKEDOWN}",status="200"}} 1' in lines
+    assert f'subway_request_duration_seconds_count{{phase="{trace.SHAKEDOWN}"}} 2' in lines
+    assert 'subway_wake_lateness_seconds_bucket{le="0.0005"} 1' in lines
+    assert 'subway_grabs_total{station="沙河站",slot="0720-0730",result="success"} 1' in lines
+    assert 'subway_grabs_total{station="沙河站",slot="0730-0740",result="failure"} 1' in lines
+    assert 'subway_window_duration_seconds 1.5' in lines
+    assert 'subway_outbox_pending 4' in lines
@@ -0,0 +1,50 @@
+# _author: Coke
+# _date: 2023/10/9 22:10
+
+from subway import outbox
+
+
+def test_lease_single_owner(tmp_path):
+    filename = str(tmp_path / 'outbox.db')
+    first, second = outbox.Outbox(filename), outbox.Outbox(filename)
+    try:
+        assert first.put('lark', 'digest:1', '标题', '内容')
+        assert not second.put('lark', 'digest:1', '标题', '内容')
+
+        # 租约期间其他进程取不到同一条通知, 下次到期时间为租约到期时间
+        record = first.due('lark')
+        assert record is not None and record.key == 'digest:1'
+        assert second.due('lark') is None
+        assert second.next_due('lark') >= record_lease(first)
+
+        # 发送失败后释放租约, 到期后任意进程都可以重试
+        due = first.retry(record, '机器人返回失败')
+        assert second.due('lark', now=due) is not None
+    finally:
+        second.close()
+        first.close()
+
+
+def test_close_releases_lease(tmp_path):
+    filename = str(tmp_path / 'outbox.db')
+    first, second = outbox.Outbox(filename), outbox.Outbox(filename)
+    first.put('lark', 'digest:1', '标题', '内容')
+    assert first.due('lark') is not None
+    first.close()
+    assert second.due('lark') is not None
+    second.close()
+
+
+def test_put_does_not_compact(tmp_path):
+    box = outbox.Outbox(str(tmp_path / 'outbox.db'))
+    box._compacted = 0.0
+    box.put('lark', 'digest:1', '标题', '内容')
+    assert box._compacted == 0.0
+    box.maintain()
+    assert box._compacted > 0
+    box.close()
+
+
+def record_lease(box: outbox.Outbox) -> float:
+    with box._lock:
+        return box._connection.execute('SELECT MAX(lease) FROM outbox').fetchone()[0]
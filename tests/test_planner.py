@@ -0,0 +1,77 @@
+# _author: Coke
+# _date: 2023/10/10 21:03
+
+import datetime
+import json
+import time
+
+from subway import config, planner, server
+
+START = datetime.date.today() + datetime.timedelta(days=1)
+
+
+def parse(*users: dict) -> config.Config:
+    expire = time.time() + 30 * 86400
+    for user in users:
+        user.setdefault('lineName', '昌平线')
+        user.setdefault('stationName', '沙河站')
+        user.setdefault('timeSlot', '0720-0730')
+        user.setdefault('token', server.make_token(user['name'], expire))
+    return config.Config.parse(json.dumps(dict(userAgent=list(users)), ensure_ascii=False))
+
+
+def midnight(day: datetime.date) -> float:
+    return datetime.datetime.combine(day, datetime.time()).timestamp()
+
+
+def test_build_merges_overlapping_users():
+    _config = parse(dict(name='a'), dict(name='b', subscribeTime=['12:00:00.150']), dict(name='c'))
+    grabs = planner.build(_config.users, [12, 20], START, 1, holiday=lambda day: False)
+
+    # b 的抢票时间与其他用户只相差 150 ms, 合并为同一个抢票时刻并保留 b 自己的时间
+    assert [grab.users for grab in grabs] == [('a', 'c', 'b'), ('a', 'c')]
+    assert grabs[0].instant == midnight(START) + 12 * 3600
+    assert round(grabs[0].offset('b'), 3) == 0.15
+    assert grabs[0].offset('a') == 0
+
+
+def test_build_skips_holiday_and_dates():
+    travel = (START + datetime.timedelta(days=1)).strftime(planner.TIME_FORMAT)
+    _config = parse(dict(name='a', skipDates=[travel]), dict(name='b', holiday=True))
+    grabs = planner.build(_config.users, [12], START, 2, holiday=lambda day: day.strftime(planner.TIME_FORMAT) == travel)
+
+    # 第一天 a 跳过, 节假日只有 holiday 为 True 的 b 抢票; 第二天两人都抢票
+    assert [(grab.date, grab.users) for grab in grabs] == [
+        (travel, ('b', )), ((START + datetime.timedelta(days=2)).strftime(planner.TIME_FORMAT), ('a', 'b'))
+    ]
+
+
+class Recorder:
+
+    def __init__(self):
+        self.messages = []
+
+    def warning(self, message):
+        self.messages.append(message)
+
+    def debug(self, message):
+        pass
+
+
+def test_planner_next_and_missed():
+    _config = parse(dict(name='a'), dict(name='b', subscribeTime=['12:05']))
+    recorder = Recorder()
+    _planner = planner.Planner([12, 20], days=1, logger=recorder)
+    _planner.update(_config)
+    _planner.build = lambda now=None: planner.build(_config.users, [12, 20], START, 1, lambda day: False)
+
+    now = midnight(START)
+    first = _planner.next(now)
+    assert first.users == ('a', ) and first.instant == now + 12 * 3600
+    assert recorder.messages == []
+
+    # 第一个时刻执行完成时已经过了 b 的 12:05, 需要提示错过
+    _planner.done(first)
+    second = _planner.next(now + 12 * 3600 + 400)
+    assert second.users == ('a', ) and second.instant == now + 20 * 3600
+    assert len(recorder.messages) == 1 and 'b' in recorder.messages[0]
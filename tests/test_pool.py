@@ -0,0 +1,29 @@
+# _author: Coke
+# _date: 2023/10/21 21:40
+
+import time
+import os
+
+from subway import pool
+
+
+def crash(kwargs: dict) -> int:
+    """ 模拟工作进程在任务中被 OOM 终止 """
+    if kwargs.get('crash'):
+        os._exit(1)
+    return kwargs['value']
+
+
+def test_deadline_restarts_pool():
+    workers = pool.WorkerPool(2, preload=())
+    try:
+        output = workers.run(
+            crash, [dict(value=1), dict(crash=True), dict(value=3)],
+            failure=lambda item, error: repr(error), deadline=time.time() + 3
+        )
+        assert output[0] == 1 and output[2] == 3
+        assert output[1].startswith('TimeoutError')
+        # 重建后的进程池可以继续执行之后的任务
+        assert workers.run(crash, [dict(value=4)], deadline=time.time() + 5) == [4]
+    finally:
+        workers.close()
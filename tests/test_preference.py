@@ -0,0 +1,31 @@
+# _author: Coke
+# _date: 2023/10/8 21:06
+
+from subway import preference
+
+ENTER_DATE = '20231009'
+CHOICES = preference.ranked('昌平线', '沙河站', '0720-0730', preference.parse(
+    [dict(timeSlot='0730-0740'), dict(stationName='天通苑站', lineName='5号线', timeSlot='0720-0730')], '昌平线', '沙河站'
+))
+
+
+def test_choose_by_priority():
+    snapshot = {
+        '沙河站': [dict(timeSlot='0730-0740', enterDate='2023-10-09')],
+        '天通苑站': [dict(timeSlot='0720-0730', enterDate='20231009')]
+    }
+    assert preference.choose(snapshot, CHOICES, ENTER_DATE) == CHOICES[1]
+
+
+def test_choose_sold_out():
+    assert preference.choose({'沙河站': [], '天通苑站': None}, CHOICES, ENTER_DATE) is None
+
+
+def test_choose_no_match():
+    # 查询结果非空但没有匹配的候选 (如日期不是明天), 与没有配置 preferences 时一致抢首选
+    snapshot = {'沙河站': [dict(timeSlot='0720-0730', enterDate='20231010')], '天通苑站': []}
+    assert preference.choose(snapshot, CHOICES, ENTER_DATE) == CHOICES[0]
+
+    # 只有其他站点的查询结果非空时不会改抢
+    snapshot = {'沙河站': [], '天通苑站': [dict(timeSlot='0800-0810', enterDate='20231009')]}
+    assert preference.choose(snapshot, CHOICES, ENTER_DATE) is None
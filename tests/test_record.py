@@ -0,0 +1,49 @@
+# _author: Coke
+# _date: 2023/10/9 21:40
+
+import time
+
+from subway import record
+
+
+def item(_id: int, day: int) -> dict:
+    return dict(id=str(_id), stationName='沙河站', arrivalTime=f'10月{day}日 (07:20~07:30)')
+
+
+def exists(index: record.AppointmentIndex, day: int) -> bool:
+    date, slot = record.parse_arrival(f'10月{day}日 (07:20~07:30)')
+    return index.exists(date, '沙河站', slot)
+
+
+def test_rebuild_evicts_cancelled():
+    index = record.AppointmentIndex(ttl=0.05)
+    assert index.expired
+    index.rebuild([item(2, 10), item(1, 9)], index.generation)
+    assert index.valid and exists(index, 10)
+
+    # 过期后全量重建, 在其他设备上取消的预约不再存在
+    time.sleep(0.1)
+    assert index.expired and not index.valid
+    index.rebuild([item(1, 9)], index.generation)
+    assert not exists(index, 10)
+    assert exists(index, 9)
+
+
+def test_update_stops_only_when_newest_first():
+    index = record.AppointmentIndex()
+    index.rebuild([item(1, 9)], index.generation)
+
+    # 从新到旧排列且出现已索引的记录, 之后的分页都已经索引过
+    assert index.update([item(3, 11), item(2, 10), item(1, 9)]) is False
+    # 从旧到新排列时无法确认后续分页, 需要继续获取
+    assert index.update([item(1, 9), item(4, 12)]) is True
+    assert exists(index, 12)
+    assert index.update([]) is False
+
+
+def test_rebuild_after_invalidate_is_not_valid():
+    index = record.AppointmentIndex()
+    generation = index.generation
+    index.invalidate()
+    index.rebuild([item(1, 9)], generation)
+    assert not index.valid
@@ -0,0 +1,77 @@
+# _author: Coke
+# _date: 2023/10/25 20:20
+
+import asyncio
+
+import pytest
+
+from subway import metro, resolver, server
+
+from conftest import SLOT, STATION
+
+HOST = 'stand-in.local'  # 不会被系统解析的主机名, 只能通过固定的地址访问
+
+
+@pytest.fixture
+def stand_ins():
+    """ 在 127.0.0.2 及 127.0.0.3 的同一个端口上启动两个替身服务 """
+    first = server.StandIn(host='127.0.0.2', inventory={STATION: {SLOT: 5}})
+    first.start()
+    second = server.StandIn(host='127.0.0.3', port=first.port, inventory={STATION: {SLOT: 5}})
+    second.start()
+    yield first, second
+    for item in (first, second):
+        try:
+            item.stop()
+        except (Exception, ):
+            pass
+
+
+def pinned(port: int) -> resolver.Resolver:
+    dns = resolver.Resolver(HOST, port, tls=False, addresses=['127.0.0.2', '127.0.0.3'])
+    dns.resolve()
+    # 固定测速结果, 127.0.0.2 为最快的节点
+    dns.ranking = [(0.001, '127.0.0.2'), (0.002, '127.0.0.3')]
+    return dns
+
+
+def test_rank(stand_ins):
+    first, _ = stand_ins
+    dns = resolver.Resolver(HOST, first.port, tls=False, addresses=['127.0.0.2', '127.0.0.3', '127.0.0.4'])
+    assert dns.prepare() in ('127.0.0.2', '127.0.0.3')
+    # 没有服务监听的地址排在最后且不会被选中
+    assert dns.ranking[-1] == (float('inf'), '127.0.0.4')
+
+
+def test_pinned_adapter_failover(stand_ins):
+    first, second = stand_ins
+    dns = pinned(first.port)
+    client = metro.Metro(first.token('a'), dns=dns, domain=f'http://{HOST}:{first.port}')
+    try:
+        assert client.balance(stationName=STATION)
+        assert first.stats['GetBalance'] == 1 and second.stats['GetBalance'] == 0
+
+        # 最快的节点不可用后重新测速, 之后的请求固定到下一个节点
+        first.stop()
+        assert dns.prepare() == '127.0.0.3'
+        assert client.balance(stationName=STATION)
+        assert second.stats['GetBalance'] == 1
+    finally:
+        client.close()
+
+
+def test_pinned_resolver_failover(stand_ins):
+    first, second = stand_ins
+    dns = pinned(first.port)
+
+    async def balance():
+        async with metro.AsyncMetro(first.token('a'), dns=dns, domain=f'http://{HOST}:{first.port}') as client:
+            return await client.balance(stationName=STATION)
+
+    assert asyncio.run(balance())
+    assert first.stats['GetBalance'] == 1
+
+    # 测速结果未刷新时, 连接失败的地址会自动切换到测速结果中的下一个地址
+    first.stop()
+    assert asyncio.run(balance())
+    assert second.stats['GetBalance'] == 1
@@ -0,0 +1,41 @@
+# _author: Coke
+# _date: 2023/10/10 20:12
+
+import threading
+import time
+
+from subway import scheduler
+
+
+def test_approach_near_spin_boundary():
+    # 剩余时间在自旋边界附近时, 两次读取时钟之间越过边界不能导致休眠时长为负数
+    for index in range(2000):
+        deadline = time.time() + scheduler.SPIN * (1 + (index % 20) / 10)
+        scheduler._approach(deadline)
+        assert time.time() >= deadline - 0.001
+
+
+def test_wait_error():
+    error = scheduler.wait(time.time() + 0.1)
+    assert 0 <= error < 0.02
+
+
+def test_scheduler_order_and_cancel():
+    instance = scheduler.Scheduler()
+    fired, done = [], threading.Event()
+    now = time.time()
+    instance.register(now + 0.15, lambda _: (fired.append('b'), done.set()), 'b')
+    cancelled = instance.register(now + 0.1, lambda _: fired.append('x'), 'x')
+    instance.register(now + 0.05, lambda _: fired.append('a'), 'a')
+    instance.cancel(cancelled)
+
+    assert done.wait(2)
+    assert fired == ['a', 'b']
+    assert set(instance.report()) == {'a', 'b'}
+
+
+def test_scheduler_survives_failures():
+    instance = scheduler.Scheduler()
+    instance.register(time.time() + 0.02, lambda _: 1 / 0, 'broken')
+    # 回调失败后调度线程仍然可以触发后续的任务
+    assert instance.wait(time.time() + 0.05, 'next') < 0.02
@@ -0,0 +1,44 @@
+# _author: Coke
+# _date: 2023/10/22 16:20
+
+from subway import shard
+
+
+def users(*sizes: int) -> list:
+    """ 按组生成用户, 每组使用不同的站点 """
+    return [
+        dict(name=f'{group}-{index}', stationName=f'站{group}', timeSlot='0720-0730')
+        for group, size in enumerate(sizes) for index in range(size)
+    ]
+
+
+def groups(result: list) -> list:
+    """ 每个分片中的站点集合 """
+    return [{user['stationName'] for user in items} for items in result]
+
+
+def test_groups_kept_whole():
+    result = shard.partition(users(5, 3, 2), 3)
+    assert sorted(len(items) for items in result) == [2, 3, 5]
+    # 每个组只出现在一个分片中
+    assert all(len(item) == 1 for item in groups(result))
+
+
+def test_balanced():
+    result = shard.partition(users(3, 3, 2, 2, 1, 1), 2)
+    assert sorted(len(items) for items in result) == [6, 6]
+    assert sum(len(item) for item in groups(result)) == 6
+
+
+def test_large_group_split():
+    result = shard.partition(users(10, 2), 3)
+    assert len(result) == 3
+    assert max(len(items) for items in result) - min(len(items) for items in result) <= 2
+    assert sum(len(items) for items in result) == 12
+
+
+def test_weight():
+    items = users(2, 2, 2)
+    result = shard.partition(items, 2, weight=lambda user: 3 if user['stationName'] == '站0' else 1)
+    # 站0 的负载为 6, 其他两组共 4 , 分配到另一个分片
+    assert sorted(len(items) for items in result) == [2, 4]
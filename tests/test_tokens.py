@@ -0,0 +1,82 @@
+# _author: Coke
+# _date: 2023/10/23 21:30
+
+import json
+import time
+
+from subway import config, scheduler, server, tokens
+
+from conftest import LINE, SLOT, STATION
+
+
+def users(**expires) -> tuple:
+    """ 按 用户名称=过期时间戳 生成配置中的用户 """
+    content = json.dumps(dict(userAgent=[
+        dict(name=name, lineName=LINE, stationName=STATION, timeSlot=SLOT, token=server.make_token(name, expire))
+        for name, expire in expires.items()
+    ]))
+    return config.Config.parse(content).users
+
+
+class Notifier:
+
+    def __init__(self):
+        self.messages = []
+
+    def __call__(self, text: str, key: str):
+        self.messages.append((text, key))
+
+
+def test_expiring_then_expired():
+    notifier = Notifier()
+    registry = tokens.TokenRegistry(scheduler.Scheduler(), notifier, warning=2)
+    expire = int(time.time()) + 3
+    registry.update(users(a=expire))
+
+    time.sleep(1.5)
+    assert len(notifier.messages) == 1
+    assert notifier.messages[0][1].startswith(f'token-{tokens.EXPIRING}:a:')
+
+    time.sleep(expire - time.time() + 0.5)
+    assert len(notifier.messages) == 2
+    assert '已过期' in notifier.messages[1][0]
+    assert notifier.messages[1][1].startswith(f'token-{tokens.EXPIRED}:a:')
+    registry.clear()
+
+
+def test_already_expired():
+    notifier = Notifier()
+    registry = tokens.TokenRegistry(scheduler.Scheduler(), notifier)
+    registry.update(users(a=time.time() - 10))
+    time.sleep(0.3)
+
+    # 已经过期时只发送过期通知
+    assert [key.split(':')[0] for _, key in notifier.messages] == [f'token-{tokens.EXPIRED}']
+
+
+def test_update_keeps_unchanged_tokens():
+    notifier = Notifier()
+    _scheduler = scheduler.Scheduler()
+    registry = tokens.TokenRegistry(_scheduler, notifier)
+    expire = time.time() + 7 * 86400
+    registry.update(users(a=expire, b=expire))
+    entries = dict(registry._entries)
+
+    # Token 未变化的用户保留已注册的时刻, 更换 Token 及删除的用户取消已注册的时刻
+    registry.update(users(a=expire, c=expire + 60))
+    assert registry._entries['a'] is entries['a']
+    assert 'b' not in registry._entries and all(item[2] is None for item in entries['b'][1])
+    assert 'c' in registry._entries
+
+    registry.update(users(a=expire + 60, c=expire + 60))
+    assert registry._entries['a'] is not entries['a']
+    assert all(item[2] is None for item in entries['a'][1])
+    registry.clear()
+    assert not notifier.messages
+
+
+def test_key_changes_with_token():
+    a, = users(a=time.time() + 60)
+    b, = users(a=time.time() + 120)
+    assert tokens.key(a, tokens.EXPIRED) == tokens.key(a, tokens.EXPIRED)
+    assert tokens.key(a, tokens.EXPIRED) != tokens.key(b, tokens.EXPIRED)
@@ -0,0 +1,87 @@
+# _author: Coke
+# _date: 2023/10/24 21:35
+
+import asyncio
+import json
+import time
+
+import pytest
+from click.testing import CliRunner
+
+from subway import cli, trace
+
+from conftest import SLOT, STATION
+
+
+def test_tracer_events():
+    release = time.time()
+    tracer = trace.Tracer('a', release)
+    with tracer.span(trace.PRECHECK) as span:
+        span.outcome = 'absent'
+    with pytest.raises(KeyError):
+        with tracer.span(trace.VERIFY):
+            raise KeyError
+    tracer.request('/Appointment/CreateAppointment', time.monotonic(), 0.02, release + 0.01, 200, 'ok')
+    tracer.wake(release - 0.001)
+
+    precheck, verify, shakedown, wake = tracer.events
+    assert precheck['phase'] == trace.PRECHECK and precheck['outcome'] == 'absent'
+    # 异常退出的阶段以异常类型作为结果
+    assert verify['outcome'] == 'KeyError'
+    assert shakedown['phase'] == trace.SHAKEDOWN and shakedown['status'] == 200
+    assert shakedown['offset'] == pytest.approx(10, abs=0.01) and shakedown['latency'] == 20
+    assert wake['phase'] == trace.WAKE and wake['outcome'] == 'late'
+    assert all(item['user'] == 'a' for item in tracer.events)
+
+
+def test_lanes():
+    tracer = trace.Tracer('a', time.time())
+
+    async def request():
+        tracer.event(trace.BALANCE, time.monotonic(), 0.001)
+
+    async def main():
+        await asyncio.gather(request(), request())
+
+    asyncio.run(main())
+    # 并发的协程记录在不同的时间线上
+    assert tracer.events[0]['lane'] != tracer.events[1]['lane']
+
+
+def test_export(tmp_path):
+    release = time.time()
+    a, b = trace.Tracer('a', release), trace.Tracer('b', release)
+    a.request('/Appointment/GetBalance', time.monotonic(), 0.005, release - 0.1, 200, 'ok')
+    a.event(trace.RESULT, time.monotonic(), 0, wall=release + 0.2, outcome='success')
+    b.request('/Appointment/CreateAppointment', time.monotonic(), 0.03, release, None, 'timeout')
+
+    filename = trace.path(str(tmp_path), release)
+    assert trace.write(filename, a.events + b.events) == 3
+    assert trace.read(filename) == a.events + b.events
+
+    result = CliRunner().invoke(cli.command, ['trace', filename])
+    assert result.exit_code == 0, result.output
+    with open(filename.replace('.jsonl', '.trace.json'), encoding='utf-8') as file:
+        data = json.load(file)
+
+    events = data['traceEvents']
+    balance, done, shakedown = events[:3]
+    assert balance['ph'] == 'X' and balance['name'] == 'balance: ok'
+    assert balance['ts'] == pytest.approx(-100000, abs=10) and balance['dur'] == 5000
+    assert done['ph'] == 'i' and done['name'] == 'result: success'
+    assert shakedown['pid'] != balance['pid'] and shakedown['name'] == 'shakedown: timeout'
+    names = {item['args']['name'] for item in events if item['name'] == 'process_name'}
+    assert names == {'a', 'b'}
+    assert events[-1]['name'] == 'release' and events[-1]['ts'] == 0
+
+
+def test_grab_writes_trace(stand_in, subway, tmp_path):
+    stand_in.inventory[(STATION, SLOT)] = 5
+    instance = subway([dict(name='a')])
+    start_time = time.time() + 0.5
+    instance.write_trace(start_time, instance.start_task(start_time))
+
+    events = trace.read(trace.path(str(tmp_path / 'trace'), start_time))
+    phases = {item['phase'] for item in events}
+    assert {trace.SHAKEDOWN, trace.WAKE} <= phases
+    assert all(item['user'] == 'a' for item in events)
@@ -0,0 +1,105 @@
+# _author: Coke
+# _date: 2023/10/23 20:05
+
+import threading
+import json
+import time
+import os
+
+import pytest
+
+from subway import watcher
+
+from conftest import SLOT
+
+
+@pytest.fixture
+def watch(tmp_path):
+    """ 在后台线程中监听 tmp_path/conf.json, 返回 (文件路径, 回调次数列表, 启动函数) """
+    filename = tmp_path / 'conf.json'
+    filename.write_text('{}', encoding='utf-8')
+    calls = []
+    watchers = []
+
+    def start(**kwargs) -> watcher.Watcher:
+        instance = watcher.Watcher(str(filename), lambda: calls.append(time.time()), **kwargs)
+        threading.Thread(target=instance.run, daemon=True).start()
+        watchers.append(instance)
+        time.sleep(0.1)
+        return instance
+
+    yield filename, calls, start
+    for item in watchers:
+        item.stop()
+
+
+def test_debounce(watch):
+    filename, calls, start = watch
+    start(debounce=0.2)
+
+    # 连续多次写入只在最后一次写入 debounce 时间后通知一次
+    for index in range(5):
+        filename.write_text(json.dumps(dict(index=index)), encoding='utf-8')
+        time.sleep(0.05)
+    time.sleep(0.5)
+    assert len(calls) == 1
+
+    # 同一目录下的其他文件不会触发通知
+    (filename.parent / 'other.json').write_text('{}', encoding='utf-8')
+    time.sleep(0.4)
+    assert len(calls) == 1
+
+
+def test_atomic_replace(watch):
+    filename, calls, start = watch
+    start(debounce=0.1)
+
+    # 编辑器写入临时文件后重命名, 文件的 inode 会变化
+    temporary = filename.parent / 'conf.json.tmp'
+    temporary.write_text('{"a": 1}', encoding='utf-8')
+    os.replace(temporary, filename)
+    time.sleep(0.4)
+    assert len(calls) == 1
+
+
+def test_poll_fallback(watch, monkeypatch):
+    filename, calls, start = watch
+    monkeypatch.setattr(watcher, '_libc', lambda: None)
+    start(debounce=0.05, interval=0.05)
+
+    filename.write_text('{"changed": true}', encoding='utf-8')
+    time.sleep(0.4)
+    assert len(calls) == 1
+
+
+def test_stop(watch):
+    filename, calls, start = watch
+    instance = start()
+    instance.stop()
+    time.sleep(0.1)
+    filename.write_text('{"stopped": true}', encoding='utf-8')
+    time.sleep(0.5)
+    assert not calls
+
+
+def test_reload_changed_users(subway, tmp_path):
+    instance = subway([dict(name='a'), dict(name='b')])
+    instance.ticket[:] = ['a', 'b']
+    filename = tmp_path / 'conf.json'
+    content = json.loads(filename.read_text(encoding='utf-8'))
+
+    # 只有内容发生变化的用户需要重新抢票
+    content['userAgent'][1]['timeSlot'] = '0730-0740'
+    filename.write_text(json.dumps(content, ensure_ascii=False), encoding='utf-8')
+    instance._reload()
+    assert instance.ticket == ['a']
+    assert instance.config.user('b').slot == '0730-0740'
+    assert instance.config.user('a').slot == SLOT
+
+    # 校验失败的版本不会替换当前配置
+    version = instance.config
+    content['userAgent'][0]['burstPlan'] = dict(offsets=5)
+    filename.write_text(json.dumps(content, ensure_ascii=False), encoding='utf-8')
+    instance._reload()
+    assert instance.config is version
+    assert instance.loader.error is not None